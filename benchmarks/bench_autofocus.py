@@ -0,0 +1,174 @@
+"""
+Benchmark of the autofocus metrics and search strategies on a simulated microscope.
+
+Every combination of sharpness metric and search strategy focuses a SimulatedMicroscope from a set of
+random starting defocus offsets. Reports stage moves, captures, wall time, CPU time and the Z error of
+the final position against the known focal plane. Runs without a microscope:
+
+    python benchmarks/bench_autofocus.py --trials 5
+    python benchmarks/bench_autofocus.py --time-scale 0.2 --baseline old.json   # exit code 1 on regressions
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bench_utils import compare_results, environment, import_extension_module, write_results
+from simulated_microscope import SimulatedMicroscope, SimulatedStage, SimulatedCamera
+
+utils = import_extension_module("smartAutofocus", "utils")
+search = import_extension_module("smartAutofocus", "search")
+sweep = import_extension_module("smartAutofocus", "sweep")
+
+STRATEGIES = tuple(search.STRATEGIES) + ("sweep",)
+
+
+def central_roi(img: np.ndarray) -> np.ndarray:
+    """The central half of the frame, the default ROI of smart_autofocus."""
+    h, w = img.shape[:2]
+    return img[h // 4:h // 4 + h // 2, w // 4:w // 4 + w // 2]
+
+
+def run_autofocus(microscope: SimulatedMicroscope, strategy: str, metric_fn, args) -> float:
+    """Focus with one strategy, leaving the stage at the result. Returns the Z the strategy chose."""
+    stage, camera = microscope.stage, microscope.camera
+
+    def measure():
+        return metric_fn(central_roi(camera.array(use_video_port=True)))
+
+    if strategy == "sweep":
+        result = sweep.sweep_focus(stage, measure, args.coarse_range)
+        return result["peak"] if result["peak"] is not None else stage.position[2]
+    probe = search.FocusProbe(stage, measure, settle=args.settle * args.time_scale)
+    result = search.find_focus(
+        strategy,
+        probe,
+        coarse_range=args.coarse_range,
+        coarse_steps=args.coarse_steps,
+        fine_range=args.fine_range,
+        fine_steps=args.fine_steps,
+        tolerance=args.tolerance,
+        max_iterations=args.max_iterations,
+    )
+    return result["peak"]
+
+
+def make_cameras(offsets: list, args) -> list:
+    """One camera per trial; rendering the blur levels is slow, so they are shared by all combinations."""
+    return [
+        SimulatedCamera(
+            None,
+            shape=(args.height, args.width),
+            focus_z=offset,
+            depth_of_field=args.depth_of_field,
+            noise=args.noise,
+            frame_interval=args.frame_interval,
+            latency=args.latency,
+            seed=args.seed + trial,
+        )
+        for trial, offset in enumerate(offsets)
+    ]
+
+
+def run_trials(metric: str, strategy: str, cameras: list, args) -> dict:
+    metric_fn = utils.get_sharpness_function(metric, channel=args.channel, downsample=args.downsample)
+    errors, moves, captures, walls, cpus = [], [], [], [], []
+    for camera in cameras:
+        stage = SimulatedStage(speed=args.speed, move_overhead=args.move_overhead, play=args.play, time_scale=args.time_scale)
+        # The autofocus extension runs with set_properties(stage, backlash=256)
+        stage.backlash = args.backlash
+        camera.stage = stage
+        camera.captures = 0
+        microscope = SimulatedMicroscope(stage, camera)
+        offset = camera.focus_z
+        wall, cpu = time.perf_counter(), time.process_time()
+        run_autofocus(microscope, strategy, metric_fn, args)
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+        errors.append(abs(stage.optical_z() - offset))
+        moves.append(stage.moves)
+        captures.append(camera.captures)
+    return {
+        "metric": metric,
+        "strategy": strategy,
+        "trials": len(cameras),
+        "z_error_median": float(np.median(errors)),
+        "z_error_max": float(np.max(errors)),
+        "in_focus": float(np.mean(np.asarray(errors) <= args.depth_of_field)),
+        "moves": float(np.mean(moves)),
+        "captures": float(np.mean(captures)),
+        "wall": float(np.mean(walls)),
+        "cpu": float(np.mean(cpus)),
+        "metric_cost": utils.METRICS[metric].cost,
+    }
+
+
+def parse_names(text: str, known: tuple, parser, kind: str) -> list:
+    names = [name for name in text.split(",") if name]
+    for name in names:
+        if name not in known:
+            parser.error(f"Unknown {kind}: {name}")
+    return names
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--metrics", default=",".join(utils.METRICS), help=f"Metrics to run, from {', '.join(utils.METRICS)}")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help=f"Strategies to run, from {', '.join(STRATEGIES)}")
+    parser.add_argument("--trials", type=int, default=5, help="Starting offsets per combination")
+    parser.add_argument("--max-offset", type=float, default=300, help="Largest starting defocus (steps)")
+    parser.add_argument("--coarse-range", type=int, default=400)
+    parser.add_argument("--coarse-steps", type=int, default=5)
+    parser.add_argument("--fine-range", type=int, default=100)
+    parser.add_argument("--fine-steps", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=10)
+    parser.add_argument("--max-iterations", type=int, default=5)
+    parser.add_argument("--settle", type=float, default=0.1, help="Settle time after each move (seconds)")
+    parser.add_argument("--channel", default="mean")
+    parser.add_argument("--downsample", type=int, default=1)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--depth-of-field", type=float, default=40, help="Defocus per pixel of blur (steps)")
+    parser.add_argument("--noise", type=float, default=2.0, help="Sensor noise (grey levels)")
+    parser.add_argument("--speed", type=float, default=1000, help="Z speed (steps per second)")
+    parser.add_argument("--move-overhead", type=float, default=0.02, help="Fixed time per move (seconds)")
+    parser.add_argument("--play", type=int, default=30, help="Mechanical backlash of the Z axis (steps)")
+    parser.add_argument("--backlash", type=int, default=256, help="Backlash compensation of the stage (steps)")
+    parser.add_argument("--frame-interval", type=float, default=1 / 30, help="Time between video frames (seconds)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Frame delivery latency (seconds)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Factor on all simulated latencies and the settle time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_autofocus.json", help="Results file (JSON)")
+    parser.add_argument("--baseline", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance-time", type=float, default=0.2, help="Allowed slowdown against the baseline (fraction)")
+    args = parser.parse_args(argv)
+    metrics = parse_names(args.metrics, tuple(utils.METRICS), parser, "metric")
+    strategies = parse_names(args.strategies, STRATEGIES, parser, "strategy")
+
+    offsets = np.random.default_rng(args.seed).uniform(-args.max_offset, args.max_offset, args.trials).round().tolist()
+    cameras = make_cameras(offsets, args)
+    results = []
+    for metric in metrics:
+        for strategy in strategies:
+            result = run_trials(metric, strategy, cameras, args)
+            results.append(result)
+            print(
+                f"{metric:10s} {strategy:10s} error {result['z_error_median']:6.1f} (max {result['z_error_max']:6.1f})"
+                f"  moves {result['moves']:5.1f}  captures {result['captures']:5.1f}"
+                f"  wall {result['wall']:6.2f}s  cpu {result['cpu']:5.2f}s"
+            )
+
+    meta = {**environment(), "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}}
+    write_results(args.output, meta, results)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        regressions = compare_results(results, args.baseline, ("metric", "strategy"), "wall", args.tolerance_time)
+        for message in regressions:
+            print("Slower than baseline:", message)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
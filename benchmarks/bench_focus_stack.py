@@ -0,0 +1,213 @@
+"""
+Benchmark of the focus stacking pipeline on synthetic defocus stacks.
+
+Times the stages of the Laplacian pyramid fusion (sharpness, Laplacian pyramids, blend, reconstruct)
+and the fusion engines end to end across frame sizes, slice counts and pyramid depths, records their
+peak memory and scores the result against the known all-in-focus texture. Runs without a microscope:
+
+    python benchmarks/bench_focus_stack.py --sizes 1024x768 --slices 10,30 --levels 3,4,5
+    python benchmarks/bench_focus_stack.py --baseline old.json   # exit code 1 on speed regressions
+
+Every configuration is also checked for parity with the fusion before release 1.2.0 (legacy_fusion.py):
+weight_pyramid="laplacian" must reproduce it within 1 LSB, otherwise the exit code is 1. The difference
+of the default Gaussian weight pyramid is reported too; it changes the output on purpose.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import cv2
+
+from bench_utils import best_time, compare_results, environment, import_extension_module, peak_memory, write_results
+from legacy_fusion import fuse_legacy
+from synthetic import height_error, make_defocus_stack, psnr
+
+pyramid = import_extension_module("focusStack", "pyramid")
+pyramid_cache = import_extension_module("focusStack", "pyramid_cache")
+streaming_fusion = import_extension_module("focusStack", "streaming_fusion")
+stack_file = import_extension_module("focusStack", "stack_file")
+tiled_fusion = import_extension_module("focusStack", "tiled_fusion")
+depth_map = import_extension_module("focusStack", "depth_map")
+
+ENGINES = ("pyramid", "pyramid_cached", "streaming", "tiled", "depthmap")
+
+
+def stage_timings(frames: list, levels: int, weights_alpha: float, blur: int, repeat: int) -> dict:
+    """
+    Time the stages of fuse_lap_pyramid separately.
+
+    The colour pyramids of all slices are kept between stages here, so this needs more memory than
+    the fusion itself.
+    """
+    n = len(frames)
+    padded = [pyramid.pad_to_multiple(frame, 2 ** levels)[0] for frame in frames]
+
+    def sharpness():
+        weight_levels = None
+        for i, frame in enumerate(padded):
+            weights = pyramid.build_weight_pyramid(pyramid.sharpness_map(frame), levels)
+            if weight_levels is None:
+                weight_levels = [np.empty((n,) + w.shape, dtype=np.float32) for w in weights]
+            for level, w in enumerate(weights):
+                weight_levels[level][i] = w
+        return weight_levels
+
+    def lap_pyramids():
+        return [pyramid.build_lap_pyramid(frame.astype(np.float32), levels) for frame in padded]
+
+    t_sharpness, weight_levels = best_time(sharpness, repeat)
+    t_pyramids, pyramids = best_time(lap_pyramids, repeat)
+    sizes = pyramids[0][1]
+
+    def blend():
+        levels_copy = [w.copy() for w in weight_levels]
+        for weights in levels_copy:
+            for i in range(n):
+                cv2.GaussianBlur(weights[i], (blur, blur), 0, dst=weights[i])
+            pyramid.softmax_inplace(weights, alpha=weights_alpha)
+        fused = [np.zeros(lp.shape, dtype=np.float32) for lp in pyramids[0][0]]
+        for i, (lp, _) in enumerate(pyramids):
+            for level in range(levels + 1):
+                cv2.accumulateProduct(lp[level], cv2.merge([levels_copy[level][i]] * 3), fused[level])
+        return fused
+
+    t_blend, fused_pyramid = best_time(blend, repeat)
+    t_reconstruct, _ = best_time(lambda: np.clip(pyramid.reconstruct_from_lap_pyramid(fused_pyramid, sizes), 0, 255).astype(np.uint8), repeat)
+    return {
+        "sharpness": t_sharpness,
+        "lap_pyramid": t_pyramids,
+        "blend": t_blend,
+        "reconstruct": t_reconstruct,
+    }
+
+
+PARITY_TOLERANCE = 1  # LSB
+
+
+def parity(frames: list, levels: int, weights_alpha: float, blur: int) -> dict:
+    """Maximum and mean absolute difference (LSB) of both weight pyramids to the legacy fusion."""
+    legacy = fuse_legacy(frames, levels=levels, weights_alpha=weights_alpha, blur=blur).astype(np.int16)
+    result = {}
+    for weight_pyramid in ("laplacian", "gaussian"):
+        fused = pyramid.fuse_lap_pyramid(frames, levels=levels, weights_alpha=weights_alpha, blur=blur, weight_pyramid=weight_pyramid)
+        diff = np.abs(fused.astype(np.int16) - legacy)
+        result[weight_pyramid] = {"max": int(diff.max()), "mean": float(diff.mean())}
+    return result
+
+
+def run_engine(engine: str, frames: list, levels: int, weights_alpha: float, blur: int, workdir: str):
+    """
+    Build a callable fusing the stack with one engine.
+
+    Returns:
+        callable: Returns the fused image, or (composite, height map) for the depth map engine.
+    """
+    if engine == "pyramid":
+        return lambda: pyramid.fuse_lap_pyramid(frames, levels=levels, weights_alpha=weights_alpha, blur=blur)
+    if engine == "pyramid_cached":
+        # Re-fusion with a warm in-memory cache, as after changing weights_alpha or blur
+        cache = pyramid_cache.PyramidCache(None, memory_budget=2 ** 40)
+        keys = [pyramid_cache.PyramidCache.key(pyramid_cache.content_hash(f), levels) for f in frames]
+        pyramid.fuse_lap_pyramid(frames, levels=levels, cache=cache, keys=keys)
+        return lambda: pyramid.fuse_lap_pyramid(frames, levels=levels, weights_alpha=weights_alpha, blur=blur, cache=cache, keys=keys)
+    if engine == "streaming":
+        def streaming():
+            fuser = streaming_fusion.StreamingPyramidFuser(levels=levels, weights_alpha=weights_alpha, blur=blur)
+            for frame in frames:
+                fuser.add(frame)
+            return fuser.result()
+        return streaming
+    if engine == "tiled":
+        if not os.path.exists(os.path.join(workdir, stack_file.STACK_FILE_NAME)):
+            with stack_file.StackFileWriter(os.path.join(workdir, stack_file.STACK_FILE_NAME)) as writer:
+                for z, frame in enumerate(frames):
+                    writer.append(frame, {"z": z})
+        return lambda: tiled_fusion.fuse_stack_tiled(workdir, levels=levels, weights_alpha=weights_alpha, blur=blur)[0]
+    if engine == "depthmap":
+        def depthmap():
+            fuser = depth_map.DepthMapFuser(focus_blur=blur)
+            for frame in frames:
+                fuser.add(frame)
+            # Z in hundredths of a slice, so the integer height map keeps sub-slice precision
+            composite, height, _ = fuser.result([100 * z for z in range(len(frames))])
+            return composite, height / 100.0
+        return depthmap
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def parse_sizes(text: str) -> list:
+    return [tuple(int(v) for v in size.lower().split("x")) for size in text.split(",")]
+
+
+def parse_ints(text: str) -> list:
+    return [int(v) for v in text.split(",")]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("640x480,1024x768"), help="Frame sizes as WxH, comma separated")
+    parser.add_argument("--slices", type=parse_ints, default=[10, 30], help="Slice counts, comma separated")
+    parser.add_argument("--levels", type=parse_ints, default=[4], help="Pyramid depths, comma separated")
+    parser.add_argument("--engines", default=",".join(ENGINES), help=f"Engines to run, from {', '.join(ENGINES)}")
+    parser.add_argument("--weights-alpha", type=float, default=5)
+    parser.add_argument("--blur", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest counts")
+    parser.add_argument("--no-stages", action="store_true", help="Skip the per-stage timings")
+    parser.add_argument("--no-parity", action="store_true", help="Skip the parity check against the legacy fusion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_focus_stack.json", help="Results file (JSON)")
+    parser.add_argument("--baseline", help="Earlier results file to check for speed regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (fraction)")
+    args = parser.parse_args(argv)
+    engines = [e for e in args.engines.split(",") if e]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"Unknown engine: {engine}")
+
+    results = []
+    parity_failures = []
+    for width, height in args.sizes:
+        for slices in args.slices:
+            texture, surface, frames = make_defocus_stack(height, width, slices, seed=args.seed)
+            with tempfile.TemporaryDirectory() as workdir:
+                for levels in args.levels:
+                    config = {"width": width, "height": height, "slices": slices, "levels": levels}
+                    if not args.no_parity:
+                        differences = parity(frames, levels, args.weights_alpha, args.blur)
+                        results.append({**config, "engine": "parity", **differences})
+                        print(config, "parity", differences)
+                        if differences["laplacian"]["max"] > PARITY_TOLERANCE:
+                            parity_failures.append(f"{config}: {differences['laplacian']['max']} LSB")
+                    if not args.no_stages:
+                        stages = stage_timings(frames, levels, args.weights_alpha, args.blur, args.repeat)
+                        results.append({**config, "engine": "stages", "stages": stages, "time": sum(stages.values())})
+                        print(config, "stages", {k: round(v, 4) for k, v in stages.items()})
+                    for engine in engines:
+                        run = run_engine(engine, frames, levels, args.weights_alpha, args.blur, workdir)
+                        elapsed, output = best_time(run, args.repeat)
+                        result = {**config, "engine": engine, "time": elapsed, "peak_memory": peak_memory(run)}
+                        if engine == "depthmap":
+                            output, estimate = output
+                            result["height_error"] = height_error(estimate, surface)
+                        result["psnr"] = psnr(output, texture)
+                        results.append(result)
+                        print(config, engine, f"{elapsed:.4f}s", f"{result['peak_memory'] / 2 ** 20:.0f} MiB", f"{result['psnr']:.2f} dB")
+
+    write_results(args.output, environment(), results)
+    print(f"Results written to {args.output}")
+    for message in parity_failures:
+        print('weight_pyramid="laplacian" differs from the legacy fusion:', message)
+    if parity_failures:
+        return 1
+    if args.baseline:
+        regressions = compare_results(results, args.baseline, ("width", "height", "slices", "levels", "engine"), "time", args.tolerance)
+        for message in regressions:
+            print("Slower than baseline:", message)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import types
+
+EXTENSIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extensions")
+
+
+def load_extension(name: str) -> types.ModuleType:
+    """
+    Make the modules of an extension package importable without running its __init__.
+
+    The extension packages import LabThings and the OpenFlexure server on import; the benchmarks only
+    need the pure processing modules, so the package is registered as an empty namespace instead.
+    Afterwards e.g. `importlib.import_module("focusStack.pyramid")` works on a laptop.
+    """
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.join(EXTENSIONS_DIR, name)]
+        sys.modules[name] = package
+    return sys.modules[name]
+
+
+def import_extension_module(package: str, module: str) -> types.ModuleType:
+    load_extension(package)
+    return importlib.import_module(f"{package}.{module}")
+
+
+def best_time(func, repeat: int = 3):
+    """
+    Run func `repeat` times.
+
+    Returns:
+        tuple: Fastest wall time in seconds and the result of the last call.
+    """
+    best, result = float("inf"), None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func):
+    """
+    Peak Python heap allocation (bytes) while running func. NumPy and OpenCV arrays are included,
+    memory of child processes is not.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def environment() -> dict:
+    import numpy as np
+    import cv2
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(path: str, meta: dict, results: list):
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+def compare_results(results: list, baseline_path: str, key_fields: tuple, time_field: str, tolerance: float) -> list:
+    """
+    Find runs that got slower than in a baseline results file.
+
+    Returns:
+        list of str: One message per run slower than (1 + tolerance) times its baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = {tuple(r[k] for k in key_fields): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        key = tuple(result[k] for k in key_fields)
+        base = baseline.get(key)
+        if base and base.get(time_field) and result[time_field] > base[time_field] * (1 + tolerance):
+            regressions.append(f"{dict(zip(key_fields, key))}: {result[time_field]:.4f}s vs {base[time_field]:.4f}s")
+    return regressions
@@ -0,0 +1,94 @@
+"""
+Laplacian pyramid fusion as it was before the float32 rewrite of focusStack/pyramid.py (release 1.1.x).
+
+Kept as the reference for the parity check of bench_focus_stack.py: fuse_lap_pyramid with
+weight_pyramid="laplacian" must reproduce it within 1 LSB. The image loading of the old action is
+replaced by a list of frames, the maths is unchanged.
+"""
+import numpy as np
+import cv2
+
+
+def softmax(x, axis=0, alpha=1.0):
+    x_max = np.max(x, axis=axis, keepdims=True)
+    e_x = np.exp(alpha * (x - x_max))
+    return e_x / np.sum(e_x, axis=axis, keepdims=True)
+
+
+def pad_to_multiple(img, divisor):
+    h, w = img.shape[:2]
+    pad_h = (divisor - (h % divisor)) % divisor
+    pad_w = (divisor - (w % divisor)) % divisor
+    return cv2.copyMakeBorder(img, 0, int(pad_h), 0, int(pad_w), borderType=cv2.BORDER_REFLECT), h, w
+
+
+def build_lap_pyramid(img, levels):
+    G = img.copy()
+    gp = [G]
+    sizes = [G.shape[:2]]
+    for i in range(levels):
+        G = cv2.pyrDown(G)
+        gp.append(G)
+        sizes.append(G.shape[:2])
+
+    lp = []
+    for i in range(levels):
+        GE = cv2.pyrUp(gp[i + 1], dstsize=(gp[i].shape[1], gp[i].shape[0]))
+        lp.append(cv2.subtract(gp[i], GE))
+    lp.append(gp[-1])
+    return lp, sizes
+
+
+def reconstruct_from_lap_pyramid(lp, sizes):
+    img = lp[-1]
+    for i in range(len(lp) - 2, -1, -1):
+        shape = sizes[i]
+        img = cv2.pyrUp(img)
+        img = img[:shape[0], :shape[1], ...]
+        L = lp[i][:shape[0], :shape[1], ...]
+        if img.dtype != L.dtype:
+            img = img.astype(np.float32)
+            L = L.astype(np.float32)
+        img = cv2.add(img, L)
+    return img
+
+
+def fuse_legacy(frames: list, levels: int = 4, weights_alpha: float = 5, blur: int = 5) -> np.ndarray:
+    """Fuse BGR uint8 frames the way fuse_stack_lap_pyramid did before release 1.2.0."""
+    tmp_imgs = []
+    orig_h, orig_w = None, None
+    max_h, max_w = 0, 0
+    for img in frames:
+        img, h, w = pad_to_multiple(img, 2 ** levels)
+        tmp_imgs.append(img)
+        max_h, max_w = max(max_h, img.shape[0]), max(max_w, img.shape[1])
+        if orig_h is None:
+            orig_h, orig_w = h, w
+    imgs = [
+        cv2.copyMakeBorder(img, 0, max_h - img.shape[0], 0, max_w - img.shape[1], borderType=cv2.BORDER_REFLECT).astype(np.float32)
+        for img in tmp_imgs
+    ]
+
+    pyramids_with_sizes = [build_lap_pyramid(img, levels) for img in imgs]
+    pyramids = [x[0] for x in pyramids_with_sizes]
+    sizes = pyramids_with_sizes[0][1]
+
+    sharpness_masks = []
+    for img in imgs:
+        img_gray = cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_BGR2GRAY)
+        lap = cv2.Laplacian(img_gray, cv2.CV_64F)
+        sobel = cv2.Sobel(img_gray, cv2.CV_64F, 1, 1, ksize=3)
+        sharpness_masks.append(np.abs(np.abs(lap) + 0.5 * np.abs(sobel)))
+    sharpness_pyramids = [build_lap_pyramid(mask.astype(np.float32), levels)[0] for mask in sharpness_masks]
+
+    fused_pyramid = []
+    for level in range(levels + 1):
+        target_shape = sizes[level]
+        level_stack = np.stack([p[level][:target_shape[0], :target_shape[1], ...] for p in pyramids], axis=0)
+        level_sharp = [p[level][:target_shape[0], :target_shape[1]] for p in sharpness_pyramids]
+        level_sharp = np.stack([cv2.GaussianBlur(s, (blur, blur), 0) for s in level_sharp], axis=0)
+        weights = softmax(level_sharp, axis=0, alpha=weights_alpha)
+        fused_pyramid.append(np.sum(weights[..., None] * level_stack, axis=0))
+
+    fused = reconstruct_from_lap_pyramid(fused_pyramid, sizes)
+    return np.clip(fused, 0, 255).astype(np.uint8)[:orig_h, :orig_w]
@@ -0,0 +1,218 @@
+"""
+Stand-ins for the parts of the OpenFlexure Microscope, BaseStage and BaseCamera interfaces used by the
+autofocus code, so it can be run and timed without hardware.
+"""
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import cv2
+
+from synthetic import make_texture
+
+
+class SimulatedLock:
+    """Re-entrant lock accepting the keyword arguments of the LabThings StrictLock."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def acquire(self, blocking: bool = True, timeout=None, _strict: bool = True) -> bool:
+        if not blocking:
+            return self._lock.acquire(blocking=False)
+        return self._lock.acquire(timeout=-1 if timeout is None else timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SimulatedStage:
+    """
+    Stage with a motion model and mechanical backlash.
+
+    Moves take `move_overhead` plus the distance divided by the axis speed, during which the optical
+    Z is interpolated linearly (see optical_z), so continuous sweeps can be simulated. The Z axis has
+    `play` steps of lost motion: after a downward move the optics lag `play` steps above the commanded
+    position. Setting `backlash` (as set_properties(stage, backlash=...) does on the real stage) makes
+    every downward move overshoot by that much and come back up, which removes the error if backlash >= play.
+    """
+
+    def __init__(self, speed: float = 1000, move_overhead: float = 0.02, play: int = 30, time_scale: float = 1.0):
+        """
+        Args:
+            speed (float): Axis speed (steps per second).
+            move_overhead (float): Fixed time per move, e.g. for serial communication (seconds).
+            play (int): Mechanical backlash of the Z axis (steps).
+            time_scale (float): Factor applied to all simulated latencies, < 1 for faster runs.
+        """
+        self.speed = speed
+        self.move_overhead = move_overhead
+        self.play = play
+        self.time_scale = time_scale
+        self.backlash = 0
+        self.lock = SimulatedLock()
+        self.moves = 0
+        self._position = [0, 0, 0]
+        self._offset = 0.0
+        # Optical Z trajectory of the last move: (start time, start Z, end time, end Z)
+        self._motion = (0.0, 0.0, 0.0, 0.0)
+
+    @property
+    def position(self):
+        return list(self._position)
+
+    def _travel(self, z_from: float, z_to: float):
+        duration = (self.move_overhead + abs(z_to - z_from) / self.speed) * self.time_scale
+        start = time.monotonic()
+        self._motion = (start + self.move_overhead * self.time_scale, z_from, start + duration, z_to)
+        time.sleep(duration)
+
+    def _move_z(self, dz: int):
+        z = self._position[2]
+        target = z + dz
+        optical = z + self._offset
+        if dz < 0 and self.backlash:
+            # Overshoot and approach from below
+            self._travel(optical, target - self.backlash)
+            self._travel(target - self.backlash, target)
+            self._offset = 0.0
+        elif dz < 0:
+            self._offset = float(self.play)
+            self._travel(optical, target + self._offset)
+        elif dz > 0:
+            # Moving up takes up the play first
+            self._travel(optical, target)
+            self._offset = 0.0
+        self._position[2] = target
+
+    def move_rel(self, displacement, **kwargs):
+        self.moves += 1
+        dx, dy, dz = (int(v) for v in displacement)
+        if dx or dy:
+            time.sleep((self.move_overhead + max(abs(dx), abs(dy)) / self.speed) * self.time_scale)
+            self._position[0] += dx
+            self._position[1] += dy
+        if dz:
+            self._move_z(dz)
+
+    def move_abs(self, final, **kwargs):
+        self.move_rel([int(f) - p for f, p in zip(final, self._position)])
+
+    def scan_z(self, dz, return_to_start: bool = True):
+        """Move to each Z offset relative to the starting position, yielding after every move."""
+        start = self._position[2]
+        for offset in dz:
+            self.move_rel((0, 0, int(start + offset) - self._position[2]))
+            yield
+        if return_to_start:
+            self.move_rel((0, 0, start - self._position[2]))
+
+    def optical_z(self, t: Optional[float] = None) -> float:
+        """Actual Z of the optics at time t (default now), including backlash and moves in progress."""
+        t = time.monotonic() if t is None else t
+        t0, z0, t1, z1 = self._motion
+        if t >= t1:
+            return z1
+        if t <= t0:
+            return z0
+        return z0 + (t - t0) / (t1 - t0) * (z1 - z0)
+
+
+class SimulatedCamera:
+    """
+    Camera imaging a textured sample through a lens with a limited depth of field.
+
+    The sharp texture is blurred with a Gaussian whose sigma grows with the distance of the optical Z
+    from the focal plane, then sensor noise is added. The focal plane may be tilted, in which case the
+    blur varies across the frame. Video port frames arrive every `frame_interval`: a grab waits for the
+    next frame to be exposed and then for `latency` until it is delivered, and the frame shows the sample
+    at the Z it had during exposure.
+    """
+
+    def __init__(
+        self,
+        stage: SimulatedStage,
+        shape: Tuple[int, int] = (480, 640),
+        focus_z: float = 0,
+        tilt: Tuple[float, float] = (0.0, 0.0),
+        depth_of_field: float = 40,
+        max_sigma: float = 8.0,
+        noise: float = 2.0,
+        frame_interval: float = 1 / 30,
+        latency: float = 0.01,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            stage (SimulatedStage): Stage moving the sample; may be replaced later, e.g. to reuse the rendered blur levels.
+            shape (tuple): Frame (height, width).
+            focus_z (float): Z of the focal plane at the frame centre (steps).
+            tilt (tuple): Slope of the focal plane in x and y (steps per pixel).
+            depth_of_field (float): Defocus (steps) that adds one pixel of blur sigma.
+            max_sigma (float): Largest blur sigma (pixels).
+            noise (float): Standard deviation of the sensor noise (grey levels).
+            frame_interval (float): Time between video frames (seconds).
+            latency (float): Delay between the end of the exposure and delivery of a frame (seconds).
+            seed (int): Random seed of the texture and the noise.
+        """
+        self.stage = stage
+        self.shape = shape
+        self.focus_z = focus_z
+        self.tilt = tilt
+        self.depth_of_field = depth_of_field
+        self.max_sigma = max_sigma
+        self.noise = noise
+        self.frame_interval = frame_interval
+        self.latency = latency
+        self.lock = SimulatedLock()
+        self.captures = 0
+        self._rng = np.random.default_rng(seed + 1)
+        texture = make_texture(*shape, seed=seed).astype(np.float32)
+        self._sigmas = np.linspace(0, max_sigma, 17)
+        self._blurred = np.stack([texture if s == 0 else cv2.GaussianBlur(texture, (0, 0), s) for s in self._sigmas])
+        yy, xx = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+        self._plane_offset = tilt[0] * (xx - shape[1] / 2) + tilt[1] * (yy - shape[0] / 2)
+
+    def _render(self, z: float) -> np.ndarray:
+        defocus = np.abs(z - self.focus_z - self._plane_offset) if any(self.tilt) else np.float32(abs(z - self.focus_z))
+        idx = np.minimum(defocus / self.depth_of_field, self.max_sigma) / (self._sigmas[1] - self._sigmas[0])
+        lo = np.minimum(np.asarray(idx).astype(np.int64), len(self._sigmas) - 2)
+        frac = idx - lo
+        if np.ndim(lo) == 0:
+            frame = self._blurred[lo] * (1 - frac) + self._blurred[lo + 1] * frac
+        else:
+            rows, cols = np.indices(lo.shape)
+            frac = frac[..., None]
+            frame = self._blurred[lo, rows, cols] * (1 - frac) + self._blurred[lo + 1, rows, cols] * frac
+        frame += self._rng.normal(0, self.noise, frame.shape).astype(np.float32)
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+    def array(self, use_video_port: bool = True) -> np.ndarray:
+        scale = self.stage.time_scale
+        now = time.monotonic()
+        interval = self.frame_interval * scale
+        # Wait for the frame being exposed now to finish, then for its delivery
+        exposure_end = (now // interval + 1) * interval
+        z = self.stage.optical_z(exposure_end - interval / 2)
+        time.sleep(exposure_end - now + self.latency * scale)
+        self.captures += 1
+        return self._render(z)
+
+
+class SimulatedMicroscope:
+    """Microscope with a SimulatedStage and a SimulatedCamera."""
+
+    def __init__(self, stage: Optional[SimulatedStage] = None, camera: Optional[SimulatedCamera] = None, **camera_kwargs):
+        self.stage = stage or SimulatedStage()
+        self.camera = camera or SimulatedCamera(self.stage, **camera_kwargs)
+
+    def has_real_stage(self) -> bool:
+        return True
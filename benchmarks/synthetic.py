@@ -0,0 +1,71 @@
+import numpy as np
+import cv2
+
+
+def make_texture(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """Sharp random texture with detail at several scales (uint8, BGR)."""
+    rng = np.random.default_rng(seed)
+    texture = np.zeros((height, width, 3), dtype=np.float32)
+    for scale, amplitude in ((16, 0.5), (4, 0.3), (1, 0.2)):
+        noise = rng.random((max(1, height // scale), max(1, width // scale), 3)).astype(np.float32)
+        texture += amplitude * cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    return np.clip(texture * 255, 0, 255).astype(np.uint8)
+
+
+def make_height_field(height: int, width: int, slices: int) -> np.ndarray:
+    """Smooth height field in slice units spanning most of the stack (float32)."""
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    relief = 0.5 + 0.4 * np.sin(xx / width * 3) * np.cos(yy / height * 2)
+    return (slices - 1) * relief
+
+
+def make_defocus_stack(height: int = 768, width: int = 1024, slices: int = 30, blur_per_slice: float = 1.0, max_sigma: float = 8.0, noise: float = 2.0, seed: int = 0):
+    """
+    Synthetic Z-stack of a sharp texture on a known height field.
+
+    Every slice is blurred per pixel with a Gaussian whose sigma grows with the distance between the
+    slice and the surface height at that pixel, then sensor noise is added. The blur is interpolated
+    between a few precomputed sigma levels.
+
+    Args:
+        height (int): Frame height.
+        width (int): Frame width.
+        slices (int): Number of Z slices.
+        blur_per_slice (float): Gaussian sigma per slice of defocus.
+        max_sigma (float): Largest sigma.
+        noise (float): Standard deviation of the additive noise (grey levels).
+        seed (int): Random seed.
+
+    Returns:
+        tuple:
+            - np.ndarray: Ground-truth all-in-focus texture (uint8, BGR).
+            - np.ndarray: Height field in slice units (float32).
+            - list of np.ndarray: Stack frames (uint8, BGR).
+    """
+    rng = np.random.default_rng(seed + 1)
+    texture = make_texture(height, width, seed)
+    surface = make_height_field(height, width, slices)
+    sigmas = np.linspace(0, max_sigma, 9)
+    blurred = np.stack([texture.astype(np.float32) if s == 0 else cv2.GaussianBlur(texture, (0, 0), s).astype(np.float32) for s in sigmas])
+    frames = []
+    for z in range(slices):
+        sigma = np.minimum(np.abs(surface - z) * blur_per_slice, max_sigma)
+        idx = sigma / (sigmas[1] - sigmas[0])
+        lo = np.minimum(idx.astype(np.int64), len(sigmas) - 2)
+        frac = (idx - lo)[..., None]
+        rows, cols = np.indices(lo.shape)
+        frame = blurred[lo, rows, cols] * (1 - frac) + blurred[lo + 1, rows, cols] * frac
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return texture, surface, frames
+
+
+def psnr(image: np.ndarray, reference: np.ndarray) -> float:
+    """Peak signal-to-noise ratio (dB) of an 8-bit image against a reference."""
+    mse = np.mean((image.astype(np.float32) - reference.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+
+def height_error(estimate: np.ndarray, surface: np.ndarray) -> float:
+    """Median absolute error (slices) of an estimated height map."""
+    return float(np.median(np.abs(estimate.astype(np.float32) - surface)))
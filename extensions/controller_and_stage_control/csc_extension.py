@@ -1,12 +1,14 @@
 import threading
 
-from labthings import Schema, fields
+from labthings import Schema, fields, find_extension
 from labthings.extensions import BaseExtension
 from labthings.views import PropertyView
 
+from .focus_lock import FocusLock
 from .logger import logger as base_logger
 from .serial_listener import serial_listener
 from .stage_controller import StageController
+from .telemetry import StagePublisher
 from .websocket_server import WebsocketServer
 
 logger = base_logger.getChild(__name__)
@@ -21,6 +23,8 @@ class CSCExtension(BaseExtension):
         )
 
         self.add_view(JoystickStangeControlView, "/joystick-stage-control")
+        self.add_view(FocusLockView, "/focus-lock")
+        self.add_view(TelemetryView, "/telemetry")
 
         self.on_component("org.openflexure.microscope", self.register)
 
@@ -30,10 +34,18 @@ class CSCExtension(BaseExtension):
         self.stage_controller.start_thread()
         logger.info(f"Started stage controller")
 
+        self.focus_lock = FocusLock(microscope_object, self.stage_controller)
+        self.focus_lock.start_thread()
+        logger.info(f"Started focus lock (disabled)")
+
         self.websocket_server = WebsocketServer(self.stage_controller)
         self.websocket_server.run()
         logger.info(f"Started websocket server")
 
+        self.stage_publisher = StagePublisher(microscope_object, self.websocket_server)
+        self.stage_publisher.start_thread()
+        logger.info(f"Started stage position publisher")
+
         self.serial_listener = threading.Thread(
             target=serial_listener,
             args=(self.websocket_server,),
@@ -63,3 +75,84 @@ class JoystickStangeControlView(PropertyView):
 
     def get(self):
         return {"joystick_stage_control": True}
+
+
+class FocusLockSchema(Schema):
+    enabled = fields.Boolean()
+    state = fields.String(dump_only=True)
+    corrections = fields.Integer(dump_only=True)
+    step = fields.Integer()
+    settle = fields.Float()
+    idle_delay = fields.Float()
+    duty_cycle = fields.Float()
+    cpu_budget = fields.Float()
+    roi_size = fields.Integer()
+
+
+class FocusLockView(PropertyView):
+    """Background focus correction between joystick moves"""
+
+    schema = FocusLockSchema()
+
+    args = {
+        "enabled": fields.Boolean(metadata={"example": True}),
+        "step": fields.Integer(metadata={"example": 25}),
+        "settle": fields.Float(metadata={"example": 0.15}),
+        "idle_delay": fields.Float(metadata={"example": 0.5}),
+        "duty_cycle": fields.Float(metadata={"example": 0.3}),
+        "cpu_budget": fields.Float(metadata={"example": 0.1}),
+        "roi_size": fields.Integer(metadata={"example": 128}),
+    }
+
+    @staticmethod
+    def _focus_lock():
+        return find_extension("de.hs-flensburg.controller-and-stage-control").focus_lock
+
+    def post(self, args):
+        focus_lock = self._focus_lock()
+        for key in ("step", "settle", "idle_delay", "duty_cycle", "cpu_budget", "roi_size"):
+            if key in args:
+                setattr(focus_lock, key, args[key])
+        if "enabled" in args and args["enabled"] != focus_lock.enabled:
+            if args["enabled"]:
+                focus_lock.enable()
+            else:
+                focus_lock.disable()
+        return focus_lock.settings()
+
+    def get(self):
+        return self._focus_lock().settings()
+
+
+class TelemetrySchema(Schema):
+    rate = fields.Float()
+    min_delta = fields.Integer()
+    keepalive = fields.Float()
+    sent = fields.Integer(dump_only=True)
+    suppressed = fields.Integer(dump_only=True)
+
+
+class TelemetryView(PropertyView):
+    """Stage position updates pushed to websocket clients subscribed to the "stage" topic"""
+
+    schema = TelemetrySchema()
+
+    args = {
+        "rate": fields.Float(metadata={"example": 10.0}),
+        "min_delta": fields.Integer(metadata={"example": 1}),
+        "keepalive": fields.Float(metadata={"example": 5.0}),
+    }
+
+    @staticmethod
+    def _stage_publisher():
+        return find_extension("de.hs-flensburg.controller-and-stage-control").stage_publisher
+
+    def post(self, args):
+        stage_publisher = self._stage_publisher()
+        for key in ("rate", "min_delta", "keepalive"):
+            if key in args:
+                setattr(stage_publisher, key, args[key])
+        return stage_publisher.settings()
+
+    def get(self):
+        return self._stage_publisher().settings()
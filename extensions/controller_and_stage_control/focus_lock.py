@@ -0,0 +1,207 @@
+import threading
+import time
+
+import cv2
+
+from .logger import logger as base_logger
+from .stage_controller import StageController
+
+logger = base_logger.getChild(__name__)
+
+
+class FocusLock:
+    """Keeps the sample in focus while the user navigates with the joystick. Between XY moves it hill-climbs
+    the focus with small Z steps, judged by a cheap sharpness metric on a small ROI of the video port frames.
+
+    The lock never waits for the stage or camera: whenever the joystick, an action or another thread holds
+    one of their locks, the current step is skipped. Its share of stage time (duty cycle) and of one CPU
+    core (CPU budget) are limited by pausing between steps.
+    """
+
+    def __init__(
+        self,
+        microscope_object,
+        stage_controller: StageController,
+        step: int = 25,
+        settle: float = 0.15,
+        idle_delay: float = 0.5,
+        duty_cycle: float = 0.3,
+        cpu_budget: float = 0.1,
+        roi_size: int = 128,
+        min_gain: float = 0.02,
+        relock_drop: float = 0.15,
+    ):
+        """
+        :param step: Z step of a single correction (stage steps)
+        :param settle: Wait after a Z step before the frame is grabbed (seconds)
+        :param idle_delay: Time without XY movement before corrections start (seconds)
+        :param duty_cycle: Maximum fraction of time the lock may occupy stage and camera
+        :param cpu_budget: Maximum fraction of one CPU core spent on the metric
+        :param roi_size: Edge of the central ROI the metric is computed on (pixels)
+        :param min_gain: Relative sharpness gain a step must bring to be kept
+        :param relock_drop: Relative sharpness drop after which a locked focus is corrected again
+        """
+        self.microscope = microscope_object
+        self.stage_controller = stage_controller
+        self.step = step
+        self.settle = settle
+        self.idle_delay = idle_delay
+        self.duty_cycle = duty_cycle
+        self.cpu_budget = cpu_budget
+        self.roi_size = roi_size
+        self.min_gain = min_gain
+        self.relock_drop = relock_drop
+
+        self.thread = None
+        self._enabled = threading.Event()
+        self.state = "disabled"
+        self.corrections = 0
+        self._reset()
+
+    def _reset(self):
+        self._reference = None
+        self._direction = 1
+        self._failures = 0
+        self._locked_value = None
+        self._last_xy = None
+        self._last_move = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled.is_set()
+
+    def enable(self):
+        self._reset()
+        self.state = "waiting"
+        self._enabled.set()
+
+    def disable(self):
+        self._enabled.clear()
+        self.state = "disabled"
+
+    def settings(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "corrections": self.corrections,
+            "step": self.step,
+            "settle": self.settle,
+            "idle_delay": self.idle_delay,
+            "duty_cycle": self.duty_cycle,
+            "cpu_budget": self.cpu_budget,
+            "roi_size": self.roi_size,
+        }
+
+    def measure(self) -> float:
+        """Variance of the Laplacian of the green channel in a central ROI of a video port frame."""
+        img = self.microscope.camera.array(use_video_port=True)
+        h, w = img.shape[:2]
+        half = self.roi_size // 2
+        roi = img[max(h // 2 - half, 0):h // 2 + half, max(w // 2 - half, 0):w // 2 + half, 1]
+        return float(cv2.Laplacian(roi, cv2.CV_32F).var())
+
+    def _moved(self) -> bool:
+        """True while the joystick is deflected or the stage has moved in XY since the last check."""
+        if self.stage_controller.current_direction != (0, 0):
+            if self.stage_controller.focus_axis:
+                # The user focuses by hand: start over from the new Z
+                self._reference = None
+                self._locked_value = None
+            self._last_move = time.monotonic()
+            return True
+        xy = tuple(self.microscope.stage.position[:2])
+        if xy != self._last_xy:
+            self._last_xy = xy
+            self._last_move = time.monotonic()
+            self._reference = None
+            self._locked_value = None
+            return True
+        return time.monotonic() - self._last_move < self.idle_delay
+
+    def _try_lock(self):
+        """Acquire stage and camera lock without waiting. Returns the acquired locks, or None if busy."""
+        acquired = []
+        for lock in (self.microscope.stage.lock, self.microscope.camera.lock):
+            if not lock.acquire(blocking=False, timeout=None, _strict=False):
+                for held in reversed(acquired):
+                    held.release()
+                return None
+            acquired.append(lock)
+        return acquired
+
+    def _correct(self) -> float:
+        """Run one hill-climbing step. Returns the CPU time of this thread spent computing the metric
+        (process time would also count the server threads, which are not ours to budget)."""
+        stage = self.microscope.stage
+        compute = 0.0
+        if self._reference is None:
+            start = time.thread_time()
+            self._reference = self.measure()
+            compute += time.thread_time() - start
+            self._failures = 0
+        if self._locked_value is not None:
+            # Locked: only watch for the focus drifting away
+            start = time.thread_time()
+            value = self.measure()
+            compute += time.thread_time() - start
+            if value < (1 - self.relock_drop) * self._locked_value:
+                self._locked_value = None
+                self._reference = value
+                self.state = "tracking"
+            return compute
+
+        self.state = "tracking"
+        dz = self._direction * self.step
+        stage.move_rel((0, 0, dz))
+        time.sleep(self.settle)
+        start = time.thread_time()
+        value = self.measure()
+        compute += time.thread_time() - start
+        if value > (1 + self.min_gain) * self._reference:
+            self._reference = value
+            self._failures = 0
+            self.corrections += 1
+        else:
+            # No improvement: step back and try the other direction next time
+            stage.move_rel((0, 0, -dz))
+            self._direction = -self._direction
+            self._failures += 1
+            if self._failures >= 2:
+                self._locked_value = self._reference
+                self.state = "locked"
+        return compute
+
+    def run(self):
+        while True:
+            self._enabled.wait()
+            if self._moved():
+                self.state = "waiting"
+                time.sleep(0.05)
+                continue
+            locks = self._try_lock()
+            if locks is None:
+                time.sleep(0.05)
+                continue
+            start = time.monotonic()
+            try:
+                compute = self._correct()
+            except Exception:
+                logger.exception("Focus lock step failed")
+                compute = 0.0
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+            busy = time.monotonic() - start
+            # Pause long enough to stay within the duty cycle and the CPU budget
+            pause = max(
+                busy * (1 / max(self.duty_cycle, 1e-3) - 1),
+                compute * (1 / max(self.cpu_budget, 1e-3) - 1),
+            )
+            time.sleep(min(pause, 5.0))
+
+    def start_thread(self):
+        if self.thread is not None:
+            logger.debug("Focus lock already running")
+            return
+        self.thread = threading.Thread(target=self.run, name="Focus Lock", daemon=True)
+        self.thread.start()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from .logger import logger as base_logger
+from .websocket_server import WebsocketServer
+
+logger = base_logger.getChild(__name__)
+
+
+class StagePublisher:
+    """Pushes the stage position to the websocket clients subscribed to the "stage" topic, so the web app does
+    not have to poll it over HTTP. The position is read at a fixed rate, but only sent when it changed by at
+    least min_delta steps on any axis, or every keepalive seconds. Nothing is read while nobody is subscribed.
+    """
+
+    TOPIC = "stage"
+
+    def __init__(
+        self,
+        microscope_object,
+        websocket_server: WebsocketServer,
+        rate: float = 10.0,
+        min_delta: int = 1,
+        keepalive: float = 5.0,
+    ):
+        """
+        :param rate: Maximum number of position updates per second
+        :param min_delta: Change on any axis below which an update is suppressed (stage steps)
+        :param keepalive: Time after which the position is sent even if it did not change (seconds)
+        """
+        self.microscope = microscope_object
+        self.websocket_server = websocket_server
+        self.rate = rate
+        self.min_delta = min_delta
+        self.keepalive = keepalive
+
+        self.thread = None
+        self.sent = 0
+        self.suppressed = 0
+        self._last_position = None
+        self._last_sent = 0.0
+
+    def settings(self) -> dict:
+        return {
+            "rate": self.rate,
+            "min_delta": self.min_delta,
+            "keepalive": self.keepalive,
+            "sent": self.sent,
+            "suppressed": self.suppressed,
+        }
+
+    def _changed(self, position) -> bool:
+        if self._last_position is None or len(position) != len(self._last_position):
+            return True
+        return any(abs(a - b) >= self.min_delta for a, b in zip(position, self._last_position))
+
+    def poll(self):
+        """Read the position once and publish it if it changed enough or the keepalive is due."""
+        if not self.websocket_server.has_subscribers(self.TOPIC):
+            # New subscribers get the current position right away
+            self._last_position = None
+            return
+        position = [int(x) for x in self.microscope.stage.position]
+        now = time.monotonic()
+        if not self._changed(position) and now - self._last_sent < self.keepalive:
+            self.suppressed += 1
+            return
+        self.websocket_server.publish(self.TOPIC, {"position": position, "time": time.time()})
+        self._last_position = position
+        self._last_sent = now
+        self.sent += 1
+
+    def run(self):
+        while True:
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Publishing the stage position failed")
+            time.sleep(max(1 / max(self.rate, 0.1) - (time.monotonic() - start), 0))
+
+    def start_thread(self):
+        if self.thread is not None:
+            logger.debug("Stage publisher already running")
+            return
+        self.thread = threading.Thread(target=self.run, name="CSC_Stage_Publisher", daemon=True)
+        self.thread.start()
@@ -10,39 +10,66 @@ from .stage_controller import StageController
 logger = base_logger.getChild(__name__)
 
 
+DEFAULT_TOPICS = ("input",)
+
+
 class WebsocketServer:
-    """Handling websocket connections to receive and send user input form controller to all connected clients"""
+    """Handling websocket connections to receive and send user input form controller to all connected clients.
+
+    Clients can subscribe to topics by sending {"subscribe": [...]} and {"unsubscribe": [...]}. Every client
+    starts with the "input" topic (joystick and button messages). Other topics are published as
+    {"topic": ..., ...} by the server with publish(), or by a client sending {"publish": topic, "payload": {...}}.
+    """
 
     def __init__(self, stage_controller: StageController):
         logger.debug("Websocket Server Initialization")
         self.connected_clients = set()
+        self.subscriptions = {}  # websocket -> set of topics
         self.asyncio_loop = None
         self.thread = None
         self.stage_controller = stage_controller
 
-    async def _handle_input(self, message):
+    async def _handle_input(self, message, websocket=None):
         parsed_message = json.loads(message)
 
+        if websocket is not None and (
+            "subscribe" in parsed_message or "unsubscribe" in parsed_message
+        ):
+            topics = self.subscriptions.setdefault(websocket, set(DEFAULT_TOPICS))
+            topics.update(parsed_message.get("subscribe", []))
+            topics.difference_update(parsed_message.get("unsubscribe", []))
+            await websocket.send(json.dumps({"topic": "subscriptions", "topics": sorted(topics)}))
+            return
+
+        if "publish" in parsed_message:
+            # Events from other parts of the server (e.g. the mini map), forwarded to the subscribers of the topic
+            topic = parsed_message["publish"]
+            payload = json.dumps({"topic": topic, **parsed_message.get("payload", {})}, separators=(",", ":"))
+            await self._send_to_clients(payload, topic)
+            return
+
         if "joystick" in parsed_message:
             self.stage_controller.change_direction(
                 (parsed_message["joystick"]["x"], parsed_message["joystick"]["y"]),
                 parsed_message["joystick"].get("button", False),
             )
 
-        await self._send_to_clients(json.dumps(parsed_message))
+        await self._send_to_clients(json.dumps(parsed_message), "input")
 
     async def _websocket_handler(self, websocket):
         self.connected_clients.add(websocket)
+        self.subscriptions[websocket] = set(DEFAULT_TOPICS)
         logger.debug(f"client connected: {websocket.remote_address}")
         try:
             async for message in websocket:
-                await self._handle_input(message)
+                await self._handle_input(message, websocket)
                 logger.debug(f"Received message from client: {message}")
         except websockets.exceptions.ConnectionClosed:
             logger.debug(f"Client disconnected: {websocket.remote_address}")
         finally:
             logger.debug(f"Finally disconnected: {websocket.remote_address}")
             self.connected_clients.remove(websocket)
+            self.subscriptions.pop(websocket, None)
 
     async def _start_websocket_server(self):
         self.asyncio_loop = asyncio.get_running_loop()
@@ -50,10 +77,27 @@ class WebsocketServer:
             logger.info("Websocket server started on ws://0.0.0.0:6789")
             await server.serve_forever()
 
-    async def _send_to_clients(self, message):
-        if self.connected_clients:
-            tasks = [client.send(message) for client in self.connected_clients]
-            await asyncio.gather(*tasks)
+    async def _send_to_clients(self, message, topic="input"):
+        clients = [
+            client
+            for client in self.connected_clients
+            if topic in self.subscriptions.get(client, DEFAULT_TOPICS)
+        ]
+        if clients:
+            tasks = [client.send(message) for client in clients]
+            # A client that went away must not keep the message from the others
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def has_subscribers(self, topic):
+        return any(topic in topics for topics in list(self.subscriptions.values()))
+
+    def publish(self, topic, payload):
+        """Send {"topic": topic, **payload} to all clients subscribed to the topic. Can be called from any thread."""
+        if self.asyncio_loop and self.has_subscribers(topic):
+            message = json.dumps({"topic": topic, **payload}, separators=(",", ":"))
+            asyncio.run_coroutine_threadsafe(
+                self._send_to_clients(message, topic), self.asyncio_loop
+            )
 
     def handle_input(self, message):
         logger.debug("Sending to clients")
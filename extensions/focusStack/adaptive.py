@@ -0,0 +1,103 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+import cv2
+
+
+def focus_score(rgb: np.ndarray, size: tuple = (160, 120)) -> float:
+    """
+    Cheap focus score of a (video port) frame: variance of the Laplacian of a small grayscale copy.
+
+    Args:
+        rgb (np.ndarray): Frame (H x W x 3).
+        size (tuple): Size (width, height) the frame is shrunk to before scoring.
+
+    Returns:
+        float: Focus score, higher is sharper.
+    """
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY) if rgb.ndim == 3 else rgb
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(small, cv2.CV_32F).var())
+
+
+class FocusPeakTracker:
+    """
+    Decides when a Z sweep has passed the focus peak.
+
+    The sweep ends once the score has stayed below `stop_fraction` of the highest score seen so far
+    for `patience` consecutive steps, but only if that peak rose at least `min_prominence` times above
+    the lowest score before it. A sweep starting at (or past) the focus, or over a featureless sample,
+    never shows such a rise and runs over the full range.
+    """
+
+    def __init__(self, stop_fraction: float = 0.5, patience: int = 3, min_prominence: float = 1.5):
+        self.stop_fraction = stop_fraction
+        self.patience = max(1, patience)
+        self.min_prominence = min_prominence
+        self.peak = None
+        self.peak_index = None
+        self.floor = None  # Lowest score before the peak
+        self.below = 0
+        self.steps = 0
+        self._lowest = None
+
+    @property
+    def prominent(self) -> bool:
+        """Whether the peak rose at least min_prominence times above the scores before it."""
+        return self.floor is not None and self.peak > self.min_prominence * self.floor
+
+    def update(self, score: float) -> bool:
+        """
+        Record the score of the next step.
+
+        Returns:
+            bool: True once the sweep can stop.
+        """
+        if self.peak is None or score > self.peak:
+            self.peak, self.peak_index = score, self.steps
+            self.floor = self._lowest
+        self._lowest = score if self._lowest is None else min(self._lowest, score)
+        self.steps += 1
+        if score < self.stop_fraction * self.peak:
+            self.below += 1
+        else:
+            self.below = 0
+        return self.prominent and self.below >= self.patience
+
+
+def focus_band(
+    positions: Sequence[int], scores: Sequence[float], stop_fraction: float, margin: int, min_prominence: float = 1.5
+) -> Optional[tuple]:
+    """
+    Z range around the focus peak of a coarse sweep.
+
+    Args:
+        positions (sequence): Z positions of the coarse sweep.
+        scores (sequence): Focus score at each position.
+        stop_fraction (float): Positions scoring at least this fraction of the peak belong to the band.
+        margin (int): Extra Z distance added on both sides of the band.
+        min_prominence (float): The peak must score at least this many times the lowest position.
+
+    Returns:
+        tuple: (lowest Z, highest Z) of the band, or None if the sweep shows no clear peak.
+    """
+    scores = np.asarray(scores, dtype=float)
+    if len(scores) == 0:
+        return None
+    peak = int(np.argmax(scores))
+    if scores[peak] <= min_prominence * scores.min():
+        return None
+    threshold = stop_fraction * scores[peak]
+    lo = hi = peak
+    # Grow the band only through contiguous in-focus positions around the peak
+    while lo > 0 and scores[lo - 1] >= threshold:
+        lo -= 1
+    while hi < len(scores) - 1 and scores[hi + 1] >= threshold:
+        hi += 1
+    z_lo, z_hi = sorted((positions[lo], positions[hi]))
+    return z_lo - margin, z_hi + margin
+
+
+def refine_positions(positions: List[int], band: tuple) -> List[int]:
+    """Keep the positions of the fine stack that fall into a focus band."""
+    return [z for z in positions if band[0] <= z <= band[1]]
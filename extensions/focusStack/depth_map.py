@@ -0,0 +1,111 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import cv2
+
+from .pyramid import sharpness_map
+
+
+class DepthMapFuser:
+    """
+    Fast all-in-focus composite and height map by per-pixel argmax of a smoothed focus measure.
+
+    Slices are processed one at a time: for every pixel the best focus score, the slice it came from and
+    the scores of its two neighbouring slices are tracked, so memory is constant in the number of slices.
+    The neighbour scores give sub-slice accuracy by fitting a parabola through the peak. The focus
+    measure is evaluated on a downsampled copy of each slice; only the selection of composite pixels
+    runs at full resolution.
+    """
+
+    def __init__(self, focus_blur: int = 5, downsample: int = 4):
+        """
+        Args:
+            focus_blur (int): Kernel size for smoothing the focus measure (must be odd!)
+            downsample (int): Factor by which slices are shrunk before the focus measure is computed.
+        """
+        self.focus_blur = focus_blur
+        self.downsample = max(1, downsample)
+        self.frames = 0
+        self.composite = None
+        self._best = None
+        self._best_idx = None
+        self._best_prev = None
+        self._best_next = None
+        self._prev = None
+
+    def add(self, frame: np.ndarray):
+        """
+        Add the next slice of the stack.
+
+        Args:
+            frame (np.ndarray): Stack image (H x W x 3, BGR).
+        """
+        h, w = frame.shape[:2]
+        small = frame
+        if self.downsample > 1:
+            small = cv2.resize(frame, (max(1, w // self.downsample), max(1, h // self.downsample)), interpolation=cv2.INTER_AREA)
+        score = sharpness_map(small)
+        cv2.GaussianBlur(score, (self.focus_blur, self.focus_blur), 0, dst=score)
+        k = self.frames
+        if k == 0:
+            self.composite = np.array(frame, copy=True)
+            self._best = score
+            self._best_idx = np.zeros(score.shape, dtype=np.int32)
+            self._best_prev = np.full(score.shape, np.nan, dtype=np.float32)
+            self._best_next = np.full(score.shape, np.nan, dtype=np.float32)
+        else:
+            if frame.shape != self.composite.shape:
+                raise ValueError(f"Frame shape {frame.shape} does not match stack shape {self.composite.shape}.")
+            # This slice is the upper neighbour of every peak found in the previous slice
+            np.copyto(self._best_next, score, where=self._best_idx == k - 1)
+            better = score > self._best
+            np.copyto(self._best_prev, self._prev, where=better)
+            np.copyto(self._best_next, np.float32(np.nan), where=better)
+            np.copyto(self._best, score, where=better)
+            self._best_idx[better] = k
+            mask = better.view(np.uint8)
+            if self.downsample > 1:
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+            cv2.copyTo(np.ascontiguousarray(frame), mask, self.composite)
+        self._prev = score
+        self.frames += 1
+
+    def sub_slice_index(self) -> np.ndarray:
+        """
+        Per-pixel in-focus slice index, refined by parabolic interpolation between neighbouring slices.
+
+        Returns:
+            np.ndarray: Fractional slice index at the downsampled resolution (float32).
+        """
+        prev, best, nxt = self._best_prev, self._best, self._best_next
+        denom = prev - 2 * best + nxt
+        valid = np.isfinite(denom) & (denom < 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = np.where(valid, 0.5 * (prev - nxt) / denom, 0)
+        return self._best_idx + np.clip(delta, -0.5, 0.5).astype(np.float32)
+
+    def result(self, z_positions: Optional[Sequence[float]] = None):
+        """
+        Build the composite and the height map.
+
+        Args:
+            z_positions (sequence, optional): Stage Z of every slice. Slice indices are used if not given.
+
+        Returns:
+            tuple:
+                - np.ndarray: All-in-focus composite (uint8, BGR).
+                - np.ndarray: Height map (uint16) in stage Z units, relative to the lowest slice.
+                - float: Z of the lowest slice (offset of the height map).
+        """
+        if self.frames == 0:
+            raise ValueError("No frames have been added to the fuser.")
+        if z_positions is None or any(z is None for z in z_positions):
+            z_positions = range(self.frames)
+        z_positions = np.asarray(z_positions, dtype=np.float32)
+        z = np.interp(self.sub_slice_index(), np.arange(self.frames), z_positions).astype(np.float32)
+        h, w = self.composite.shape[:2]
+        if z.shape != (h, w):
+            z = cv2.resize(z, (w, h), interpolation=cv2.INTER_LINEAR)
+        z_min = float(z_positions.min())
+        height = np.clip(np.rint(z - z_min), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+        return self.composite, height, z_min
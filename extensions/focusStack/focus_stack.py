@@ -1,16 +1,18 @@
+import logging
 import os
 import time
 import datetime
 import io
 import numpy as np
-from typing import Optional
+from typing import Callable, List, Optional
 from PIL import Image, ImageFilter
 import cv2
 import pprint
+import queue
 
-from labthings import fields, current_action, find_component
+from labthings import fields, current_action, find_component, find_extension
 from labthings.extensions import BaseExtension
-from labthings.views import ActionView
+from labthings.views import ActionView, View
 from labthings.utilities import get_docstring, get_summary
 
 from openflexure_microscope.microscope import Microscope
@@ -19,6 +21,25 @@ from openflexure_microscope.camera.base import BaseCamera
 from openflexure_microscope.utilities import set_properties
 from openflexure_microscope.devel import abort
 
+from .pyramid import (
+    softmax,
+    pad_to_multiple,
+    build_lap_pyramid,
+    reconstruct_from_lap_pyramid,
+    sharpness_map,
+    fuse_lap_pyramid,
+)
+from .streaming_fusion import StreamingPyramidFuser, StreamingFusionWorker
+from .stack_writer import StackWriter, write_stack_index
+from .stack_file import STACK_FILE_NAME, StackFileWriter, open_stack, prepare_frame
+from . import tiled_fusion
+from .depth_map import DepthMapFuser
+from .adaptive import FocusPeakTracker, focus_score, focus_band, refine_positions
+from .pyramid_cache import PyramidCache
+from .fusion_jobs import FusionJobQueue
+
+PYRAMID_CACHE_DIR = "/var/openflexure/data/z_stack/.pyramid_cache"
+
 
 def find_microscope() -> Microscope:
     """Find and return the connected microscope component, or abort if none found."""
@@ -69,10 +90,14 @@ class FocusStackExtension(BaseExtension):
     def __init__(self):
         super().__init__(
             "org.openflexure.focus_stack",
-            version="1.1.0",
+            version="1.2.0",
             description="Capture a Z-stack and fuse it into a single all-in-focus image.",
         )
+        self.pyramid_cache = PyramidCache(PYRAMID_CACHE_DIR)
+        self.fusion_jobs = FusionJobQueue(workers=1, max_pending=4, on_complete=self._store_fusion_job_result, cache_dir=PYRAMID_CACHE_DIR)
         self.add_decorated_method_views()
+        self.add_view(FusionJobListView, "/fusion_jobs", endpoint="fusion_jobs")
+        self.add_view(FusionJobView, "/fusion_jobs/<job_id>", endpoint="fusion_job")
 
     def add_decorated_method_views(self):
         """Register all decorated methods as Flask views for the API."""
@@ -93,6 +118,14 @@ class FocusStackExtension(BaseExtension):
             "end_offset": fields.Int(required=True),
             "step_size": fields.Int(required=True),
             "settle": fields.Float(load_default=0.4),
+            "pipelined": fields.Bool(load_default=False),
+            "storage": fields.Str(load_default="jpeg", metadata={"description": "'jpeg' or 'stack'"}),
+            "resize": fields.List(fields.Int(), load_default=[1024, 768], metadata={"description": "Frame size as [width, height], empty for full sensor resolution"}),
+            "adaptive": fields.Bool(load_default=False),
+            "stop_fraction": fields.Float(load_default=0.5),
+            "stop_patience": fields.Int(load_default=3),
+            "min_prominence": fields.Float(load_default=1.5),
+            "coarse_factor": fields.Int(load_default=1),
         }
     )
     def acquire_stack(
@@ -101,20 +134,52 @@ class FocusStackExtension(BaseExtension):
         start_offset: int = -300,
         end_offset: int = 300,
         step_size: int = 50,
-        settle: float = 0.4
+        settle: float = 0.4,
+        pipelined: bool = False,
+        storage: str = "jpeg",
+        resize: Optional[List[int]] = (1024, 768),
+        adaptive: bool = False,
+        stop_fraction: float = 0.5,
+        stop_patience: int = 3,
+        min_prominence: float = 1.5,
+        coarse_factor: int = 1,
+        frame_callback: Optional[Callable[[int, int, bytes], None]] = None,
     ):
         """
         Capture a Z-stack by moving the microscope stage along the Z-axis and recording images at each step.
 
-        The stack is saved to a timestamped directory for later focus stacking. The method also returns to the initial position after the capture.
+        The stack is saved to a timestamped directory for later focus stacking, together with a sidecar index
+        (index.json) holding Z position, timestamp and settle time of every frame. The method also returns to the initial position after the capture.
         If an abort signal is received (e.g. by user interrupt), the process is stopped and the stage is reset.
 
+        In pipelined mode the camera's JPEG bytes are handed to a background writer and stored unchanged,
+        so the stage moves to the next Z while the previous frame is still being written.
+
+        With storage="stack", lossless frames are written into a single memory-mappable container
+        (stack.zstk) instead of one JPEG per slice, so the stack can be re-fused without JPEG decoding.
+
+        In adaptive mode a cheap focus score is computed on a video port frame at every step, and the sweep
+        ends once the score has stayed below stop_fraction of its peak for stop_patience steps, provided the
+        peak rose min_prominence times above the scores before it. With coarse_factor > 1, a video-port-only
+        sweep at coarse_factor * step_size first locates the in-focus band, and full frames are only captured
+        at step_size within that band. Without a clear peak, the full range is captured.
+
         Args:
             microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
             start_offset (int): Z-offset from the current position for the stack's starting point.
             end_offset (int): Z-offset from the current position for the stack's ending point.
             step_size (int): Distance between each captured image along Z.
             settle (float): Wait time (in seconds) after each movement before capturing an image.
+            pipelined (bool): Write frames on a background thread without decoding and re-encoding them.
+            storage (str): "jpeg" for a directory of z_###.jpg files, "stack" for a single stack container.
+            resize (list, optional): Frame size as [width, height]. None or empty for full sensor resolution.
+            adaptive (bool): Stop the sweep once the focus peak has been passed.
+            stop_fraction (float): Fraction of the peak focus score below which a slice counts as out of focus.
+            stop_patience (int): Number of consecutive out-of-focus steps after which the sweep ends.
+            min_prominence (float): Factor by which the focus peak must exceed the lowest score before it.
+            coarse_factor (int): Step multiplier for a coarse pre-sweep that locates the in-focus band (1 to disable).
+            frame_callback (callable, optional): Called as frame_callback(index, z, frame) right after each
+                capture, with the JPEG bytes or, for stack storage, the BGR array. Must return quickly.
 
         Returns:
             dict: {
@@ -123,6 +188,11 @@ class FocusStackExtension(BaseExtension):
                 "directory" (str): Path to the output directory containing the stack images.
             }
         """
+        if storage not in ("jpeg", "stack"):
+            abort(400, f"Unknown stack storage: {storage}")
+        if step_size <= 0 or end_offset < start_offset:
+            abort(400, "The Z range holds no positions: end_offset must not be below start_offset, and step_size must be positive.")
+        resize = tuple(resize) if resize else None
         if not microscope:
             microscope = find_microscope_with_stage()
         camera: BaseCamera = microscope.camera
@@ -139,136 +209,309 @@ class FocusStackExtension(BaseExtension):
         initial_y = stage.position[1]
         initial_z = stage.position[2]
         positions = [initial_z + dz for dz in range(start_offset, end_offset + 1, step_size)]
-
-        # Compute absolute Z positions to acquire
-        with set_properties(stage, backlash=256), stage.lock, camera.lock:
-            for idx, target_z in enumerate(positions):
-                if current_action() and current_action().stopped:
-                    # On abort, return to original Z
-                    stage.move_abs((initial_x, initial_y, initial_z))
-                    return {"status": "aborted", "captured": idx}
-
-                # Move to Z, wait, and capture image
-                stage.move_abs((initial_x, initial_y, target_z))
+        tracker = FocusPeakTracker(stop_fraction, stop_patience, min_prominence) if adaptive and coarse_factor <= 1 else None
+        captured = 0
+
+        stack_file = StackFileWriter(os.path.join(directory, STACK_FILE_NAME)) if storage == "stack" else None
+        writer = StackWriter(directory, stack_file=stack_file).start() if pipelined else None
+        index = []
+        try:
+            # Compute absolute Z positions to acquire
+            with set_properties(stage, backlash=256), stage.lock, camera.lock:
+                if adaptive and coarse_factor > 1:
+                    band = self._coarse_focus_band(
+                        stage, camera, (initial_x, initial_y),
+                        [initial_z + dz for dz in range(start_offset, end_offset + 1, step_size * coarse_factor)],
+                        settle, stop_fraction, stop_patience, min_prominence, margin=step_size * coarse_factor,
+                    )
+                    if band is None:
+                        stage.move_abs((initial_x, initial_y, initial_z))
+                        return {"status": "aborted", "captured": 0}
+                    # The band holds at least one coarse position, which is a fine position too
+                    positions = refine_positions(positions, band) or positions
+
+                for idx, target_z in enumerate(positions):
+                    if current_action() and current_action().stopped:
+                        # On abort, return to original Z
+                        stage.move_abs((initial_x, initial_y, initial_z))
+                        return {"status": "aborted", "captured": idx}
+
+                    # Move to Z, wait, and capture image
+                    stage.move_abs((initial_x, initial_y, target_z))
+                    time.sleep(settle)
+
+                    score = None
+                    if tracker:
+                        score = focus_score(camera.array(use_video_port=True))
+                        if tracker.update(score):
+                            break
+
+                    if stack_file:
+                        frame = prepare_frame(camera.array(use_video_port=False), resize)
+                        entry = {"index": idx, "z": int(target_z), "timestamp": time.time(), "settle": settle}
+                        filename = STACK_FILE_NAME
+                    else:
+                        filename = f"z_{idx:03d}.jpg"
+                        with io.BytesIO() as stream:
+                            camera.capture(stream, use_video_port=False, bayer=False, resize=resize)
+                            frame = stream.getvalue()
+                        entry = {"index": idx, "z": int(target_z), "timestamp": time.time(), "settle": settle}
+                    if score is not None:
+                        entry["focus_score"] = score
+                    captured += 1
+
+                    if frame_callback:
+                        frame_callback(idx, target_z, frame)
+                    if writer:
+                        writer.write(filename, frame, entry)
+                        continue
+                    if stack_file:
+                        stack_file.append(frame, entry)
+                    else:
+                        image = Image.open(io.BytesIO(frame))
+                        image.save(os.path.join(directory, filename))
+                    index.append({**entry, "file": filename})
+                # Restore initial Z position
+                stage.move_abs((initial_x, initial_y, initial_z))
                 time.sleep(settle)
+        finally:
+            # Flush outstanding frames after the stage and camera locks have been released
+            if writer:
+                writer.close()
+            else:
+                if stack_file:
+                    stack_file.close()
+                write_stack_index(directory, index)
 
-                filename = os.path.join(directory, f"z_{idx:03d}.jpg")
-                with io.BytesIO() as stream:
-                    camera.capture(stream, use_video_port=False, bayer=False, resize=(1024, 768))
-                    stream.seek(0)
-                    image = Image.open(stream)
-                    image.save(filename)
-            # Restore initial Z position
-            stage.move_abs((initial_x, initial_y, initial_z))
-            time.sleep(settle)
+        return {"status": "completed", "frames": captured, "directory": directory}
 
+    @staticmethod
+    def _coarse_focus_band(stage, camera, xy, positions, settle, stop_fraction, stop_patience, min_prominence, margin):
+        """
+        Sweep Z coarsely, scoring video port frames only, and return the (lowest, highest) Z of the in-focus band.
 
-        return {"status": "completed", "frames": len(positions), "directory": directory}
+        Without a clear focus peak the band is the whole sweep. Returns None if the action was aborted.
+        """
+        tracker = FocusPeakTracker(stop_fraction, stop_patience, min_prominence)
+        visited, scores = [], []
+        for target_z in positions:
+            if current_action() and current_action().stopped:
+                return None
+            stage.move_abs((xy[0], xy[1], target_z))
+            time.sleep(settle)
+            score = focus_score(camera.array(use_video_port=True))
+            visited.append(target_z)
+            scores.append(score)
+            if tracker.update(score):
+                break
+        band = focus_band(visited, scores, stop_fraction, margin, min_prominence)
+        if band is None:
+            logging.warning("No clear focus peak in the coarse sweep, capturing the full Z range")
+            return min(positions) - margin, max(positions) + margin
+        return band
     
-    @staticmethod
-    def softmax(x, axis=0, alpha=1.0):
+    softmax = staticmethod(softmax)
+    pad_to_multiple = staticmethod(pad_to_multiple)
+    build_lap_pyramid = staticmethod(build_lap_pyramid)
+    reconstruct_from_lap_pyramid = staticmethod(reconstruct_from_lap_pyramid)
+    sharpness_map = staticmethod(sharpness_map)
+
+    @extension_action(
+        args={
+            "directory": fields.Str(required=True),
+            "output_name": fields.Str(load_default="fused.jpg"),
+            "levels": fields.Int(load_default=4),
+            "weights_alpha": fields.Int(load_default=5),
+            "blur": fields.Int(load_default=5),
+            "weight_pyramid": fields.Str(load_default="gaussian", metadata={"description": "'gaussian' or 'laplacian' (weights of releases before 1.2.0)"}),
+            "use_cache": fields.Bool(load_default=False),
+        }
+    )
+    def fuse_stack_lap_pyramid(self, directory: str, output_name: str = "fused.jpg", levels: int = 4, weights_alpha:int = 5, blur: int = 5, weight_pyramid: str = "gaussian", use_cache: bool = False, microscope: Optional[Microscope] = None):
         """
-        Compute the numerically stable softmax of an array along a specified axis,
-        with optional scaling exponent (alpha).
+        Fuse a Z-stack of images using a multi-scale Laplacian pyramid and focus blending.
 
         Args:
-            x (np.ndarray): Input array (e.g., sharpness mask stack).
-            axis (int, optional): Axis along which to compute softmax. Default: 0.
-            alpha (float, optional): Exponent for scaling ("temperature"). Default: 1.0.
+            directory (str): Directory containing stack images (.jpg) or a stack container (stack.zstk)
+            output_name (str): Name for the fused output image
+            levels (int): Number of pyramid levels
+            weights_alpha (int): Sharpness blending exponent (softmax alpha)
+            blur (int): Kernel size for mask smoothing (must be odd!)
+            weight_pyramid (str): Blending weights per level: "gaussian" (default) or "laplacian" to reproduce earlier results
+            use_cache (bool): Reuse per-slice pyramids and sharpness maps of earlier fusions of the same frames.
+                Only worth it when re-fusing a directory (e.g. with other weights_alpha or blur), a fresh stack
+                never hits the cache and would only fill the SD card with uncompressed pyramids.
+            microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
 
         Returns:
-            np.ndarray: Array of same shape as x, normalized along 'axis'.
+            dict: Status, path to output image, frame count, cache hits and misses
         """
-        x_max = np.max(x, axis=axis, keepdims=True)
-        e_x = np.exp(alpha * (x - x_max))
-        return e_x / np.sum(e_x, axis=axis, keepdims=True)
+        stack = open_stack(directory)
+        if not len(stack):
+            abort(400, "No images found in directory.")
 
-    @staticmethod
-    def pad_to_multiple(img, divisor):
-        """
-        Pad an image so that its height and width become exact multiples of a given divisor.
+        cache, keys = None, None
+        if use_cache:
+            cache = self.pyramid_cache.session()
+            keys = [PyramidCache.key(stack.content_hash(i), levels) for i in range(len(stack))]
+        try:
+            fused = fuse_lap_pyramid(stack, levels=levels, weights_alpha=weights_alpha, blur=blur, weight_pyramid=weight_pyramid, cache=cache, keys=keys)
+        except ValueError as e:
+            abort(400, str(e))
 
-        This is necessary for constructing image pyramids, which require dimensions to be divisible by powers of two (or the chosen divisor).
-        Padding is added to the bottom and right edges, using reflected border pixels.
+        fused_path = self.save_fused_image(fused, directory, output_name, microscope)
+        return {
+            "status": "fused",
+            "output": fused_path,
+            "source_frames": len(stack),
+            "cache_hits": cache.hits if cache else 0,
+            "cache_misses": cache.misses if cache else 0,
+        }
+
+    @extension_action(
+        args={
+            "memory_budget_mb": fields.Int(load_default=None, allow_none=True),
+            "disk_budget_mb": fields.Int(load_default=None, allow_none=True),
+            "clear": fields.Bool(load_default=False),
+        }
+    )
+    def configure_pyramid_cache(self, memory_budget_mb: Optional[int] = None, disk_budget_mb: Optional[int] = None, clear: bool = False):
+        """
+        Set the byte budgets of the pyramid cache used by fuse_stack_lap_pyramid, or clear it.
 
         Args:
-            img (np.ndarray): Input image array (H x W x C or H x W).
-            divisor (int): The value to which height and width should be multiples.
+            memory_budget_mb (int, optional): Memory the cache may hold (MiB). Unchanged if not given.
+            disk_budget_mb (int, optional): Disk space the cache may use (MiB), 0 to disable the on-disk store. Unchanged if not given.
+            clear (bool): Drop all cached entries.
 
         Returns:
-            tuple:
-                - np.ndarray: The padded image.
-                - int: Original (unpadded) image height.
-                - int: Original (unpadded) image width.
+            dict: Cache statistics
         """
-        h, w = img.shape[:2]
-        pad_h = (divisor - (h % divisor)) % divisor
-        pad_w = (divisor - (w % divisor)) % divisor
-        return cv2.copyMakeBorder(img, 0, int(pad_h), 0, int(pad_w), borderType=cv2.BORDER_REFLECT), h, w
-
+        if memory_budget_mb is not None:
+            self.pyramid_cache.memory_budget = memory_budget_mb * 2 ** 20
+        if disk_budget_mb is not None:
+            self.pyramid_cache.disk_budget = disk_budget_mb * 2 ** 20
+        if clear:
+            self.pyramid_cache.clear()
+        return self.pyramid_cache.stats()
 
-    @staticmethod
-    def build_lap_pyramid(img, levels):
+    @extension_action(
+        args={
+            "directory": fields.Str(required=True),
+            "output_name": fields.Str(load_default="fused.jpg"),
+            "levels": fields.Int(load_default=4),
+            "weights_alpha": fields.Int(load_default=5),
+            "blur": fields.Int(load_default=5),
+            "tile_size": fields.Int(load_default=0),
+            "workers": fields.Int(load_default=0),
+            "memory_budget_mb": fields.Int(load_default=256),
+        }
+    )
+    def fuse_stack_tiled(
+        self,
+        directory: str,
+        output_name: str = "fused.jpg",
+        levels: int = 4,
+        weights_alpha: int = 5,
+        blur: int = 5,
+        tile_size: int = 0,
+        workers: int = 0,
+        memory_budget_mb: int = 256,
+        microscope: Optional[Microscope] = None,
+    ):
         """
-        Build a Laplacian pyramid from an input image.
+        Fuse a Z-stack tile by tile in a process pool, with bounded memory.
+
+        Tiles are fused with a halo sized to the pyramid depth and stitched seamlessly. Use this for
+        full sensor resolution stacks that do not fit into memory with fuse_stack_lap_pyramid.
 
         Args:
-            img (np.ndarray): Input image (float32 or uint8).
-            levels (int): Number of pyramid levels.
+            directory (str): Directory containing stack images (.jpg) or a stack container (stack.zstk)
+            output_name (str): Name for the fused output image
+            levels (int): Number of pyramid levels
+            weights_alpha (int): Sharpness blending exponent (softmax alpha)
+            blur (int): Kernel size for mask smoothing (must be odd!)
+            tile_size (int): Tile edge in pixels, 0 to derive it from the memory budget
+            workers (int): Number of worker processes, 0 for one per CPU core
+            memory_budget_mb (int): Memory the tile workers may use together (MiB)
+            microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
 
         Returns:
-            tuple:
-                - list of np.ndarray: Laplacian images, from highest to lowest resolution.
-                - list of tuple: Shapes (height, width) per level.
+            dict: Status, path to output image, frame count, tile count
         """
-        G = img.copy()
-        gp = [G]
-        sizes = [G.shape[:2]]
-        for i in range(levels):
-            G = cv2.pyrDown(G)
-            gp.append(G)
-            sizes.append(G.shape[:2])
-
-        lp = []
-        # Build pyramid so lp[0] is the largest (original) resolution
-        for i in range(levels):
-            GE = cv2.pyrUp(gp[i+1], dstsize=(gp[i].shape[1], gp[i].shape[0]))
-            L = cv2.subtract(gp[i], GE)
-            lp.append(L)
-        lp.append(gp[-1])  # Smallest level at the bottom
-        return lp, sizes
-
+        try:
+            fused, frames, tiles = tiled_fusion.fuse_stack_tiled(
+                directory,
+                levels=levels,
+                weights_alpha=weights_alpha,
+                blur=blur,
+                tile_size=tile_size,
+                workers=workers,
+                memory_budget=memory_budget_mb * 2 ** 20,
+            )
+        except ValueError as e:
+            abort(400, str(e))
+        fused_path = self.save_fused_image(fused, directory, output_name, microscope)
+        return {"status": "fused", "output": fused_path, "source_frames": frames, "tiles": tiles}
 
-    @staticmethod
-    def reconstruct_from_lap_pyramid(lp, sizes):
+    @extension_action(
+        args={
+            "directory": fields.Str(required=True),
+            "output_name": fields.Str(load_default="depthmap.jpg"),
+            "height_map_name": fields.Str(load_default="height.png"),
+            "focus_blur": fields.Int(load_default=5),
+            "downsample": fields.Int(load_default=4),
+        }
+    )
+    def fuse_stack_depthmap(
+        self,
+        directory: str,
+        output_name: str = "depthmap.jpg",
+        height_map_name: str = "height.png",
+        focus_blur: int = 5,
+        downsample: int = 4,
+        microscope: Optional[Microscope] = None,
+    ):
         """
-        Reconstruct an image from a Laplacian pyramid.
+        Fast preview fusion: pick every pixel from the slice where a smoothed focus measure peaks.
+
+        Besides the all-in-focus composite, a 16-bit height map (PNG) in stage Z units is written, using the
+        Z positions recorded by acquire_stack. The peak is refined between slices by parabolic interpolation.
+        Much cheaper than fuse_stack_lap_pyramid, at the cost of less smooth transitions between slices.
 
         Args:
-            lp (list of np.ndarray): Laplacian images, from highest to lowest resolution.
-            sizes (list of tuple): Original image shapes per level.
+            directory (str): Directory containing stack images (.jpg) or a stack container (stack.zstk)
+            output_name (str): Name for the composite image
+            height_map_name (str): Name for the 16-bit height map
+            focus_blur (int): Kernel size for smoothing the focus measure (must be odd!)
+            downsample (int): Factor by which slices are shrunk for the focus measure
+            microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
 
         Returns:
-            np.ndarray: Reconstructed image (same shape as input image).
+            dict: Status, paths to composite and height map, Z offset of the height map, frame count
         """
-        img = lp[-1]
-        for i in range(len(lp) - 2, -1, -1):
-            shape = sizes[i]
-            img = cv2.pyrUp(img)
-            img = img[:shape[0], :shape[1], ...]
-            L = lp[i]
-            L = L[:shape[0], :shape[1], ...]
-            if img.ndim != L.ndim:
-                if img.ndim == 3 and L.ndim == 2:
-                    L = np.repeat(L[..., None], img.shape[2], axis=2)
-                elif img.ndim == 2 and L.ndim == 3:
-                    img = np.repeat(img[..., None], L.shape[2], axis=2)
-            if img.dtype != L.dtype:
-                img = img.astype(np.float32)
-                L = L.astype(np.float32)
-            img = cv2.add(img, L)
-        return img
+        stack = open_stack(directory)
+        if not len(stack):
+            abort(400, "No images found in directory.")
 
+        fuser = DepthMapFuser(focus_blur=focus_blur, downsample=downsample)
+        try:
+            for i in range(len(stack)):
+                fuser.add(stack[i])
+        except ValueError as e:
+            abort(400, str(e))
+        composite, height, z_offset = fuser.result(stack.z_positions)
+
+        height_path = os.path.join(directory, height_map_name if height_map_name.endswith(".png") else height_map_name + ".png")
+        cv2.imwrite(height_path, height)
+        composite_path = self.save_fused_image(composite, directory, output_name, microscope)
+        return {
+            "status": "fused",
+            "output": composite_path,
+            "height_map": height_path,
+            "height_offset": z_offset,
+            "source_frames": len(stack),
+        }
 
     @extension_action(
         args={
@@ -276,97 +519,78 @@ class FocusStackExtension(BaseExtension):
             "output_name": fields.Str(load_default="fused.jpg"),
             "levels": fields.Int(load_default=4),
             "weights_alpha": fields.Int(load_default=5),
-            "blur": fields.Int(load_default=5)
+            "blur": fields.Int(load_default=5),
+            "weight_pyramid": fields.Str(load_default="gaussian", metadata={"description": "'gaussian' or 'laplacian' (weights of releases before 1.2.0)"}),
+            "use_cache": fields.Bool(load_default=False),
         }
     )
-    def fuse_stack_lap_pyramid(self, directory: str, output_name: str = "fused.jpg", levels: int = 4, weights_alpha:int = 5, blur: int = 5):
+    def submit_fusion_job(
+        self,
+        directory: str,
+        output_name: str = "fused.jpg",
+        levels: int = 4,
+        weights_alpha: int = 5,
+        blur: int = 5,
+        weight_pyramid: str = "gaussian",
+        use_cache: bool = False,
+        microscope: Optional[Microscope] = None,
+    ):
         """
-        Fuse a Z-stack of images using a multi-scale Laplacian pyramid and focus blending.
+        Queue the fusion of a stack in a background worker process and return immediately.
+
+        Poll GET /fusion_jobs/<job_id> for progress. Once fused, the image is written next to the stack
+        and added to the microscope's captures, as with fuse_stack_lap_pyramid.
 
         Args:
-            directory (str): Directory containing stack images (.jpg)
+            directory (str): Directory containing stack images (.jpg) or a stack container (stack.zstk)
             output_name (str): Name for the fused output image
             levels (int): Number of pyramid levels
             weights_alpha (int): Sharpness blending exponent (softmax alpha)
             blur (int): Kernel size for mask smoothing (must be odd!)
+            weight_pyramid (str): Blending weights per level: "gaussian" (default) or "laplacian" to reproduce earlier results
+            use_cache (bool): Reuse per-slice pyramids of earlier fusions of the same frames, see fuse_stack_lap_pyramid
+            microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
 
         Returns:
-            dict: Status, path to output image, frame count
+            dict: Job ID and state
         """
-        image_files = sorted([f for f in os.listdir(directory) if f.endswith(".jpg")])
-        if not image_files:
-            abort(400, "No images found in directory.")
+        if not os.path.isdir(directory):
+            abort(400, f"Directory {directory} does not exist.")
+        if not microscope:
+            microscope = find_microscope()
+        try:
+            job = self.fusion_jobs.submit(
+                directory,
+                output_name=output_name,
+                levels=levels,
+                weights_alpha=weights_alpha,
+                blur=blur,
+                weight_pyramid=weight_pyramid,
+                use_cache=use_cache,
+                microscope=microscope,
+                block=False,
+            )
+        except queue.Full as e:
+            abort(503, str(e))
+        return job.to_dict()
 
-        
-
-        # --- Load and pad images to compatible size for pyramids
-        tmp_imgs = []
-        orig_h, orig_w = None, None
-        max_h, max_w = 0, 0
-        for f in image_files:
-            img = cv2.imread(os.path.join(directory, f))
-            img, h, w = self.pad_to_multiple(img, 2 ** levels)
-            tmp_imgs.append((img, h, w))
-            if img.shape[0] > max_h: max_h = img.shape[0]
-            if img.shape[1] > max_w: max_w = img.shape[1]
-            if orig_h is None: orig_h, orig_w = h, w
-
-        imgs = []
-        for img, h, w in tmp_imgs:
-            # Pad all images to same maximal shape
-            pad_h = max_h - img.shape[0]
-            pad_w = max_w - img.shape[1]
-            img = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, borderType=cv2.BORDER_REFLECT)
-            imgs.append(img)
-        
-        imgs = [img.astype(np.float32) for img in imgs]
-
-        # --- Build Laplacian pyramids for all stack images
-        pyramids_with_sizes = [self.build_lap_pyramid(img, levels) for img in imgs]
-        pyramids = [x[0] for x in pyramids_with_sizes]
-        sizes = pyramids_with_sizes[0][1]
-
-        # --- Compute sharpness mask for each image
-        sharpness_masks = []
-        for img in imgs:
-            img_uint8 = img.astype(np.uint8)
-            img_gray = cv2.cvtColor(img_uint8, cv2.COLOR_BGR2GRAY)
-            # Hybrid sharpness: Laplacian + Sobel
-            lap = cv2.Laplacian(img_gray, cv2.CV_64F)
-            sobel = cv2.Sobel(img_gray, cv2.CV_64F, 1, 1, ksize=3)
-            sharp = np.abs(lap) + 0.5 * np.abs(sobel)
-            sharpness_masks.append(np.abs(sharp))
-        # Build sharpness pyramids for blending, one per image
-        sharpness_pyramids = [self.build_lap_pyramid(mask.astype(np.float32), levels)[0] for mask in sharpness_masks]
-
-         # --- Fuse images per pyramid level using sharpness weights
-        fused_pyramid = []
-        for level in range(levels+1):
-            target_shape = sizes[level]
-            # Get this level from every image, cropped to common size
-            level_stack = [pyramids[i][level][:target_shape[0], :target_shape[1], ...] for i in range(len(imgs))]
-            level_sharp = [sharpness_pyramids[i][level][:target_shape[0], :target_shape[1]] for i in range(len(imgs))]
-            level_sharp = [s.squeeze() if s.ndim > 2 else s for s in level_sharp]
-            # Smooth sharpness map (avoid artifacts)
-            level_sharp = [cv2.GaussianBlur(s, (blur, blur), 0) for s in level_sharp]
-            level_sharp = np.stack(level_sharp, axis=0) 
-            # Compute blending weights using softmax of sharpness
-            weights = self.softmax(level_sharp, axis=0, alpha=weights_alpha)
-
-            level_stack_np = np.stack(level_stack, axis=0)
-            # Weighted sum over all images
-            if level_stack_np.ndim == 4:
-                fused_level = np.sum(weights[..., None] * level_stack_np, axis=0)
-            else:
-                fused_level = np.sum(weights * level_stack_np, axis=0)
-            fused_pyramid.append(fused_level)
+    def _store_fusion_job_result(self, job, fused: np.ndarray) -> str:
+        """Completion callback of the fusion job queue: save the fused image and add it to the captures."""
+        return self.save_fused_image(fused, job.directory, job.output_name, job.microscope)
 
-        # --- Reconstruct all-in-focus image from fused pyramid
-        fused = self.reconstruct_from_lap_pyramid(fused_pyramid, sizes)
-        fused = np.clip(fused, 0, 255).astype(np.uint8)
-        fused = fused[:orig_h, :orig_w] # Restore original size
+    def save_fused_image(self, fused: np.ndarray, directory: str, output_name: str, microscope: Optional[Microscope] = None) -> str:
+        """
+        Write a fused image next to its stack and add it to the microscope's captures.
 
-        # Save result
+        Args:
+            fused (np.ndarray): Fused image (uint8, BGR).
+            directory (str): Stack directory the image is written to.
+            output_name (str): Name for the fused output image
+            microscope (Microscope, optional): Microscope object. If None, will be auto-detected.
+
+        Returns:
+            str: Path to the written image.
+        """
         fused_path = os.path.join(directory, output_name if output_name.endswith(".jpg") else output_name + ".jpg")
         cv2.imwrite(fused_path, fused)
         if not microscope:
@@ -380,7 +604,7 @@ class FocusStackExtension(BaseExtension):
             output.flush()
 
             output.put_and_save()
-        return {"status": "fused", "output": fused_path, "source_frames": len(image_files)}
+        return fused_path
 
     @extension_action(
         args={
@@ -391,7 +615,12 @@ class FocusStackExtension(BaseExtension):
             "output_name": fields.Str(load_default="fused.jpg"),
             "levels": fields.Int(load_default=4),
             "weights_alpha": fields.Int(load_default=5),
-            "blur": fields.Int(load_default=5)
+            "blur": fields.Int(load_default=5),
+            "streaming": fields.Bool(load_default=False),
+            "pipelined": fields.Bool(load_default=False),
+            "storage": fields.Str(load_default="jpeg", metadata={"description": "'jpeg' or 'stack'"}),
+            "adaptive": fields.Bool(load_default=False),
+            "background": fields.Bool(load_default=False),
         }
     )
     def acquire_and_fuse_stack(
@@ -404,7 +633,12 @@ class FocusStackExtension(BaseExtension):
         output_name: str = "fused.jpg",
         levels: int = 4,
         weights_alpha: int = 5,
-        blur: int = 5
+        blur: int = 5,
+        streaming: bool = False,
+        pipelined: bool = False,
+        storage: str = "jpeg",
+        adaptive: bool = False,
+        background: bool = False,
     ):
         """
         Complete workflow: Acquire a Z-stack of images and directly fuse them into a single all-in-focus image.
@@ -419,22 +653,51 @@ class FocusStackExtension(BaseExtension):
             levels (int, optional): Number of pyramid levels.
             weights_alpha (int, optional): Exponent for sharpness-based blending.
             blur (int, optional): Kernel size for sharpness mask smoothing.
+            streaming (bool, optional): Fuse each frame in the background while the stage moves to the next Z,
+                instead of reading the whole stack back after acquisition. Memory stays constant in the number of frames.
+            pipelined (bool, optional): Write frames on a background thread without re-encoding them.
+            storage (str, optional): "jpeg" for one file per slice, "stack" for a single lossless stack container.
+            adaptive (bool, optional): End the Z sweep once the focus peak has been passed (see acquire_stack).
+            background (bool, optional): Queue the fusion as a job (see submit_fusion_job) and return as soon as the
+                stage and camera are released, so the next stack can be acquired while this one is fused.
 
         Returns:
             dict: {
-                "status" (str): Status message ("done" or "failed"),
+                "status" (str): Status message ("done", "queued" or "failed"),
                 "frames" (int): Number of images captured,
                 "directory" (str): Path to output directory,
-                "fused_image" (str): Path to output fused image, or None if failed.
+                "fused_image" (str): Path to output fused image, or None if failed or queued.
+                "job_id" (str): ID of the fusion job, if queued.
             }
         """
+        if streaming and background:
+            abort(400, "Streaming fusion runs during acquisition and cannot be queued in the background.")
+        if streaming:
+            return self._acquire_and_fuse_streaming(
+                microscope=microscope,
+                start_offset=start_offset,
+                end_offset=end_offset,
+                step_size=step_size,
+                settle=settle,
+                output_name=output_name,
+                levels=levels,
+                weights_alpha=weights_alpha,
+                blur=blur,
+                pipelined=pipelined,
+                storage=storage,
+                adaptive=adaptive,
+            )
+
         # Step 1: Acquire stack
         result = self.acquire_stack(
             microscope=microscope,
             start_offset=start_offset,
             end_offset=end_offset,
             step_size=step_size,
-            settle=settle
+            settle=settle,
+            pipelined=pipelined,
+            storage=storage,
+            adaptive=adaptive,
         )
         if result["status"] != "completed":
             return {"status": "failed", "message": "Stack acquisition failed", **result}
@@ -442,12 +705,33 @@ class FocusStackExtension(BaseExtension):
         directory = result["directory"]
 
         # Step 2: Fuse stack
+        if background:
+            # The stage and camera locks are released at this point, only the fusion is left
+            job = self.fusion_jobs.submit(
+                directory,
+                output_name=output_name,
+                levels=levels,
+                weights_alpha=weights_alpha,
+                blur=blur,
+                use_cache=False,  # A new acquisition never hits the cache
+                microscope=microscope or find_microscope(),
+            )
+            return {
+                "status": "queued",
+                "frames": result["frames"],
+                "directory": directory,
+                "fused_image": None,
+                "job_id": job.id,
+            }
+
         fused = self.fuse_stack_lap_pyramid(
             directory=directory,
             output_name=output_name,
             levels=levels,
             weights_alpha=weights_alpha,
-            blur=blur
+            blur=blur,
+            use_cache=False,  # A new acquisition never hits the cache
+            microscope=microscope,
         )
         return {
             "status": "done",
@@ -456,3 +740,69 @@ class FocusStackExtension(BaseExtension):
             "fused_image": fused.get("output", None)
         }
 
+    def _acquire_and_fuse_streaming(
+        self,
+        microscope: Optional[Microscope],
+        start_offset: int,
+        end_offset: int,
+        step_size: int,
+        settle: float,
+        output_name: str,
+        levels: int,
+        weights_alpha: int,
+        blur: int,
+        pipelined: bool = False,
+        storage: str = "jpeg",
+        adaptive: bool = False,
+    ):
+        """Acquire a Z-stack while a background worker folds every captured frame into the fused pyramid."""
+        worker = StreamingFusionWorker(
+            StreamingPyramidFuser(levels=levels, weights_alpha=weights_alpha, blur=blur)
+        ).start()
+        try:
+            result = self.acquire_stack(
+                microscope=microscope,
+                start_offset=start_offset,
+                end_offset=end_offset,
+                step_size=step_size,
+                settle=settle,
+                pipelined=pipelined,
+                storage=storage,
+                adaptive=adaptive,
+                frame_callback=lambda idx, z, data: worker.submit(data),
+            )
+        except Exception:
+            worker.cancel()
+            raise
+        if result["status"] != "completed":
+            worker.cancel()
+            return {"status": "failed", "message": "Stack acquisition failed", **result}
+
+        directory = result["directory"]
+        fused = worker.finish()
+        fused_path = self.save_fused_image(fused, directory, output_name, microscope)
+        return {
+            "status": "done",
+            "frames": result["frames"],
+            "directory": directory,
+            "fused_image": fused_path
+        }
+
+
+class FusionJobListView(View):
+
+    def get(self):
+        """List queued, running and recently finished fusion jobs"""
+        extension = find_extension("org.openflexure.focus_stack")
+        return [job.to_dict() for job in extension.fusion_jobs.jobs()]
+
+
+class FusionJobView(View):
+
+    def get(self, job_id):
+        """Get state and progress of a fusion job"""
+        extension = find_extension("org.openflexure.focus_stack")
+        job = extension.fusion_jobs.get(job_id)
+        if job is None:
+            abort(404, f"No fusion job {job_id}.")
+        return job.to_dict()
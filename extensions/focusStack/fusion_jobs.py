@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from .pyramid import fuse_lap_pyramid
+from .pyramid_cache import PyramidCache
+from .stack_file import open_stack
+from .worker_pool import WorkerPool
+
+
+def run_fusion_job(directory: str, levels: int, weights_alpha: float, blur: int, weight_pyramid: str, cache_dir: Optional[str], progress: Callable[[float], None]):
+    """
+    Fuse the stack in a directory. Runs in a fusion_worker.py process of a FusionJobQueue.
+
+    Returns:
+        tuple: Fused image (uint8, BGR) and number of source frames.
+    """
+    progress(0.0)
+    stack = open_stack(directory)
+    if not len(stack):
+        raise ValueError("No images found in directory.")
+    cache, keys = None, None
+    if cache_dir:
+        cache = PyramidCache(cache_dir)
+        keys = [PyramidCache.key(stack.content_hash(i), levels) for i in range(len(stack))]
+    fused = fuse_lap_pyramid(
+        stack,
+        levels=levels,
+        weights_alpha=weights_alpha,
+        blur=blur,
+        weight_pyramid=weight_pyramid,
+        cache=cache,
+        keys=keys,
+        progress=progress,
+    )
+    return fused, len(stack)
+
+
+class FusionJob:
+    """State of one queued fusion of a stack directory."""
+
+    def __init__(self, directory: str, output_name: str, params: dict, microscope=None):
+        self.id = uuid.uuid4().hex
+        self.directory = directory
+        self.output_name = output_name
+        self.params = params
+        self.microscope = microscope
+        self.status = "queued"
+        self.progress = 0.0
+        self.output = None
+        self.source_frames = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "directory": self.directory,
+            "output": self.output,
+            "source_frames": self.source_frames,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            **self.params,
+        }
+
+
+class FusionJobQueue:
+    """
+    Runs stack fusions as jobs in worker processes (see WorkerPool), so that acquisition does not wait for fusion.
+
+    At most `max_pending` jobs are queued or running at a time. The progress reported by the workers is
+    folded into the job states. Fused images are handed to `on_complete` in this process, e.g. to store
+    them with the microscope's captures.
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int = 4, on_complete: Optional[Callable] = None, cache_dir: Optional[str] = None, history: int = 50):
+        """
+        Args:
+            workers (int): Number of worker processes.
+            max_pending (int): Maximum number of jobs queued or running at a time.
+            on_complete (callable, optional): Called as on_complete(job, fused) once a job has fused its stack,
+                returning the path of the stored image.
+            cache_dir (str, optional): Directory of the on-disk pyramid cache shared by the workers.
+            history (int): Number of finished jobs kept for status queries.
+        """
+        self.workers = workers
+        self.on_complete = on_complete
+        self.cache_dir = cache_dir
+        self.history = history
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _update(self, job: FusionJob, fraction: float):
+        with self._lock:
+            if job.status not in ("queued", "running"):
+                return
+            if job.status == "queued":
+                job.status, job.started = "running", time.time()
+            job.progress = fraction
+
+    def submit(self, directory: str, output_name: str = "fused.jpg", levels: int = 4, weights_alpha: float = 5, blur: int = 5, weight_pyramid: str = "gaussian", use_cache: bool = False, microscope=None, block: bool = True) -> FusionJob:
+        """
+        Queue the fusion of a stack directory.
+
+        Args:
+            use_cache (bool): Use the shared on-disk pyramid cache, only worth it when re-fusing a directory.
+            block (bool): Wait for a free slot if `max_pending` jobs are pending, otherwise raise queue.Full.
+
+        Returns:
+            FusionJob: The queued job.
+        """
+        if not self._slots.acquire(blocking=block):
+            raise queue.Full("Too many fusion jobs pending.")
+        params = {"output_name": output_name, "levels": levels, "weights_alpha": weights_alpha, "blur": blur, "weight_pyramid": weight_pyramid, "use_cache": use_cache}
+        job = FusionJob(directory, output_name, params, microscope)
+        with self._lock:
+            if self._pool is None:
+                self._pool = WorkerPool(self.workers, name="Focus Stack Fusion Job Worker")
+            self._jobs[job.id] = job
+            self._prune()
+            # A worker that dies (e.g. OOM-killed) fails its job through the future and is restarted
+            future = self._pool.submit(
+                "fusion_job",
+                directory,
+                levels,
+                weights_alpha,
+                blur,
+                weight_pyramid,
+                self.cache_dir if use_cache else None,
+                progress=lambda fraction: self._update(job, fraction),
+            )
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def _finish(self, job: FusionJob, future):
+        status, error, output = "completed", None, None
+        try:
+            fused, job.source_frames = future.result()
+            if self.on_complete:
+                output = self.on_complete(job, fused)
+        except Exception as e:
+            status, error = "failed", str(e)
+        with self._lock:
+            job.status, job.error, job.output = status, error, output
+            if status == "completed":
+                job.progress = 1.0
+            job.finished = time.time()
+            job.microscope = None
+        self._slots.release()
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished is not None]
+        for job in sorted(finished, key=lambda j: j.finished)[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[FusionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.submitted)
+
+    def shutdown(self):
+        """Wait for all pending jobs and stop the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,60 @@
+"""Fusion worker of the focus stack extension, started as a process of its own by WorkerPool.
+
+It registers this directory as the focusStack package without running its __init__, so only the fusion
+modules are imported, never LabThings or the microscope server (as multiprocessing's spawn would), and
+no server threads are forked. Requests (task, args, kwargs, report progress) are read from stdin as
+pickles. Replies are written to stdout: ("progress", fraction) while a task runs, then ("result", value)
+or ("error", message)."""
+import importlib
+import os
+import pickle
+import sys
+import types
+
+PACKAGE = "focusStack"
+
+
+def load_package():
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[PACKAGE] = package
+
+
+def tasks():
+    """Task name -> function, imported once the package is registered."""
+    fusion_jobs = importlib.import_module(f"{PACKAGE}.fusion_jobs")
+    tiled_fusion = importlib.import_module(f"{PACKAGE}.tiled_fusion")
+    return {
+        "fusion_job": fusion_jobs.run_fusion_job,
+        "tile": tiled_fusion.fuse_tile,
+    }
+
+
+def main():
+    # Replies get a copy of stdout; prints of the fusion code go to stderr instead of corrupting them
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        pickle.dump(message, replies, protocol=pickle.HIGHEST_PROTOCOL)
+        replies.flush()
+
+    load_package()
+    functions = tasks()
+    stdin = sys.stdin.buffer
+    while True:
+        try:
+            task, args, kwargs, report_progress = pickle.load(stdin)
+        except EOFError:  # The server closed the pipe
+            break
+        if report_progress:
+            kwargs["progress"] = lambda fraction: reply(("progress", fraction))
+        try:
+            reply(("result", functions[task](*args, **kwargs)))
+        except Exception as e:
+            reply(("error", f"{type(e).__name__}: {e}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import numpy as np
+import cv2
+
+from .pyramid_cache import PyramidCacheEntry
+
+
+def softmax(x, axis=0, alpha=1.0):
+    """
+    Compute the numerically stable softmax of an array along a specified axis,
+    with optional scaling exponent (alpha).
+
+    Args:
+        x (np.ndarray): Input array (e.g., sharpness mask stack).
+        axis (int, optional): Axis along which to compute softmax. Default: 0.
+        alpha (float, optional): Exponent for scaling ("temperature"). Default: 1.0.
+
+    Returns:
+        np.ndarray: Array of same shape as x, normalized along 'axis'.
+    """
+    x_max = np.max(x, axis=axis, keepdims=True)
+    e_x = np.exp(alpha * (x - x_max))
+    return e_x / np.sum(e_x, axis=axis, keepdims=True)
+
+
+def pad_to_multiple(img, divisor):
+    """
+    Pad an image so that its height and width become exact multiples of a given divisor.
+
+    This is necessary for constructing image pyramids, which require dimensions to be divisible by powers of two (or the chosen divisor).
+    Padding is added to the bottom and right edges, using reflected border pixels.
+
+    Args:
+        img (np.ndarray): Input image array (H x W x C or H x W).
+        divisor (int): The value to which height and width should be multiples.
+
+    Returns:
+        tuple:
+            - np.ndarray: The padded image.
+            - int: Original (unpadded) image height.
+            - int: Original (unpadded) image width.
+    """
+    h, w = img.shape[:2]
+    pad_h = (divisor - (h % divisor)) % divisor
+    pad_w = (divisor - (w % divisor)) % divisor
+    return cv2.copyMakeBorder(img, 0, int(pad_h), 0, int(pad_w), borderType=cv2.BORDER_REFLECT), h, w
+
+
+def build_lap_pyramid(img, levels):
+    """
+    Build a Laplacian pyramid from an input image.
+
+    Args:
+        img (np.ndarray): Input image (float32 or uint8).
+        levels (int): Number of pyramid levels.
+
+    Returns:
+        tuple:
+            - list of np.ndarray: Laplacian images, from highest to lowest resolution.
+            - list of tuple: Shapes (height, width) per level.
+    """
+    G = img.copy()
+    gp = [G]
+    sizes = [G.shape[:2]]
+    for i in range(levels):
+        G = cv2.pyrDown(G)
+        gp.append(G)
+        sizes.append(G.shape[:2])
+
+    lp = []
+    # Build pyramid so lp[0] is the largest (original) resolution
+    for i in range(levels):
+        GE = cv2.pyrUp(gp[i+1], dstsize=(gp[i].shape[1], gp[i].shape[0]))
+        L = cv2.subtract(gp[i], GE)
+        lp.append(L)
+    lp.append(gp[-1])  # Smallest level at the bottom
+    return lp, sizes
+
+
+def reconstruct_from_lap_pyramid(lp, sizes):
+    """
+    Reconstruct an image from a Laplacian pyramid.
+
+    Args:
+        lp (list of np.ndarray): Laplacian images, from highest to lowest resolution.
+        sizes (list of tuple): Original image shapes per level.
+
+    Returns:
+        np.ndarray: Reconstructed image (same shape as input image).
+    """
+    img = lp[-1]
+    for i in range(len(lp) - 2, -1, -1):
+        shape = sizes[i]
+        img = cv2.pyrUp(img)
+        img = img[:shape[0], :shape[1], ...]
+        L = lp[i]
+        L = L[:shape[0], :shape[1], ...]
+        if img.ndim != L.ndim:
+            if img.ndim == 3 and L.ndim == 2:
+                L = np.repeat(L[..., None], img.shape[2], axis=2)
+            elif img.ndim == 2 and L.ndim == 3:
+                img = np.repeat(img[..., None], L.shape[2], axis=2)
+        if img.dtype != L.dtype:
+            img = img.astype(np.float32)
+            L = L.astype(np.float32)
+        img = cv2.add(img, L)
+    return img
+
+
+def sharpness_map(img):
+    """
+    Compute the per-pixel hybrid sharpness (|Laplacian| + 0.5 * |Sobel|) of a BGR image.
+
+    Args:
+        img (np.ndarray): Input image (H x W x 3, BGR, float32 or uint8).
+
+    Returns:
+        np.ndarray: Sharpness map (H x W, float32).
+    """
+    if img.dtype not in (np.uint8, np.float32):
+        img = img.astype(np.float32)
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Hybrid sharpness: Laplacian + Sobel
+    lap = cv2.Laplacian(img_gray, cv2.CV_32F)
+    sobel = cv2.Sobel(img_gray, cv2.CV_32F, 1, 1, ksize=3)
+    np.abs(lap, out=lap)
+    np.abs(sobel, out=sobel)
+    return cv2.scaleAdd(sobel, 0.5, lap)
+
+
+def build_gauss_pyramid(img, levels):
+    """
+    Build a Gaussian pyramid from an input image.
+
+    Args:
+        img (np.ndarray): Input image.
+        levels (int): Number of pyramid levels.
+
+    Returns:
+        list of np.ndarray: Gaussian images, from highest to lowest resolution (levels + 1 entries).
+    """
+    gp = [img]
+    for i in range(levels):
+        gp.append(cv2.pyrDown(gp[-1]))
+    return gp
+
+
+def build_weight_pyramid(sharpness, levels, weight_pyramid="gaussian"):
+    """
+    Build the pyramid of blending weights from a sharpness map.
+
+    Args:
+        sharpness (np.ndarray): Sharpness map (H x W, float32).
+        levels (int): Number of pyramid levels.
+        weight_pyramid (str): "gaussian", or "laplacian" to reproduce the weights of earlier releases.
+
+    Returns:
+        list of np.ndarray: Weights per level, from highest to lowest resolution.
+    """
+    if weight_pyramid == "gaussian":
+        return build_gauss_pyramid(sharpness, levels)
+    if weight_pyramid == "laplacian":
+        return build_lap_pyramid(sharpness, levels)[0]
+    raise ValueError(f"Unknown weight pyramid: {weight_pyramid}")
+
+
+def softmax_inplace(x, alpha=1.0):
+    """
+    Softmax over the first axis of a float32 array, computed in place without full-size temporaries.
+
+    Args:
+        x (np.ndarray): Input array (N x ...), overwritten with the weights.
+        alpha (float, optional): Exponent for scaling ("temperature"). Default: 1.0.
+
+    Returns:
+        np.ndarray: x, normalized along axis 0.
+    """
+    x *= alpha
+    x -= x.max(axis=0)
+    # Clamp far below the maximum so exp never produces (slow) subnormal floats; such weights are < 1e-34 anyway
+    np.maximum(x, -80.0, out=x)
+    np.exp(x, out=x)
+    x /= x.sum(axis=0)
+    return x
+
+
+def fuse_lap_pyramid(frames, levels=4, weights_alpha=5, blur=5, weight_pyramid="gaussian", cache=None, keys=None, progress=None):
+    """
+    Fuse a Z-stack with a multi-scale Laplacian pyramid and sharpness-weighted blending.
+
+    The blending weights are a Gaussian pyramid of each slice's sharpness map, kept as one stacked
+    float32 array per level (N x h x w), smoothed and normalised with an in-place softmax. The colour
+    Laplacian pyramid of each slice is then built once and multiply-accumulated straight into the
+    fused pyramid, so no per-slice colour pyramids are kept in memory.
+
+    With a cache, each slice's colour Laplacian pyramid and raw sharpness map are looked up by key and
+    stored on a miss. Slices that hit the cache are never decoded, so re-fusing with different blending
+    parameters only redoes the blur/softmax/sum stage.
+
+    Args:
+        frames (sequence of np.ndarray): Stack images (H x W x 3, BGR), all of the same size.
+        levels (int): Number of pyramid levels
+        weights_alpha (float): Sharpness blending exponent (softmax alpha)
+        blur (int): Kernel size for mask smoothing (must be odd!)
+        weight_pyramid (str): "gaussian", or "laplacian" to reproduce the weights of earlier releases.
+        cache (PyramidCache or PyramidCacheSession, optional): Cache of per-slice pyramids.
+        keys (sequence of str, optional): Cache key of every slice, required with a cache.
+        progress (callable, optional): Called with the completed fraction (0 to 1) after every slice of both passes.
+
+    Returns:
+        np.ndarray: Fused image (uint8, BGR).
+    """
+    n = len(frames)
+    stack, weight_levels, shape = None, None, None
+
+    def slice_inputs(i):
+        frame, h, w = pad_to_multiple(np.asarray(frames[i]), 2 ** levels)
+        lp, sizes = build_lap_pyramid(frame.astype(np.float32), levels)
+        return PyramidCacheEntry(lp, sharpness_map(frame), (h, w)), frame
+
+    for i in range(n):
+        entry = cache.get(keys[i]) if cache is not None else None
+        frame = None
+        if entry is None:
+            if cache is not None:
+                entry, frame = slice_inputs(i)
+                cache.put(keys[i], entry)
+            else:
+                frame, h, w = pad_to_multiple(np.asarray(frames[i]), 2 ** levels)
+                entry = PyramidCacheEntry([], sharpness_map(frame), (h, w))
+        frame_shape = entry.lap_pyramid[0].shape if frame is None else frame.shape
+        if shape is None:
+            shape = frame_shape
+            orig_h, orig_w = entry.size
+            weight_levels = [np.empty((n,) + G.shape, dtype=np.float32) for G in build_gauss_pyramid(entry.sharpness, levels)]
+            if cache is None:
+                stack = np.empty((n,) + frame.shape, dtype=frame.dtype)
+        elif frame_shape != shape:
+            raise ValueError(f"Frame shape {frame_shape} does not match stack shape {shape}.")
+        if stack is not None:
+            stack[i] = frame
+        for level, weights in enumerate(build_weight_pyramid(entry.sharpness, levels, weight_pyramid)):
+            weight_levels[level][i] = weights
+        if progress:
+            progress((i + 1) / (2 * n))
+
+    for weights in weight_levels:
+        # Smooth sharpness map (avoid artifacts)
+        for i in range(n):
+            cv2.GaussianBlur(weights[i], (blur, blur), 0, dst=weights[i])
+        softmax_inplace(weights, alpha=weights_alpha)
+
+    fused_pyramid = [np.zeros(weights.shape[1:] + shape[2:], dtype=np.float32) for weights in weight_levels]
+    sizes = [weights.shape[1:3] for weights in weight_levels]
+    for i in range(n):
+        if stack is not None:
+            lp, _ = build_lap_pyramid(stack[i].astype(np.float32), levels)
+        else:
+            entry = cache.get(keys[i], count=False)
+            # Entries evicted since the first pass are rebuilt from the frame
+            lp = (entry if entry is not None else slice_inputs(i)[0]).lap_pyramid
+        for level in range(levels + 1):
+            weights = weight_levels[level][i]
+            if lp[level].ndim == 3:
+                weights = cv2.merge([weights] * lp[level].shape[2])
+            cv2.accumulateProduct(lp[level], weights, fused_pyramid[level])
+        if progress:
+            progress((n + i + 1) / (2 * n))
+
+    fused = reconstruct_from_lap_pyramid(fused_pyramid, sizes)
+    fused = np.clip(fused, 0, 255).astype(np.uint8)
+    return fused[:orig_h, :orig_w]
@@ -0,0 +1,188 @@
+import collections
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+def content_hash(data) -> str:
+    """SHA-1 of the raw bytes of a file's content or of a frame array."""
+    if isinstance(data, np.ndarray):
+        data = memoryview(np.ascontiguousarray(data)).cast("B")
+    return hashlib.sha1(data).hexdigest()
+
+
+class PyramidCacheEntry:
+    """Cached per-slice fusion inputs: colour Laplacian pyramid, raw sharpness map and unpadded frame size."""
+
+    def __init__(self, lap_pyramid: list, sharpness: np.ndarray, size: tuple):
+        self.lap_pyramid = lap_pyramid
+        self.sharpness = sharpness
+        self.size = tuple(size)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.lap_pyramid) + self.sharpness.nbytes
+
+
+class PyramidCache:
+    """
+    Content-addressed cache of per-slice Laplacian pyramids and sharpness maps.
+
+    Entries are keyed by the hash of the slice content and the number of pyramid levels, so re-fusing a
+    stack with different weights_alpha or blur only redoes the blur/softmax/sum stage. A thread-safe
+    in-memory LRU is backed by an optional on-disk store (one .npz file per entry); both are evicted
+    least-recently-used first once they exceed their byte budget.
+    """
+
+    def __init__(self, directory: Optional[str] = None, memory_budget: int = 256 * 2 ** 20, disk_budget: int = 1024 * 2 ** 20):
+        """
+        Args:
+            directory (str, optional): Directory of the on-disk store, None to keep the cache in memory only.
+            memory_budget (int): Maximum bytes held in memory.
+            disk_budget (int): Maximum bytes held on disk.
+        """
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(slice_hash: str, levels: int) -> str:
+        return f"{slice_hash}-L{levels}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key: str, count: bool = True) -> Optional[PyramidCacheEntry]:
+        """
+        Look up an entry, promoting it to the front of the memory LRU.
+
+        Args:
+            key (str): Cache key, see PyramidCache.key.
+            count (bool): Whether the lookup counts towards the hit/miss statistics.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None and self.directory and os.path.exists(self._path(key)):
+            try:
+                with np.load(self._path(key)) as data:
+                    levels = sum(1 for name in data.files if name.startswith("lap"))
+                    entry = PyramidCacheEntry(
+                        [data[f"lap{i}"] for i in range(levels)], data["sharpness"], tuple(data["size"])
+                    )
+                # Refresh the modification time, which orders disk eviction
+                os.utime(self._path(key))
+                self._remember(key, entry)
+            except (OSError, ValueError, KeyError):
+                entry = None
+        if count:
+            with self._lock:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: PyramidCacheEntry):
+        """Store an entry in memory and, if configured, on disk."""
+        self._remember(key, entry)
+        if self.directory and self.disk_budget > 0 and entry.nbytes <= self.disk_budget:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            arrays = {f"lap{i}": level for i, level in enumerate(entry.lap_pyramid)}
+            # Write under a temporary name so readers never see a partial file
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, sharpness=entry.sharpness, size=np.asarray(entry.size), **arrays)
+            os.replace(path + ".tmp", path)
+            self._evict_disk()
+
+    def _remember(self, key: str, entry: PyramidCacheEntry):
+        if entry.nbytes > self.memory_budget:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old.nbytes
+            self._memory[key] = entry
+            self._memory_bytes += entry.nbytes
+            while self._memory_bytes > self.memory_budget:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+
+    def _evict_disk(self):
+        # Other processes (fusion job workers) evict from the same directory, so files may vanish at any point
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Drop all entries from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def session(self) -> "PyramidCacheSession":
+        """A view of the cache with its own hit/miss counters, e.g. for one fusion run."""
+        return PyramidCacheSession(self)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_budget": self.memory_budget,
+                "disk_budget": self.disk_budget if self.directory else 0,
+            }
+
+
+class PyramidCacheSession:
+    """Delegates to a PyramidCache and counts the hits and misses of its own lookups."""
+
+    def __init__(self, cache: PyramidCache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, count: bool = True) -> Optional[PyramidCacheEntry]:
+        entry = self.cache.get(key, count=count)
+        if count:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: PyramidCacheEntry):
+        self.cache.put(key, entry)
@@ -0,0 +1,179 @@
+import json
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+import cv2
+
+from .stack_writer import read_stack_index
+from .pyramid_cache import content_hash
+
+STACK_FILE_NAME = "stack.zstk"
+
+MAGIC = b"OFZSTK01"
+# Frame data starts page-aligned after the fixed header, so slices can be memory-mapped directly
+DATA_OFFSET = 4096
+
+
+def prepare_frame(rgb: np.ndarray, resize: Optional[tuple] = None) -> np.ndarray:
+    """
+    Convert an RGB camera array to the BGR layout used for fusion, optionally resizing it.
+
+    Args:
+        rgb (np.ndarray): Frame as returned by camera.array (H x W x 3, RGB).
+        resize (tuple, optional): Target size as (width, height).
+
+    Returns:
+        np.ndarray: Frame as contiguous BGR uint8 array.
+    """
+    if resize is not None and (rgb.shape[1], rgb.shape[0]) != tuple(resize):
+        rgb = cv2.resize(rgb, tuple(resize), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+class StackFileWriter:
+    """
+    Writes a Z-stack into a single uncompressed container file.
+
+    Layout: an 8 byte magic, the 8 byte offset of a JSON footer and padding up to DATA_OFFSET,
+    followed by the raw frames (one chunk per Z slice, C order) and finally the JSON footer holding
+    shape, dtype, Z positions and per-frame metadata. Frames can be appended one at a time, so the
+    number of slices does not need to be known in advance.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.frame_shape = None
+        self.dtype = None
+        self.frames = []
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<Q", 0))
+        self._file.seek(DATA_OFFSET)
+
+    def append(self, frame: np.ndarray, entry: Optional[dict] = None):
+        """
+        Append one slice to the stack.
+
+        Args:
+            frame (np.ndarray): Lossless frame (H x W x C, BGR).
+            entry (dict, optional): Per-frame metadata, e.g. {"index", "z", "timestamp", "settle"}.
+        """
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+            self.dtype = frame.dtype
+        elif frame.shape != self.frame_shape or frame.dtype != self.dtype:
+            raise ValueError(f"Frame {frame.shape}/{frame.dtype} does not match stack {self.frame_shape}/{self.dtype}.")
+        self._file.write(np.ascontiguousarray(frame).tobytes())
+        self.frames.append(dict(entry or {}))
+
+    def close(self):
+        """Write the footer and close the file."""
+        if self._file.closed:
+            return
+        footer = {
+            "shape": [len(self.frames), *(self.frame_shape or ())],
+            "dtype": np.dtype(self.dtype or np.uint8).str,
+            "data_offset": DATA_OFFSET,
+            "channel_order": "BGR",
+            "z": [entry.get("z") for entry in self.frames],
+            "frames": self.frames,
+        }
+        footer_offset = self._file.tell()
+        self._file.write(json.dumps(footer).encode("utf-8"))
+        self._file.seek(len(MAGIC))
+        self._file.write(struct.pack("<Q", footer_offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StackFile:
+    """
+    Read-only view of a stack container, backed by np.memmap.
+
+    Indexing returns a slice of the memory map without copying or decoding, and `tile` returns the
+    same window of every slice, so fusion can work slice by slice or tile by tile.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(len(MAGIC) + 8)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a Z-stack container.")
+            footer_offset = struct.unpack("<Q", header[len(MAGIC):])[0]
+            if footer_offset == 0:
+                raise ValueError(f"{path} was not closed properly.")
+            f.seek(footer_offset)
+            footer = json.loads(f.read().decode("utf-8"))
+        self.shape = tuple(footer["shape"])
+        self.dtype = np.dtype(footer["dtype"])
+        self.frames = footer["frames"]
+        self.z_positions = footer["z"]
+        self.data = np.memmap(path, dtype=self.dtype, mode="r", offset=footer["data_offset"], shape=self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        return self.data[idx]
+
+    def tile(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """Return the window [y0:y1, x0:x1] of every slice as an (N x h x w x C) view."""
+        return self.data[:, y0:y1, x0:x1]
+
+    def content_hash(self, idx: int) -> str:
+        """Hash of the raw pixels of one slice."""
+        return content_hash(self.data[idx])
+
+
+class JpegStack:
+    """
+    Sequence of the JPEG frames of a stack directory, decoded lazily on access.
+
+    Frames are listed from the sidecar index if present, otherwise all .jpg files are used in sorted order.
+    """
+
+    def __init__(self, directory: str):
+        index = read_stack_index(directory)
+        if index:
+            files = [entry["file"] for entry in index]
+            self.z_positions = [entry.get("z") for entry in index]
+        else:
+            files = sorted([f for f in os.listdir(directory) if f.endswith(".jpg")])
+            self.z_positions = [None] * len(files)
+        self.paths = [os.path.join(directory, f) for f in files]
+        self.frames = index
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        return cv2.imread(self.paths[idx])
+
+    def tile(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """Return the window [y0:y1, x0:x1] of every slice. Every frame is fully decoded."""
+        return np.stack([self[i][y0:y1, x0:x1] for i in range(len(self))], axis=0)
+
+    def content_hash(self, idx: int) -> str:
+        """Hash of the encoded file of one slice, without decoding it."""
+        with open(self.paths[idx], "rb") as f:
+            return content_hash(f.read())
+
+
+def open_stack(directory: str):
+    """
+    Open the stack stored in a directory.
+
+    Returns:
+        StackFile if the directory holds a stack container, otherwise a JpegStack.
+    """
+    path = os.path.join(directory, STACK_FILE_NAME)
+    if os.path.exists(path):
+        return StackFile(path)
+    return JpegStack(directory)
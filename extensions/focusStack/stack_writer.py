@@ -0,0 +1,98 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+INDEX_NAME = "index.json"
+
+
+def write_stack_index(directory: str, entries: list):
+    """
+    Write the sidecar index of a Z-stack.
+
+    Args:
+        directory (str): Stack directory.
+        entries (list of dict): One entry per frame, e.g. {"index", "file", "z", "timestamp", "settle"}.
+    """
+    entries = sorted(entries, key=lambda e: e["index"])
+    with open(os.path.join(directory, INDEX_NAME), "w") as f:
+        json.dump({"frames": entries}, f, indent=1)
+
+
+def read_stack_index(directory: str) -> list:
+    """
+    Read the sidecar index of a Z-stack.
+
+    Returns:
+        list of dict: Frame entries sorted by index, or an empty list if the stack has no index.
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return sorted(json.load(f)["frames"], key=lambda e: e["index"])
+
+
+class StackWriter:
+    """
+    Writes captured frames of a Z-stack to disk on a background thread.
+
+    The encoded bytes coming from the camera are written unchanged, so there is no decode/re-encode
+    on the acquisition thread. Decoded frames (arrays) are appended to `stack_file` instead, e.g. a
+    StackFileWriter. The queue is bounded, so a slow disk throttles acquisition instead of filling up RAM.
+    """
+
+    def __init__(self, directory: str, max_pending: int = 8, stack_file=None):
+        self.directory = directory
+        self.stack_file = stack_file
+        self.entries = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="Focus Stack Writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self, filename: str, data: bytes, entry: dict):
+        """
+        Queue a frame for writing.
+
+        Args:
+            filename (str): File name inside the stack directory (ignored for arrays).
+            data (bytes or np.ndarray): Encoded image as returned by the camera, or a frame for the stack file.
+            entry (dict): Per-frame metadata for the sidecar index.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((filename, data, {**entry, "file": filename}))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            filename, data, entry = item
+            try:
+                if isinstance(data, np.ndarray):
+                    self.stack_file.append(data, entry)
+                else:
+                    with open(os.path.join(self.directory, filename), "wb") as f:
+                        f.write(data)
+                self.entries.append(entry)
+            except Exception as e:
+                self._error = e
+
+    def close(self):
+        """Wait until all queued frames are on disk and write the sidecar index."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.stack_file is not None:
+            self.stack_file.close()
+        write_stack_index(self.directory, self.entries)
+        if self._error is not None:
+            raise self._error
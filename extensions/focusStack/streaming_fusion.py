@@ -0,0 +1,150 @@
+import queue
+import threading
+
+import numpy as np
+import cv2
+
+from .pyramid import pad_to_multiple, build_lap_pyramid, build_weight_pyramid, reconstruct_from_lap_pyramid, sharpness_map
+
+
+class StreamingPyramidFuser:
+    """
+    Incremental Laplacian-pyramid focus fusion.
+
+    Instead of keeping the pyramids of every slice in memory, each frame is folded into a running
+    weighted accumulator per pyramid level. The softmax over the sharpness weights is computed online
+    with a running maximum and normaliser, so the result matches the batch softmax blend (up to rounding)
+    while memory stays constant in the number of frames.
+    """
+
+    def __init__(self, levels: int = 4, weights_alpha: float = 5, blur: int = 5, weight_pyramid: str = "gaussian"):
+        """
+        Args:
+            levels (int): Number of pyramid levels.
+            weights_alpha (float): Sharpness blending exponent (softmax alpha).
+            blur (int): Kernel size for mask smoothing (must be odd!)
+            weight_pyramid (str): "gaussian", or "laplacian" to reproduce the weights of earlier releases.
+        """
+        self.levels = levels
+        self.weights_alpha = weights_alpha
+        self.blur = blur
+        self.weight_pyramid = weight_pyramid
+        self.frames = 0
+        self.shape = None
+        self.orig_h, self.orig_w = None, None
+        self.sizes = None
+        # Per level: running max of the scaled sharpness, softmax normaliser and weighted sum
+        self._max = []
+        self._norm = []
+        self._acc = []
+
+    def add(self, img: np.ndarray):
+        """
+        Fold a single BGR frame into the running blend.
+
+        Args:
+            img (np.ndarray): Stack image (H x W x 3, BGR).
+        """
+        img, h, w = pad_to_multiple(img, 2 ** self.levels)
+        if self.shape is None:
+            self.shape = img.shape
+            self.orig_h, self.orig_w = h, w
+        elif img.shape != self.shape:
+            raise ValueError(f"Frame shape {img.shape} does not match stack shape {self.shape}.")
+        sharpness_pyramid = build_weight_pyramid(sharpness_map(img), self.levels, self.weight_pyramid)
+        pyramid, sizes = build_lap_pyramid(img.astype(np.float32), self.levels)
+
+        for level in range(self.levels + 1):
+            lap = pyramid[level]
+            # Smooth sharpness map (avoid artifacts) and scale it by the softmax exponent
+            sharp = cv2.GaussianBlur(sharpness_pyramid[level], (self.blur, self.blur), 0)
+            sharp *= self.weights_alpha
+            if self.frames == 0:
+                self._max.append(sharp)
+                self._norm.append(np.ones_like(sharp))
+                self._acc.append(lap.copy())
+                continue
+            new_max = np.maximum(self._max[level], sharp)
+            # Rescale what has been accumulated so far to the new running maximum. Exponents are clamped
+            # so exp never produces (slow) subnormal floats; such weights are < 1e-34 anyway.
+            scale = np.exp(np.maximum(self._max[level] - new_max, -80.0))
+            e_x = np.exp(np.maximum(sharp - new_max, -80.0))
+            self._norm[level] *= scale
+            self._norm[level] += e_x
+            if lap.ndim == 3:
+                scale, e_x = scale[..., None], e_x[..., None]
+            self._acc[level] *= scale
+            self._acc[level] += e_x * lap
+            self._max[level] = new_max
+
+        if self.sizes is None:
+            self.sizes = sizes
+        self.frames += 1
+
+    def result(self) -> np.ndarray:
+        """
+        Reconstruct the all-in-focus image from the accumulated pyramid.
+
+        Returns:
+            np.ndarray: Fused image (uint8, BGR), cropped to the original frame size.
+        """
+        if self.frames == 0:
+            raise ValueError("No frames have been added to the fuser.")
+        fused_pyramid = []
+        for acc, norm in zip(self._acc, self._norm):
+            fused_pyramid.append(acc / (norm[..., None] if acc.ndim == 3 else norm))
+        fused = reconstruct_from_lap_pyramid(fused_pyramid, self.sizes)
+        fused = np.clip(fused, 0, 255).astype(np.uint8)
+        return fused[:self.orig_h, :self.orig_w]
+
+
+class StreamingFusionWorker:
+    """
+    Runs a StreamingPyramidFuser in a background thread, so that each frame is decoded and blended
+    while the stage is already moving to the next Z position.
+
+    The frame queue is bounded: if fusion falls behind, `submit` blocks the acquisition instead of
+    buffering an unbounded number of frames.
+    """
+
+    def __init__(self, fuser: StreamingPyramidFuser, max_pending: int = 2):
+        self.fuser = fuser
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="Focus Stack Fusion", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, frame):
+        """Queue a frame for fusion, either as encoded image bytes or as a decoded BGR array."""
+        self._queue.put(frame)
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is not None:
+                # Keep draining so the producer never blocks on a failed worker
+                continue
+            try:
+                if not isinstance(frame, np.ndarray):
+                    frame = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+                self.fuser.add(frame)
+            except Exception as e:
+                self._error = e
+
+    def finish(self) -> np.ndarray:
+        """Wait for all queued frames to be fused and return the fused image."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.fuser.result()
+
+    def cancel(self):
+        """Stop the worker without building a result."""
+        self._queue.put(None)
+        self._thread.join()
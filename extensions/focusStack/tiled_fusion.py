@@ -0,0 +1,135 @@
+import math
+import os
+import numpy as np
+
+from .stack_file import StackFile, StackFileWriter, open_stack
+from .streaming_fusion import StreamingPyramidFuser
+from .worker_pool import WorkerPool
+
+# Rough peak working set of StreamingPyramidFuser per tile pixel: the float32 colour and sharpness
+# pyramids of the current slice plus the running accumulator, max and normaliser of every level.
+BYTES_PER_TILE_PIXEL = 160
+
+TEMP_STACK_NAME = ".tiled_fusion.zstk"
+
+
+def tile_halo(levels: int, blur: int) -> int:
+    """
+    Halo (in full resolution pixels) needed around a tile so that its core fuses exactly like the full frame.
+
+    Each pyramid level widens the footprint of the 5x5 pyrDown/pyrUp kernels and of the mask blur by a
+    factor of two, so the halo grows with 2 ** levels. It is kept a multiple of 2 ** levels so that the
+    pyramid sampling grid of every tile lines up with the full frame.
+    """
+    return (4 + blur // 2) * 2 ** levels
+
+
+def plan_tiles(height: int, width: int, tile_size: int, halo: int):
+    """
+    Split a frame into tiles.
+
+    Returns:
+        list of tuple: ((y0, y1, x0, x1) core box, (y0, y1, x0, x1) box including halo) per tile.
+    """
+    tiles = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            core = (y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width))
+            padded = (max(core[0] - halo, 0), min(core[1] + halo, height), max(core[2] - halo, 0), min(core[3] + halo, width))
+            tiles.append((core, padded))
+    return tiles
+
+
+def auto_tile_size(height: int, width: int, workers: int, memory_budget: int, halo: int, align: int) -> int:
+    """
+    Largest tile edge (a multiple of `align`) for which `workers` tiles including halos fit into `memory_budget` bytes.
+    """
+    pixels_per_worker = memory_budget / (max(workers, 1) * BYTES_PER_TILE_PIXEL)
+    edge = int(math.sqrt(pixels_per_worker)) - 2 * halo
+    edge = max(align, edge // align * align)
+    return min(edge, max(height, width))
+
+
+def fuse_tile(path: str, core: tuple, padded: tuple, levels: int, weights_alpha: float, blur: int) -> np.ndarray:
+    """
+    Fuse one tile of a stack container. Runs in a fusion_worker.py process.
+
+    Returns:
+        np.ndarray: Fused core region of the tile (uint8, BGR).
+    """
+    stack = StackFile(path)
+    window = stack.tile(*padded)
+    fuser = StreamingPyramidFuser(levels=levels, weights_alpha=weights_alpha, blur=blur)
+    for i in range(len(stack)):
+        fuser.add(np.ascontiguousarray(window[i]))
+    fused = fuser.result()
+    y0, x0 = core[0] - padded[0], core[2] - padded[2]
+    return fused[y0:y0 + core[1] - core[0], x0:x0 + core[3] - core[2]]
+
+
+def fuse_stack_tiled(
+    directory: str,
+    levels: int = 4,
+    weights_alpha: float = 5,
+    blur: int = 5,
+    tile_size: int = 0,
+    workers: int = 0,
+    memory_budget: int = 256 * 2 ** 20,
+):
+    """
+    Fuse a stack tile by tile in worker processes (see WorkerPool).
+
+    Every tile is read from a memory-mapped stack container together with a halo sized to the pyramid depth,
+    fused independently and only its core is copied into the output, so the result is seamless. Peak memory
+    is bounded by the tile size and the number of workers instead of frame size times slice count.
+    JPEG stacks are decoded once into a temporary container first.
+
+    Args:
+        directory (str): Stack directory.
+        levels (int): Number of pyramid levels.
+        weights_alpha (float): Sharpness blending exponent (softmax alpha).
+        blur (int): Kernel size for mask smoothing (must be odd!)
+        tile_size (int): Tile edge in pixels, 0 to derive it from the memory budget.
+        workers (int): Number of worker processes, 0 for one per CPU core.
+        memory_budget (int): Bytes the tile workers may use together.
+
+    Returns:
+        tuple: (fused image (uint8, BGR), number of slices, number of tiles)
+    """
+    workers = workers or os.cpu_count() or 1
+    stack = open_stack(directory)
+    if not len(stack):
+        raise ValueError("No images found in directory.")
+
+    temp_path = None
+    if isinstance(stack, StackFile):
+        path = stack.path
+    else:
+        temp_path = path = os.path.join(directory, TEMP_STACK_NAME)
+        with StackFileWriter(path) as writer:
+            for i in range(len(stack)):
+                writer.append(stack[i])
+        stack = StackFile(path)
+
+    try:
+        n, height, width = stack.shape[:3]
+        align = 2 ** levels
+        halo = tile_halo(levels, blur)
+        if tile_size:
+            tile_size = max(align, tile_size // align * align)
+        else:
+            tile_size = auto_tile_size(height, width, workers, memory_budget, halo, align)
+        tiles = plan_tiles(height, width, tile_size, halo)
+
+        fused = np.empty(stack.shape[1:], dtype=np.uint8)
+        with WorkerPool(min(workers, len(tiles)), name="Focus Stack Tile Worker") as pool:
+            futures = [
+                (core, pool.submit("tile", path, core, padded, levels, weights_alpha, blur))
+                for core, padded in tiles
+            ]
+            for (y0, y1, x0, x1), future in futures:
+                fused[y0:y1, x0:x1] = future.result()
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+    return fused, n, len(tiles)
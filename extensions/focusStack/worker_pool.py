@@ -0,0 +1,117 @@
+import concurrent.futures
+import logging
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from typing import Callable, Optional
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fusion_worker.py")
+
+
+class WorkerPool:
+    """
+    Runs fusion tasks in fusion_worker.py processes.
+
+    The workers are started as scripts of their own rather than forked by multiprocessing, so they neither
+    inherit the threads and locks of the running server nor re-import it. Every worker is fed by a thread
+    of this process that hands it the next queued task once it has finished the previous one. A worker
+    that dies fails its current task only and is restarted for the next.
+    """
+
+    def __init__(self, processes: int = 1, name: str = "Focus Stack Worker"):
+        self.processes = max(1, processes)
+        self.name = name
+        self._tasks = queue.Queue()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._serve, name=name, daemon=True) for _ in range(self.processes)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(cancel=exc[0] is not None)
+
+    def submit(self, task: str, *args, progress: Optional[Callable[[float], None]] = None, **kwargs) -> concurrent.futures.Future:
+        """
+        Queue a task of fusion_worker.TASKS.
+
+        Args:
+            progress (callable, optional): Called with the progress fraction reported by the task, on a pool thread.
+
+        Returns:
+            concurrent.futures.Future: Result of the task.
+        """
+        if self._closed:
+            raise RuntimeError("Worker pool is closed")
+        future = concurrent.futures.Future()
+        self._tasks.put((future, (task, args, kwargs, progress is not None), progress))
+        return future
+
+    @staticmethod
+    def _start_worker():
+        return subprocess.Popen([sys.executable, WORKER_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _serve(self):
+        process = None
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                break
+            future, request, progress = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            if process is None or process.poll() is not None:
+                try:
+                    process = self._start_worker()
+                except OSError as e:
+                    future.set_exception(e)
+                    continue
+            try:
+                pickle.dump(request, process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                process.stdin.flush()
+                while True:
+                    kind, value = pickle.load(process.stdout)
+                    if kind != "progress":
+                        break
+                    if progress:
+                        progress(value)
+            except (EOFError, OSError, pickle.UnpicklingError):
+                logging.warning(f"{self.name} process exited, restarting it for the next task")
+                process.kill()
+                process.wait()
+                future.set_exception(RuntimeError(f"{self.name} process exited"))
+                continue
+            if kind == "error":
+                future.set_exception(RuntimeError(value))
+            else:
+                future.set_result(value)
+        if process is not None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def close(self, cancel: bool = False):
+        """
+        Stop the workers once the queued tasks are done, or with `cancel`, once their current task is done.
+        Waits for them to exit.
+        """
+        self._closed = True
+        if cancel:
+            while True:
+                try:
+                    item = self._tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,196 @@
+import atexit
+import concurrent.futures
+import itertools
+import logging
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_worker.py")
+
+
+def image_features(img_size, keypoints, descriptors):
+    """cv2.detail.ImageFeatures from the arrays sent by a worker (keypoints do not pickle)."""
+    features = cv2.detail.ImageFeatures()
+    features.img_idx = 0
+    features.img_size = img_size
+    features.keypoints = tuple(
+        cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in keypoints
+    )
+    features.descriptors = cv2.UMat(descriptors)
+    return features
+
+
+class FrameRing:
+    def __init__(self, slots, slot_size):
+        """Fixed slots of one shared memory block for handing frames to the workers without pickling them.
+        A slot is taken by write() and given back by release() once the worker is done with it."""
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.slots = slots
+        self.slot_size = slot_size
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+    @property
+    def busy(self):
+        return self.slots - self._free.qsize()
+
+    def write(self, img):
+        """Copy img into a free slot, waiting for one if all are busy. Returns the slot."""
+        slot = self._free.get()
+        view = np.ndarray(img.shape, dtype=img.dtype, buffer=self.shm.buf, offset=slot * self.slot_size)
+        view[...] = img
+        del view
+        return slot
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _Worker:
+    """One feature_worker.py process and the thread reading its replies."""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_PATH], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.pending = {}  # Request id -> (future, slot)
+        self._lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read, name="Mini Map Feature Reader", daemon=True)
+        self.reader.start()
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, request_id, slot, img):
+        future = concurrent.futures.Future()
+        with self._lock:
+            self.pending[request_id] = (future, slot)
+        request = (request_id, self.ring.shm.name, slot * self.ring.slot_size, img.shape, img.dtype.str)
+        try:
+            pickle.dump(request, self.process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+            self.process.stdin.flush()
+        except OSError:
+            logging.warning("Mini map feature worker is not running")
+            with self._lock:
+                pending = self.pending.pop(request_id, None)
+            if pending is not None:
+                self.ring.release(slot)
+                future.set_exception(RuntimeError("Mini map feature worker is not running"))
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                request_id, result, error = pickle.load(self.process.stdout)
+            except (EOFError, OSError, pickle.UnpicklingError):
+                break
+            with self._lock:
+                future, slot = self.pending.pop(request_id)
+            self.ring.release(slot)
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(image_features(*result))
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        for future, slot in pending.values():
+            self.ring.release(slot)
+            future.set_exception(RuntimeError("Mini map feature worker exited"))
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class FeaturePool:
+    def __init__(self, processes=2, slots_per_process=2):
+        """Extracts SIFT features in worker processes, so detection runs on other cores and does not hold the
+        GIL of the server. Frames are handed over in the slots of a shared memory FrameRing sized for the first
+        frame; submit() waits while all slots are busy, which bounds the frames in flight. With processes=0,
+        and for frames larger than a slot, features are extracted in the calling thread."""
+        self.processes = processes
+        self.slots_per_process = slots_per_process
+        self.local = 0  # Frames extracted in process
+        self._ring = None
+        self._workers = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._detector = None
+
+    def _start(self, slot_size):
+        self._ring = FrameRing(self.processes * self.slots_per_process, slot_size)
+        self._workers = [_Worker(self._ring) for _ in range(self.processes)]
+        atexit.register(self.close)
+        logging.info(f"Started {self.processes} mini map feature workers")
+
+    def _worker(self):
+        """The running worker with the fewest requests pending, restarting workers that died."""
+        for i, worker in enumerate(self._workers):
+            if not worker.alive:
+                logging.warning("Restarting mini map feature worker")
+                self._workers[i] = _Worker(self._ring)
+        return min(self._workers, key=lambda w: len(w.pending))
+
+    def extract_local(self, img):
+        if self._detector is None:
+            self._detector = cv2.SIFT.create()
+        self.local += 1
+        return cv2.detail.computeImageFeatures2(self._detector, img)
+
+    def submit(self, img):
+        """Start extracting the features of img. Returns a future of its cv2.detail.ImageFeatures."""
+        img = np.ascontiguousarray(img)
+        with self._lock:
+            if self.processes > 0 and self._ring is None:
+                self._start(img.nbytes)
+            ring = self._ring
+        if ring is None or img.nbytes > ring.slot_size:
+            future = concurrent.futures.Future()
+            future.set_result(self.extract_local(img))
+            return future
+        slot = ring.write(img)
+        with self._lock:
+            return self._worker().send(next(self._ids), slot, img)
+
+    def extract(self, img):
+        """Features of img, computed by a worker."""
+        return self.submit(img).result()
+
+    def stats(self):
+        return {
+            "processes": self.processes,
+            "running": sum(w.alive for w in self._workers),
+            "busy_slots": self._ring.busy if self._ring else 0,
+            "extracted_locally": self.local,
+        }
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._workers = []
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
@@ -0,0 +1,65 @@
+"""Feature extraction worker of the mini map, started as a process of its own by FeaturePool.
+
+It is a standalone script without package imports, so starting it neither re-imports the microscope server
+(as multiprocessing's spawn would) nor forks its threads. Requests (request id, shared memory name, offset,
+shape, dtype) are read from stdin as pickles, the frame itself is read from the shared memory. Replies
+(request id, (image size, keypoints, descriptors), error) are written to stdout."""
+import pickle
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+
+def attach(name):
+    """Attach to a shared memory block owned by the server process."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        # Otherwise the resource tracker of this process would unlink the block when it exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def extract(detector, img):
+    """SIFT features of img as (image size, keypoints as an N x 7 array, descriptors)."""
+    features = cv2.detail.computeImageFeatures2(detector, img)
+    keypoints = np.array(
+        [(*k.pt, k.size, k.angle, k.response, k.octave, k.class_id) for k in features.keypoints],
+        dtype=np.float64,
+    ).reshape(-1, 7)
+    descriptors = features.descriptors
+    if isinstance(descriptors, cv2.UMat):
+        descriptors = descriptors.get()
+    return tuple(features.img_size), keypoints, descriptors
+
+
+def main():
+    cv2.setNumThreads(1)  # One core per worker, the number of workers decides how many cores are used
+    detector = cv2.SIFT.create()
+    blocks = {}
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    while True:
+        try:
+            request_id, name, offset, shape, dtype = pickle.load(stdin)
+        except EOFError:  # The server closed the pipe
+            break
+        result, error = None, None
+        try:
+            if name not in blocks:
+                blocks[name] = attach(name)
+            img = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf, offset=offset)
+            result = extract(detector, img)
+            del img  # The block cannot be closed while a view on it exists
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        pickle.dump((request_id, result, error), stdout, protocol=pickle.HIGHEST_PROTOCOL)
+        stdout.flush()
+    for shm in blocks.values():
+        shm.close()
+
+
+if __name__ == "__main__":
+    main()
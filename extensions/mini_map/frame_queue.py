@@ -0,0 +1,94 @@
+import collections
+import dataclasses
+import itertools
+import threading
+
+POLICIES = ("drop-oldest", "latest-per-region", "skip-covered")
+
+
+@dataclasses.dataclass
+class Frame:
+    img: object
+    pos: tuple
+    region: tuple  # Cell of the map the frame was taken in, see LiveMapper.region
+    captured: float  # time.monotonic() when the capture finished
+
+
+class FrameQueue:
+    def __init__(self, maxsize=8, policy="latest-per-region", covered=None):
+        """Bounded queue of captured frames waiting for the stitcher, so a stitcher falling behind fast stage moves
+        costs at most maxsize frames of memory. When it is full, the oldest frame is dropped. On top of that:
+
+        - "drop-oldest": nothing else.
+        - "latest-per-region": a new frame replaces a queued frame of the same region (at its place in the
+          queue), so the map shows the latest view of every region and one region is not stitched twice.
+        - "skip-covered": frames of a region already queued, or for which covered(pos) is true (the map has
+          it already), are not queued at all."""
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.covered = covered
+        self.dropped = collections.Counter()  # Reason -> number of frames not stitched
+        self.queued = 0
+        self._frames = collections.OrderedDict()  # Region (or unique key) -> frame, oldest first
+        self._keys = itertools.count()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        """Queue a frame according to the policy. Returns False if it was not queued."""
+        with self._condition:
+            if self.policy == "skip-covered" and (
+                any(queued.region == frame.region for queued in self._frames.values())
+                or (self.covered is not None and self.covered(frame.pos))
+            ):
+                self.dropped["covered"] += 1
+                return False
+            if self.policy == "latest-per-region":
+                key = frame.region
+                if key in self._frames:
+                    self.dropped["replaced"] += 1
+            else:
+                key = (frame.region, next(self._keys))
+            self._frames[key] = frame
+            while len(self._frames) > max(self.maxsize, 1):
+                self._frames.popitem(last=False)
+                self.dropped["oldest"] += 1
+            self.queued += 1
+            self._condition.notify()
+            return True
+
+    def get(self, block=True):
+        """Oldest queued frame. Waits until there is one, or returns None if there is none and block is False."""
+        with self._condition:
+            while not self._frames:
+                if not block:
+                    return None
+                self._condition.wait()
+            return self._frames.popitem(last=False)[1]
+
+
+class StageTimes:
+    def __init__(self, window=100):
+        """Durations of the pipeline stages of the last `window` frames, in seconds."""
+        self._times = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def add(self, **durations):
+        for stage, duration in durations.items():
+            self._times[stage].append(duration)
+
+    def summary(self):
+        """Mean and maximum duration per stage, in milliseconds."""
+        return {
+            stage: {
+                "mean_ms": 1000 * sum(times) / len(times),
+                "max_ms": 1000 * max(times),
+                "count": len(times),
+            }
+            for stage, times in list(self._times.items())
+            if times
+        }
+
@@ -1,52 +1,123 @@
+import collections
 import logging
 import math
-import queue
 import threading
 import time
 
 import cv2
 
+from .feature_pool import FeaturePool
+from .frame_queue import Frame, FrameQueue, StageTimes
+from .map_events import MapEventPublisher
+from .placement import StageCalibration
 from .stitcher import LiveStitching
+from .tile_pyramid import TilePyramid
+
+CALIBRATION_PATH = "/var/openflexure/extensions/microscope_extensions/mini_map/calibration.json"
 
 
 class LiveMapper:
     """Handles live mini map mapping by splitting camera capture and stitching via an image queue.
-    This aims to get all images needed for a reconstruction of a movement."""
-
-    DISTANCE = 800  # Distance to capture image
-
-    def __init__(self, microscope):
+    This aims to get all images needed for a reconstruction of a movement. The queue is bounded, see FrameQueue
+    for what happens to frames the stitcher cannot keep up with."""
+
+    DISTANCE = 800  # Distance to capture image, until the field of view is known
+    COVERED = 0.9  # Fraction of a frame the map must cover to skip it with the "skip-covered" policy
+
+    def __init__(self, microscope, policy="latest-per-region", max_queued=8, overlap=0.5, processes=2):
+        """
+        :param policy: What to do with frames the stitcher cannot keep up with, see FrameQueue
+        :param max_queued: Maximum number of frames waiting for the stitcher
+        :param overlap: Overlap of consecutive frames; once the field of view is known, a frame is captured
+            every (1 - overlap) of it
+        :param processes: Number of worker processes extracting features, 0 to extract them in this process
+        """
         self.microscope = microscope
-        self.queue = queue.Queue()
+        self.stitcher = LiveStitching(calibration=StageCalibration(CALIBRATION_PATH))
+        self.pool = FeaturePool(processes=processes)
+        self.stitcher.extract_features = self.pool.extract
+        self.queue = FrameQueue(
+            maxsize=max_queued,
+            policy=policy,
+            covered=lambda pos: self.stitcher.coverage(pos) >= LiveMapper.COVERED,
+        )
+        self.overlap = overlap
+        self.pyramid = TilePyramid(self.stitcher.canvas)
+        self.events = MapEventPublisher()
+        self.times = StageTimes()
+        self.failed = 0
+        self._map_png = (None, None)  # (map version, PNG of the whole map)
 
     @staticmethod
     def get_distance(pos1, pos2):
         return math.sqrt((pos2[0] - pos1[0]) ** 2 + (pos2[1] - pos1[1]) ** 2)
 
+    def capture_distance(self):
+        """Stage distance between captures: a fixed part of the field of view if known, else DISTANCE."""
+        footprint = self.stitcher.footprint
+        if footprint is None:
+            return LiveMapper.DISTANCE
+        return (1 - self.overlap) * min(footprint)
+
+    def region(self, pos):
+        """Cell of a field of view sized grid over the stage that pos lies in."""
+        w, h = self.stitcher.footprint or (LiveMapper.DISTANCE, LiveMapper.DISTANCE)
+        return math.floor(pos[0] / w + 0.5), math.floor(pos[1] / h + 0.5)
+
+    def _extract(self, frame):
+        """Start extracting the features of a frame in the pool, if the stitcher will need them."""
+        img = cv2.cvtColor(frame.img, cv2.COLOR_RGB2BGR)
+        future = self.pool.submit(img) if self.stitcher.needs_features() else None
+        return frame, img, future, time.monotonic()
+
+    def _place(self, frame, img, future, dequeued):
+        start = time.monotonic()
+        try:
+            logging.debug("Try stitching image")
+
+            features = None
+            if future is not None:
+                try:
+                    features = future.result()
+                except RuntimeError:
+                    # The stitcher extracts them again, the pool restarts dead workers
+                    logging.exception("Feature extraction failed")
+            extracted = time.monotonic()
+            touched = self.stitcher.add_image(img, frame.pos[:2], features)
+            stitched = time.monotonic()
+            if touched is None:
+                self.failed += 1
+            # Only the tiles covered by the new image (and their ancestors) change
+            self.pyramid.update(touched)
+            self.events.publish(self.pyramid, touched)
+            done = time.monotonic()
+            self.times.add(
+                wait=dequeued - frame.captured,
+                features=extracted - start,
+                stitch=stitched - extracted,
+                update=done - stitched,
+                total=done - frame.captured,
+            )
+
+        except Exception as e:
+            self.failed += 1
+            logging.exception("Failed to add image")
+
     def worker(self):
-        """Working on queue and adding to live stitcher. Runs in thread"""
+        """Working on queue and adding to live stitcher. Runs in thread. Features of the next frames are
+        extracted by the pool while this thread places the current one, so placement stays serialised and in
+        capture order."""
+        in_flight = collections.deque()
         while True:
-            img, pos = self.queue.get()
-
-            try:
-                logging.debug("Try stitching image")
-
-                new_img = self.stitcher.add_image(
-                    cv2.cvtColor(img, cv2.COLOR_RGB2BGR), pos[:2]
-                )
-                cv2.imwrite(
-                    "/var/openflexure/extensions/microscope_extensions/mini_map/map.png",
-                    new_img,
-                )
-
-            except Exception as e:
-                logging.exception("Failed to add image")
-
-            self.queue.task_done()
+            while len(in_flight) < max(self.pool.processes, 1):
+                frame = self.queue.get(block=not in_flight)
+                if frame is None:
+                    break
+                in_flight.append(self._extract(frame))
+            self._place(*in_flight.popleft())
 
     def loop(self):
         """Capture images when distance requirement is met"""
-        self.stitcher = LiveStitching()
         worker = threading.Thread(target=self.worker)
         worker.start()
 
@@ -56,17 +127,48 @@ class LiveMapper:
 
             if (
                 last_pos is None
-                or LiveMapper.get_distance(pos, last_pos) > LiveMapper.DISTANCE
+                or LiveMapper.get_distance(pos, last_pos) > self.capture_distance()
             ):
                 last_pos = pos
+                start = time.monotonic()
                 img = self.microscope.camera.array(
                     use_video_port=True
                 )  # Captures image from video stream expects low res image for minimal cpu and memory usage
+                captured = time.monotonic()
+                self.times.add(capture=captured - start)
 
-                self.queue.put((img, pos))
+                self.queue.put(Frame(img, tuple(pos), self.region(pos), captured))
 
             time.sleep(0.2)
 
+    def stats(self):
+        """Queue state, dropped frames and the duration of every pipeline stage over the last frames."""
+        return {
+            "policy": self.queue.policy,
+            "max_queued": self.queue.maxsize,
+            "overlap": self.overlap,
+            "capture_distance": self.capture_distance(),
+            "queue_depth": len(self.queue),
+            "queued": self.queue.queued,
+            "dropped": dict(self.queue.dropped),
+            "failed": self.failed,
+            "placements": dict(self.stitcher.placements),
+            "feature_workers": self.pool.stats(),
+            "times": self.times.summary(),
+        }
+
+    def map_png(self):
+        """The whole map as PNG, or None if it is empty. Its cost grows with the map area, so it is only
+        encoded on request and kept until the map changes."""
+        version, png = self._map_png
+        if version != self.pyramid.version:
+            version = self.pyramid.version
+            image = self.stitcher.render()
+            png = None if image is None else cv2.imencode(".png", image)[1].tobytes()
+            self._map_png = (version, png)
+        return png
+
     def start_thread(self):
+        self.events.start_thread()
         self.thread = threading.Thread(target=self.loop, name="Live Mapper")
         self.thread.start()
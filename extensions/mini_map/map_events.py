@@ -0,0 +1,66 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from websockets.sync.client import connect
+
+WEBSOCKET_URL = "ws://localhost:6789"  # Websocket server of the controller and stage control extension
+
+
+def dirty_rect(touched, tile_size):
+    """Canvas pixel rectangle (x0, y0, x1, y1) covered by the changed level 0 tiles. A pasted image always
+    changes a rectangular block of tiles, so a client can tell the changed tiles of every pyramid level from it."""
+    xs = [tx for tx, _ in touched]
+    ys = [ty for _, ty in touched]
+    return [min(xs) * tile_size, min(ys) * tile_size, (max(xs) + 1) * tile_size, (max(ys) + 1) * tile_size]
+
+
+class MapEventPublisher:
+    """Publishes "map" events (map version, dirty rectangle and bounds) through the websocket server, so web
+    clients only fetch the tiles that changed instead of polling the manifest. Events are sent from a thread of
+    their own, so the stitching never waits for the network. If the queue is full (e.g. while the server is not
+    reachable) events are dropped, clients notice the gap in the versions and catch up from the manifest."""
+
+    TOPIC = "map"
+
+    def __init__(self, url=WEBSOCKET_URL, retry=5.0, max_pending=100):
+        self.url = url
+        self.retry = retry
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.thread = None
+
+    def publish(self, pyramid, touched):
+        """Queue the event for an update of the pyramid by the given level 0 tiles."""
+        if not touched:
+            return
+        payload = {
+            "version": pyramid.version,
+            "dirty": dirty_rect(touched, pyramid.canvas.tile_size),
+            "bounds": pyramid.canvas.bounds,
+        }
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            try:
+                with connect(self.url, open_timeout=1) as connection:
+                    # This connection only sends, joystick input would pile up unread
+                    connection.send(json.dumps({"unsubscribe": ["input"]}))
+                    while True:
+                        payload = self.queue.get()
+                        connection.send(json.dumps({"publish": self.TOPIC, "payload": payload}))
+            except Exception as e:
+                logging.debug(f"Map events not published, websocket server unavailable: {e}")
+            time.sleep(self.retry)
+
+    def start_thread(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name="Mini Map Events", daemon=True)
+        self.thread.start()
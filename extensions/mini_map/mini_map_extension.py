@@ -1,21 +1,26 @@
-import os
-
-from flask import send_file
+from flask import Response, request
+from labthings import fields, find_extension
 from labthings.extensions import BaseExtension
-from labthings.views import View
+from labthings.views import PropertyView, View
 
+from .frame_queue import POLICIES
 from .live_mapper import LiveMapper
 
-STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
-
 
 class MiniMapExtension(BaseExtension):
     def __init__(self):
-        super().__init__("de.hs-flensburg.mini-map", version="0.0.0")
+        super().__init__("de.hs-flensburg.mini-map", version="0.1.0")
+
+        self.live_mapper = None
 
         self.on_component("org.openflexure.microscope", self.register)
 
         self.add_view(MiniMapView, "/map")
+        self.add_view(MiniMapManifestView, "/manifest")
+        self.add_view(MiniMapPipelineView, "/pipeline")
+        self.add_view(
+            MiniMapTileView, "/tiles/<int:z>/<int(signed=True):x>/<int(signed=True):y>"
+        )
 
     def register(self, microscope):
         """Starts thread on registration to start processing when microscope is ready"""
@@ -23,9 +28,81 @@ class MiniMapExtension(BaseExtension):
         self.live_mapper.start_thread()
 
 
+def find_live_mapper():
+    return find_extension("de.hs-flensburg.mini-map").live_mapper
+
+
 class MiniMapView(View):
 
     def get(self):
-        """Get curren minimap image"""
-        image_path = os.path.join(STATIC_DIR, "map.png")
-        return send_file(image_path, mimetype="image/png")
+        """Get curren minimap image as a whole. Prefer the tiles, this grows with the map"""
+        live_mapper = find_live_mapper()
+        png = live_mapper.map_png() if live_mapper else None
+        if png is None:
+            return Response(status=404)
+        return Response(png, mimetype="image/png")
+
+
+class MiniMapManifestView(View):
+
+    def get(self):
+        """Get map version, bounds and the versions of all tiles changed after the version given as ?since="""
+        live_mapper = find_live_mapper()
+        if not live_mapper:
+            return Response(status=503)
+        return live_mapper.pyramid.manifest(since=request.args.get("since", 0, type=int))
+
+
+class MiniMapTileView(View):
+
+    def get(self, z, x, y):
+        """Get tile x, y of zoom level z (0 is full resolution, every level halves it). Supports If-None-Match"""
+        live_mapper = find_live_mapper()
+        if not live_mapper:
+            return Response(status=503)
+        data, version = live_mapper.pyramid.tile(z, x, y)
+        if data is None:
+            return Response(status=404)
+        etag = f"{z}-{x}-{y}-{version}"
+        if etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        response = Response(data, mimetype=live_mapper.pyramid.mimetype)
+        response.set_etag(etag)
+        # Clients request tiles with ?v=<version>, such URLs never change
+        if "v" in request.args:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+class MiniMapPipelineView(PropertyView):
+    """Capture queue settings, queue depth, dropped frames and durations of the capture and stitching stages"""
+
+    args = {
+        "policy": fields.String(metadata={"example": "latest-per-region"}),
+        "max_queued": fields.Integer(metadata={"example": 8}),
+        "overlap": fields.Float(metadata={"example": 0.5}),
+    }
+
+    def post(self, args):
+        live_mapper = find_live_mapper()
+        if not live_mapper:
+            return Response(status=503)
+        if args.get("policy", POLICIES[0]) not in POLICIES:
+            return Response(f"Unknown queue policy, use one of {', '.join(POLICIES)}", status=400)
+        if not 0 <= args.get("overlap", 0) < 1 or args.get("max_queued", 1) < 1:
+            return Response("overlap must be in [0, 1) and max_queued at least 1", status=400)
+        if "policy" in args:
+            live_mapper.queue.policy = args["policy"]
+        if "max_queued" in args:
+            live_mapper.queue.maxsize = args["max_queued"]
+        if "overlap" in args:
+            live_mapper.overlap = args["overlap"]
+        return live_mapper.stats()
+
+    def get(self):
+        live_mapper = find_live_mapper()
+        if not live_mapper:
+            return Response(status=503)
+        return live_mapper.stats()
@@ -0,0 +1,125 @@
+import functools
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+
+class StageCalibration:
+    def __init__(self, path=None, min_points=5, max_points=200, save_change=0.005, save_every=50):
+        """Affine transform from stage coordinates (steps) to canvas pixels, corner = A @ coords + t.
+
+        The linear part A is a property of the microscope and is kept in a JSON file, so it only has to be
+        learned once. The translation t depends on where the map started, so it is fitted per session. Both
+        are refitted by least squares from the placements added with add(), once there are min_points of them
+        not lying on one line. Until then a stored A is used with t from the placements so far.
+
+        The file is rewritten when A changed by more than save_change (relative) since it was last saved,
+        and otherwise after every save_every refits, not after every placement."""
+        self.path = path
+        self.min_points = min_points
+        self.max_points = max_points
+        self.save_change = save_change
+        self.save_every = save_every
+        self.matrix = None
+        self.offset = None
+        self.rms = None
+        self._pairs = []
+        self._saved_matrix = None
+        self._refits = 0  # Since the last save
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.matrix = np.array(json.load(f)["steps_to_pixels"], dtype=float)
+                self._saved_matrix = self.matrix
+            except (OSError, ValueError, KeyError):
+                logging.exception("Could not read mini map calibration")
+
+    @property
+    def calibrated(self):
+        return self.matrix is not None and self.offset is not None
+
+    def add(self, coords, corner):
+        """Record where an image taken at stage coords was placed on the canvas, and refit."""
+        self._pairs.append((tuple(coords[:2]), tuple(corner[:2])))
+        del self._pairs[: -self.max_points]
+        stage = np.array([p[0] for p in self._pairs], dtype=float)
+        canvas = np.array([p[1] for p in self._pairs], dtype=float)
+        design = np.column_stack([stage, np.ones(len(stage))])
+        if len(stage) >= self.min_points and np.linalg.matrix_rank(design - design.mean(axis=0)) >= 2:
+            solution, *_ = np.linalg.lstsq(design, canvas, rcond=None)
+            self.matrix = solution[:2].T
+            self.offset = solution[2]
+            self.rms = float(np.sqrt(np.mean((design @ solution - canvas) ** 2)))
+            self._refits += 1
+            if self._changed() or self._refits >= self.save_every:
+                self.save()
+        elif self.matrix is not None:
+            self.offset = np.mean(canvas - stage @ self.matrix.T, axis=0)
+
+    def predict(self, coords):
+        """Canvas corner (x, y) of an image taken at stage coords, or None if not calibrated."""
+        if not self.calibrated:
+            return None
+        x, y = self.matrix @ np.asarray(coords[:2], dtype=float) + self.offset
+        return round(x), round(y)
+
+    def footprint(self, shape):
+        """Size (width, height) in stage coordinates of an image of the given shape, or None if not calibrated."""
+        if self.matrix is None:
+            return None
+        h, w = shape[:2]
+        inverse = np.linalg.inv(self.matrix)
+        width, height = np.abs(inverse) @ [w, h]
+        return float(width), float(height)
+
+    def _changed(self):
+        """Whether A moved by more than save_change relative to the saved one."""
+        if self._saved_matrix is None:
+            return True
+        change = np.linalg.norm(self.matrix - self._saved_matrix) / max(np.linalg.norm(self._saved_matrix), 1e-12)
+        return change > self.save_change
+
+    def save(self):
+        if not self.path or self.matrix is None:
+            return
+        self._saved_matrix = self.matrix
+        self._refits = 0
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump({"steps_to_pixels": self.matrix.tolist(), "rms": self.rms}, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError:
+            # Mapping goes on, the calibration is just learned again next time
+            logging.exception("Could not save mini map calibration")
+
+
+@functools.lru_cache(maxsize=4)
+def _window(shape):
+    return cv2.createHanningWindow((shape[1], shape[0]), cv2.CV_32F)
+
+
+def _gray(img, downsample):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    gray = gray.astype(np.float32)
+    if downsample > 1:
+        gray = cv2.resize(gray, (gray.shape[1] // downsample, gray.shape[0] // downsample), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def phase_correlate(reference, img, downsample=2):
+    """Offset (dx, dy) in pixels by which img is displaced against a canvas region of the same size, found by
+    FFT phase correlation. Returns (dx, dy, response, coverage): the response is the height of the correlation
+    peak (0 to 1) and the coverage the fraction of the region that is already filled."""
+    ref = _gray(reference, downsample)
+    new = _gray(img, downsample)
+    filled = ref > 0
+    coverage = float(filled.mean())
+    if 0 < coverage < 1:
+        # Fill empty canvas with the mean, so its edge does not dominate the correlation
+        ref[~filled] = ref[filled].mean()
+    (sx, sy), response = cv2.phaseCorrelate(ref, new, _window(ref.shape))
+    return -sx * downsample, -sy * downsample, float(response), coverage
@@ -0,0 +1,73 @@
+import math
+
+
+class GridIndex:
+    def __init__(self, cell_size=1000):
+        """Uniform grid hash of items at 2D positions (stage coordinates). Inserting is O(1), and queries
+        only visit the cells around the query position, so their cost does not grow with the number of
+        items in the index, as long as items are spread over the map rather than piled up in one cell."""
+        self.cell_size = cell_size
+        self.cells: dict[tuple, list] = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _cell(self, coords):
+        return (
+            math.floor(coords[0] / self.cell_size),
+            math.floor(coords[1] / self.cell_size),
+        )
+
+    def insert(self, coords, item):
+        self.cells.setdefault(self._cell(coords), []).append((tuple(coords[:2]), item))
+        self._count += 1
+
+    def _ring(self, centre, r):
+        """Cells at Chebyshev distance r from the centre cell."""
+        cx, cy = centre
+        if r == 0:
+            return [centre]
+        cells = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+        cells += [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+        return cells
+
+    def query_radius(self, coords, radius):
+        """All items within radius of coords as (distance, coords, item), nearest first."""
+        centre = self._cell(coords)
+        reach = math.ceil(radius / self.cell_size)
+        found = []
+        for r in range(reach + 1):
+            for cell in self._ring(centre, r):
+                for position, item in self.cells.get(cell, ()):
+                    distance = math.dist(position, coords[:2])
+                    if distance <= radius:
+                        found.append((distance, position, item))
+        found.sort(key=lambda x: x[0])
+        return found
+
+    def nearest(self, coords, k, max_radius=None):
+        """Up to k nearest items as (distance, coords, item), nearest first. Returns fewer than k if the
+        index holds fewer items or not enough lie within max_radius."""
+        if self._count == 0 or k <= 0:
+            return []
+        centre = self._cell(coords)
+        found = []
+        r = 0
+        # The search ends once the k-th nearest item is closer than any cell not yet visited could be
+        while True:
+            for cell in self._ring(centre, r):
+                for position, item in self.cells.get(cell, ()):
+                    found.append((math.dist(position, coords[:2]), position, item))
+            found.sort(key=lambda x: x[0])
+            unvisited = r * self.cell_size  # Lower bound on the distance to anything in ring r + 1
+            if len(found) >= k and found[k - 1][0] <= unvisited:
+                break
+            if len(found) == self._count:
+                break
+            if max_radius is not None and unvisited > max_radius:
+                break
+            r += 1
+        if max_radius is not None:
+            found = [f for f in found if f[0] <= max_radius]
+        return found[:k]
@@ -1,9 +1,14 @@
 import dataclasses
+import logging
+import math
 
 import cv2
 import cv2.detail
 import numpy as np
-from scipy.spatial import cKDTree
+
+from .placement import StageCalibration, phase_correlate
+from .spatial_index import GridIndex
+from .tiled_canvas import TiledCanvas
 
 
 @dataclasses.dataclass
@@ -15,53 +20,96 @@ class Feature:
 
 
 class LiveStitching:
-    def __init__(self):
+    def __init__(
+        self,
+        tile_size=256,
+        footprint=None,
+        min_overlap=0.2,
+        max_neighbours=4,
+        placement="stage",
+        calibration=None,
+        min_response=0.1,
+        min_coverage=0.2,
+        max_shift=0.25,
+    ):
         """Handles live stitching by continues adding images, comparing with existing features and blending into the
-        bigger picture. It utilizes the opencv suite for feature detection, camera estimation and bundling as well
-        as blending."""
+        bigger picture. It utilizes the opencv suite for feature detection, camera estimation and bundling.
+        The mosaic is kept in a sparse tiled canvas, so adding an image only touches the tiles it overlaps.
+
+        Earlier images to match against are looked up in a grid index of their stage coordinates. If the
+        footprint (width, height) of an image in stage coordinates is known, all images overlapping the new
+        one by at least min_overlap of its area are used, up to max_neighbours with the largest overlap.
+        Otherwise the three nearest images are used.
+
+        With placement="stage", a calibrated transform from stage coordinates to canvas pixels predicts where
+        each image goes, and a phase correlation with the canvas region below it (if at least min_coverage of
+        it is filled) corrects the prediction by up to max_shift of the image size. Feature matching against that
+        region only runs if the correlation peak is lower than min_response. Until the transform is calibrated
+        (see StageCalibration), images are placed by feature matching with nearby images, which also calibrates
+        it. placement="features" always matches features.
+
+        Features are computed by extract_features(img), which can be replaced, e.g. by FeaturePool.extract to
+        run the detection in other processes."""
         self._detector = cv2.SIFT.create()
+        self.extract_features = lambda img: cv2.detail.computeImageFeatures2(self._detector, img)
         self._matcher = cv2.detail.BestOf2NearestMatcher()
         self._camera_estimator = cv2.detail.AffineBasedEstimator()
         self._camera_adjuster = cv2.detail.BundleAdjusterAffinePartial()
 
-        self.img = None
+        self.canvas = TiledCanvas(tile_size=tile_size)
         self.features: list[Feature] = []
-        self.size = None
-        self.corner = None
-
-    def get_nearby_features(self, coords):
-        if len(self.features) < 3:
-            return self.features
-        coords_array = np.array([feature.coords for feature in self.features])
-        tree = cKDTree(coords_array)
-
-        distances, indices = tree.query(coords, k=3)
-
-        return [self.features[i] for i in indices]
-
-    def add_image(self, img, coords):
-        """Try adding image to mini map and returning the new blended image."""
-        current_features = cv2.detail.computeImageFeatures2(self._detector, img)
-
-        if self.img is None:  # When its the first image
-            self.img = img
-            self.size = img.shape[:2]
-            self.corner = (0, 0)
-            self.features.append(
-                Feature(current_features, self.corner, self.size, coords)
-            )
-            return img
-
-        nearby_features = self.get_nearby_features(
-            coords
-        )  # Find existing nearby image features by coordinates (n=3)
-        if len(nearby_features) == 0:
-            print("could not find a good feature")
-            return
-
-        nearby_image_features = [x.features for x in nearby_features]
-
-        features = [current_features, *nearby_image_features]
+        self.footprint = footprint
+        self.min_overlap = min_overlap
+        self.max_neighbours = max_neighbours
+        self.index = GridIndex(cell_size=max(footprint) if footprint else 1000)
+
+        if placement not in ("stage", "features"):
+            raise ValueError(f"Unknown placement mode: {placement}")
+        self.placement = placement
+        self.calibration = calibration or StageCalibration()
+        self.min_response = min_response
+        self.min_coverage = min_coverage
+        self.max_shift = max_shift
+        self.placements = {}  # Number of images placed by each method
+
+    def _overlapping(self, coords):
+        """Placed images overlapping an image at coords as (overlap, feature), the overlap as a fraction of the
+        image area. Needs the footprint."""
+        w, h = self.footprint
+        for distance, position, feature in self.index.query_radius(coords, math.hypot(w, h)):
+            dx, dy = abs(position[0] - coords[0]), abs(position[1] - coords[1])
+            overlap = max(0, w - dx) * max(0, h - dy) / (w * h)
+            if overlap > 0:
+                yield overlap, feature
+
+    def coverage(self, coords):
+        """Largest fraction of an image at coords covered by a single placed image, 0 while the footprint is
+        unknown. Safe to call while another thread adds images, it may just miss the latest one."""
+        if self.footprint is None:
+            return 0.0
+        return max((overlap for overlap, _ in self._overlapping(coords)), default=0.0)
+
+    def get_nearby_features(self, coords, k=3):
+        """Features of earlier images to match a new image at coords against, best candidate first."""
+        if self.footprint is not None:
+            overlapping = []
+            for overlap, feature in self._overlapping(coords):
+                if overlap >= self.min_overlap:
+                    overlapping.append((overlap, feature))
+            if overlapping:
+                overlapping.sort(key=lambda x: -x[0])
+                return [feature for _, feature in overlapping[: self.max_neighbours]]
+        # Fewer than k images are fine, all of them are returned then
+        return [feature for _, _, feature in self.index.nearest(coords, k)]
+
+    def _add_feature(self, feature):
+        self.features.append(feature)
+        self.index.insert(feature.coords, feature)
+
+    def _match_features(self, current_features, nearby_features):
+        """Canvas corner of the new image from feature matches with nearby images, the first one as reference.
+        Returns None if the camera estimation fails."""
+        features = [current_features, *[x.features for x in nearby_features]]
 
         # Pairwise matches existing features with new image features
         pairwise_matches = self._matcher.apply2(features)
@@ -69,6 +117,8 @@ class LiveStitching:
 
         # Estimates camera matrices
         b, cameras = self._camera_estimator.apply(features, pairwise_matches, None)
+        if not b:
+            return None
         for cam in cameras:
             cam.R = cam.R.astype(np.float32)
 
@@ -79,7 +129,7 @@ class LiveStitching:
         second_corner = nearby_features[0].corner
         second_r_relativ_to_new = cameras[1].R
 
-        new_corner = (
+        return (
             round(
                 -(cameras[0].R[0][2]) + second_corner[0] + second_r_relativ_to_new[0][2]
             ),
@@ -88,30 +138,78 @@ class LiveStitching:
             ),
         )
 
-        corners = [self.corner, new_corner]
-        sizes = [self.size, img.shape[:2]]
-
-        # Blend using no blender to reduce cpu usage
-        blender = cv2.detail.Blender.createDefault(cv2.detail.Blender_NO)
-        blender.prepare(corners, [(size[1], size[0]) for size in sizes])
-
-        for img, size, corner in zip([self.img, img], sizes, corners):
-            mask = 255 * np.ones((size[0], size[1]), np.uint8)
-            blender.feed(img.astype(np.int16), mask, corner)
-
-        result = None
-        result_mask = None
-        result, result_mask = blender.blend(result, result_mask)
-
-        # Save new composed image and add features
-        self.img = cv2.convertScaleAbs(result)
-        self.size = self.img.shape[:2]
-        self.corner = (
-            min(corners[0][0], corners[1][0]),
-            min(corners[0][1], corners[1][1]),
-        )
-        self.features.append(
-            Feature(current_features, new_corner, img.shape[:2], coords)
-        )
-
-        return self.img
+    def needs_features(self):
+        """Whether add_image will need the features of the next image, rather than place it by stage position
+        (which only needs them as a rare fallback)."""
+        return self.placement != "stage" or not self.calibration.calibrated
+
+    def _place_by_stage(self, img, coords, predicted):
+        """Refine the corner predicted from the stage position by phase correlation with the canvas below it.
+        Falls back to feature matching against that canvas region if the correlation is not trustworthy, and
+        to the prediction alone if that fails too (e.g. on samples without texture).
+        Returns the corner and the method that placed the image."""
+        h, w = img.shape[:2]
+        x, y = predicted
+        reference = self.canvas.render((x, y, x + w, y + h))
+        dx, dy, response, coverage = phase_correlate(reference, img)
+        if coverage < self.min_coverage:
+            # Nothing to compare with yet: trust the stage
+            return predicted, "stage"
+        if response >= self.min_response and abs(dx) <= self.max_shift * w and abs(dy) <= self.max_shift * h:
+            return (round(x + dx), round(y + dy)), "correlation"
+
+        try:
+            current_features = self.extract_features(img)
+            reference_features = self.extract_features(reference)
+            corner = self._match_features(
+                current_features, [Feature(reference_features, predicted, (h, w), coords)]
+            )
+        except cv2.error:
+            logging.exception("Feature matching against the canvas failed")
+            corner = None
+        if corner is None or abs(corner[0] - x) > w or abs(corner[1] - y) > h:
+            return predicted, "stage"
+        return corner, "features"
+
+    def add_image(self, img, coords, features=None):
+        """Try adding image to mini map. Its features can be passed if they were computed beforehand.
+        Returns the indices of the canvas tiles that changed, or None if the image could not be placed."""
+        predicted = self.calibration.predict(coords) if self.placement == "stage" else None
+
+        if predicted is not None:
+            corner, method = self._place_by_stage(img, coords, predicted)
+            current_features = None
+        else:
+            current_features = features if features is not None else self.extract_features(img)
+
+            if not self.features:  # When its the first image
+                corner, method = (0, 0), "first"
+            else:
+                nearby_features = [
+                    x for x in self.get_nearby_features(coords) if x.features is not None
+                ]  # Find existing overlapping (or nearest) image features by stage coordinates
+                if len(nearby_features) == 0:
+                    logging.warning(f"Mini map: no placed image near {tuple(coords[:2])} to match features with")
+                    return
+
+                corner, method = self._match_features(current_features, nearby_features), "features"
+                if corner is None:
+                    logging.warning(f"Mini map: could not estimate the position of the image at {tuple(coords[:2])}")
+                    return
+
+        self.placements[method] = self.placements.get(method, 0) + 1
+        if method != "stage":
+            # Dead reckoning adds nothing to the calibration
+            self.calibration.add(coords, corner)
+            if self.footprint is None and self.calibration.footprint(img.shape) is not None:
+                self.footprint = self.calibration.footprint(img.shape)
+
+        # Paint the new image over the tiles it covers, like the no-blend blender did for the whole mosaic
+        touched = self.canvas.paste(img, corner)
+        self._add_feature(Feature(current_features, corner, img.shape[:2], coords))
+
+        return touched
+
+    def render(self):
+        """Compose the whole mini map image. Its cost grows with the map area, so call it only when needed."""
+        return self.canvas.render()
@@ -0,0 +1,109 @@
+import bisect
+import threading
+
+import cv2
+import numpy as np
+
+
+class TilePyramid:
+    def __init__(self, canvas, levels=6, image_format=".jpg", quality=85, history=10000):
+        """Multi-resolution tile pyramid on top of a TiledCanvas. Level z=0 are the canvas tiles themselves,
+        every higher level halves the resolution, so tile (z, x, y) covers canvas tiles
+        (x * 2^z ... (x + 1) * 2^z - 1, likewise y) at level 0.
+
+        Every tile carries the map version at which it last changed. update() only rebuilds the ancestors of
+        the changed canvas tiles, and tiles are encoded on request and cached until they change again, so the
+        work per stitched frame depends on the area it covers, not on the size of the map. The tiles changed by
+        the last `history` updates are remembered, so an incremental manifest does not scan all tiles."""
+        self.canvas = canvas
+        self.levels = levels
+        self.image_format = image_format
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality] if image_format == ".jpg" else []
+        self.mimetype = "image/jpeg" if image_format == ".jpg" else f"image/{image_format.lstrip('.')}"
+        self.version = 0
+        self.versions: dict[tuple, int] = {}  # (z, x, y) -> version of the last change
+        self._downsampled: dict[tuple, np.ndarray] = {}  # (z, x, y) -> tile for z > 0
+        self._encoded: dict[tuple, tuple] = {}  # (z, x, y) -> (version, encoded bytes)
+        self._history_versions = []  # Versions of the remembered updates, ascending
+        self._history_keys = []  # Tiles changed by each remembered update
+        self.history = history
+        self._lock = threading.Lock()
+
+    def update(self, touched):
+        """Register changed canvas tiles (level 0 indices, as returned by TiledCanvas.paste) and rebuild their
+        ancestors. Returns the new map version."""
+        if not touched:
+            return self.version
+        with self._lock:
+            self.version += 1
+            changed = {(0, tx, ty) for tx, ty in touched}
+            keys = list(changed)
+            for z in range(1, self.levels):
+                changed = {(z, x >> 1, y >> 1) for _, x, y in changed}
+                for key in changed:
+                    self._downsampled[key] = self._build(*key)
+                keys += changed
+            for key in keys:
+                self.versions[key] = self.version
+            self._history_versions.append(self.version)
+            self._history_keys.append(keys)
+            if len(self._history_versions) > self.history:
+                del self._history_versions[0], self._history_keys[0]
+            return self.version
+
+    def _child(self, z, x, y):
+        if z == 0:
+            return self.canvas.tiles.get((x, y))
+        return self._downsampled.get((z, x, y))
+
+    def _build(self, z, x, y):
+        """Tile (z, x, y) from its four children at level z - 1."""
+        t = self.canvas.tile_size
+        block = None
+        for j in range(2):
+            for i in range(2):
+                child = self._child(z - 1, 2 * x + i, 2 * y + j)
+                if child is None:
+                    continue
+                if block is None:
+                    block = np.zeros((2 * t, 2 * t) + child.shape[2:], dtype=child.dtype)
+                block[j * t:(j + 1) * t, i * t:(i + 1) * t] = child
+        return cv2.resize(block, (t, t), interpolation=cv2.INTER_AREA)
+
+    def tile(self, z, x, y):
+        """Encoded tile and its version, or (None, None) if there is no such tile."""
+        key = (z, x, y)
+        with self._lock:
+            version = self.versions.get(key)
+            if version is None:
+                return None, None
+            cached = self._encoded.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1], version
+            image = self._child(z, x, y)
+            # The canvas tile may be painted by the worker while it is encoded here, copy it first
+            image = image.copy()
+        ok, data = cv2.imencode(self.image_format, image, self.params)
+        data = data.tobytes()
+        with self._lock:
+            if self.versions.get(key) == version:
+                self._encoded[key] = (version, data)
+        return data, version
+
+    def manifest(self, since=0):
+        """Map version, tile size, number of levels, canvas bounds and the version of every tile changed after
+        version `since`, as {"z/x/y": version}."""
+        with self._lock:
+            if self._history_versions and since >= self._history_versions[0] - 1:
+                start = bisect.bisect_right(self._history_versions, since)
+                keys = {key for changed in self._history_keys[start:] for key in changed}
+            else:
+                keys = [key for key, version in self.versions.items() if version > since]
+            return {
+                "version": self.version,
+                "tile_size": self.canvas.tile_size,
+                "levels": self.levels,
+                "bounds": self.canvas.bounds,
+                "format": self.image_format.lstrip("."),
+                "tiles": {f"{z}/{x}/{y}": self.versions[(z, x, y)] for z, x, y in keys},
+            }
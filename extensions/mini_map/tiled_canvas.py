@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+
+
+class TiledCanvas:
+    def __init__(self, tile_size=256, channels=3, dtype=np.uint8):
+        """Sparse canvas made of fixed-size square tiles, kept in a dict keyed by tile index (tx, ty).
+        Pasting an image only touches the tiles it overlaps, and the canvas grows in any direction
+        (including negative coordinates) without moving existing pixels. Empty areas are black."""
+        self.tile_size = tile_size
+        self.channels = channels
+        self.dtype = dtype
+        self.tiles: dict[tuple, np.ndarray] = {}
+        self.bounds = None  # (x0, y0, x1, y1) of everything pasted so far, x1 and y1 exclusive
+
+    def _new_tile(self):
+        shape = (self.tile_size, self.tile_size, self.channels) if self.channels > 1 else (self.tile_size, self.tile_size)
+        return np.zeros(shape, dtype=self.dtype)
+
+    def tile_range(self, x0, y0, x1, y1):
+        """Indices of all tiles overlapping the pixel rectangle [x0, x1) x [y0, y1)."""
+        t = self.tile_size
+        return [
+            (tx, ty)
+            for ty in range(math.floor(y0 / t), math.ceil(y1 / t))
+            for tx in range(math.floor(x0 / t), math.ceil(x1 / t))
+        ]
+
+    def paste(self, img, corner, mask=None):
+        """Paste an image with its top left corner at canvas position (x, y), overwriting what is there.
+        If a mask is given, only pixels where it is non-zero are copied. Returns the touched tile indices."""
+        x0, y0 = int(corner[0]), int(corner[1])
+        h, w = img.shape[:2]
+        x1, y1 = x0 + w, y0 + h
+        t = self.tile_size
+        touched = self.tile_range(x0, y0, x1, y1)
+        for tx, ty in touched:
+            tile = self.tiles.get((tx, ty))
+            if tile is None:
+                tile = self.tiles[(tx, ty)] = self._new_tile()
+            # Intersection of the image and the tile in canvas coordinates
+            cx0, cy0 = max(x0, tx * t), max(y0, ty * t)
+            cx1, cy1 = min(x1, (tx + 1) * t), min(y1, (ty + 1) * t)
+            src = img[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            dst = tile[cy0 - ty * t:cy1 - ty * t, cx0 - tx * t:cx1 - tx * t]
+            if mask is None:
+                dst[...] = src
+            else:
+                where = mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] > 0
+                np.copyto(dst, src, where=where[..., None] if src.ndim == 3 else where)
+        if self.bounds is None:
+            self.bounds = (x0, y0, x1, y1)
+        else:
+            bx0, by0, bx1, by1 = self.bounds
+            self.bounds = (min(bx0, x0), min(by0, y0), max(bx1, x1), max(by1, y1))
+        return touched
+
+    def render(self, region=None):
+        """Compose the tiles into one image. Covers the canvas bounds unless a region (x0, y0, x1, y1) is
+        given. Only call this when the whole image is needed, its cost grows with the area."""
+        if region is None:
+            region = self.bounds
+        if region is None:
+            return None
+        x0, y0, x1, y1 = region
+        t = self.tile_size
+        out = np.zeros((y1 - y0, x1 - x0) + ((self.channels,) if self.channels > 1 else ()), dtype=self.dtype)
+        for tx, ty in self.tile_range(x0, y0, x1, y1):
+            tile = self.tiles.get((tx, ty))
+            if tile is None:
+                continue
+            cx0, cy0 = max(x0, tx * t), max(y0, ty * t)
+            cx1, cy1 = min(x1, (tx + 1) * t), min(y1, (ty + 1) * t)
+            out[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = tile[cy0 - ty * t:cy1 - ty * t, cx0 - tx * t:cx1 - tx * t]
+        return out
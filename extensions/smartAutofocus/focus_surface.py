@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from scipy import interpolate
+
+
+class FocusSurface:
+    """
+    Persistent record of successful focus positions and a focal surface fitted to them.
+
+    Every focus is stored as (x, y, z, metric, time) in a JSON file, so the surface survives restarts.
+    A plane is fitted from three points on; from `spline_points` points on, a smoothing thin-plate
+    spline (with the plane as its polynomial part) follows the sample's curvature. Points whose residual
+    exceeds `outlier_threshold` robust standard deviations (from the median absolute deviation) are
+    rejected before the final fit. Points along one line (e.g. a single raster row) only define a
+    straight "line" fit along it, and points at one spot only their "nearest" Z.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_points: int = 500, max_age: Optional[float] = None, spline_points: int = 10, outlier_threshold: float = 3.5, smoothing: float = 0.1):
+        """
+        Args:
+            path (str, optional): JSON file the points are kept in, None to keep them in memory only.
+            max_points (int): Number of most recent points kept.
+            max_age (float, optional): Points older than this (seconds) are ignored by the fit.
+            spline_points (int): Number of inliers from which the thin-plate spline is used instead of the plane.
+            outlier_threshold (float): Rejection threshold in robust standard deviations.
+            smoothing (float): Smoothing of the thin-plate spline, with XY normalised to the extent of the points.
+        """
+        self.path = path
+        self.max_points = max_points
+        self.max_age = max_age
+        self.spline_points = spline_points
+        self.outlier_threshold = outlier_threshold
+        self.smoothing = smoothing
+        self.points: List[dict] = []
+        self._model = None
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.points = json.load(f).get("points", [])[-max_points:]
+
+    def add(self, x: float, y: float, z: float, metric: Optional[float] = None, timestamp: Optional[float] = None):
+        """Record a successful focus and refit the surface."""
+        with self._lock:
+            self.points.append({"x": float(x), "y": float(y), "z": float(z), "metric": metric, "time": timestamp or time.time()})
+            del self.points[:-self.max_points]
+            self._model = None
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self.points = []
+            self._model = None
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"points": self.points}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _active_points(self) -> np.ndarray:
+        points = self.points
+        if self.max_age is not None:
+            oldest = time.time() - self.max_age
+            points = [p for p in points if p["time"] >= oldest]
+        return np.array([(p["x"], p["y"], p["z"]) for p in points], dtype=float).reshape(-1, 3)
+
+    @staticmethod
+    def _fit_plane(xyz: np.ndarray) -> np.ndarray:
+        design = np.column_stack([xyz[:, 0], xyz[:, 1], np.ones(len(xyz))])
+        return np.linalg.lstsq(design, xyz[:, 2], rcond=None)[0]
+
+    @staticmethod
+    def _xy_span(xyz: np.ndarray) -> tuple:
+        """
+        Number of dimensions (0, 1 or 2) the XY positions span, and their centroid and principal direction.
+
+        Spreads below one step, or below 1% of the main spread, do not count.
+        """
+        centroid = xyz[:, :2].mean(axis=0)
+        _, singular, vt = np.linalg.svd(xyz[:, :2] - centroid, full_matrices=False)
+        rank = int((singular > max(1e-2 * singular[0], 1.0)).sum())
+        return rank, centroid, vt[0]
+
+    def _inliers(self, xyz: np.ndarray) -> np.ndarray:
+        """Iteratively reject points far from the plane through the remaining points."""
+        inliers = np.ones(len(xyz), dtype=bool)
+        for _ in range(5):
+            if inliers.sum() < 4:
+                break
+            a, b, c = self._fit_plane(xyz[inliers])
+            residuals = xyz[:, 2] - (a * xyz[:, 0] + b * xyz[:, 1] + c)
+            mad = np.median(np.abs(residuals[inliers] - np.median(residuals[inliers])))
+            # With a perfect fit the MAD is 0; keep a floor so points within one step are not rejected
+            sigma = max(1.4826 * mad, 1.0)
+            updated = np.abs(residuals - np.median(residuals[inliers])) <= self.outlier_threshold * sigma
+            if (updated == inliers).all() or updated.sum() < 3:
+                break
+            inliers = updated
+        return inliers
+
+    def _fit(self):
+        xyz = self._active_points()
+        if len(xyz) < 3:
+            return {"kind": "nearest" if len(xyz) else None, "points": xyz, "inliers": len(xyz), "rms": None}
+        inliers = self._inliers(xyz)
+        good = xyz[inliers]
+        rank, centroid, direction = self._xy_span(good)
+        model = None
+        if rank < 1:
+            return {"kind": "nearest", "points": good, "inliers": int(inliers.sum()), "outliers": int((~inliers).sum()), "rms": None}
+        if rank < 2:
+            # A plane or spline through points on one line is undetermined across it
+            t = (good[:, :2] - centroid) @ direction
+            slope, intercept = np.polyfit(t, good[:, 2], 1)
+            predicted = slope * t + intercept
+            model = {"kind": "line", "line": (slope, intercept), "origin": centroid, "direction": direction}
+        elif len(good) >= self.spline_points:
+            # Normalise XY to the extent of the points, so the smoothing does not depend on the stage scale
+            origin = good[:, :2].min(axis=0)
+            scale = max(float(np.ptp(good[:, :2], axis=0).max()), 1.0)
+            try:
+                spline = interpolate.RBFInterpolator((good[:, :2] - origin) / scale, good[:, 2], kernel="thin_plate_spline", smoothing=self.smoothing, degree=1)
+            except np.linalg.LinAlgError:
+                spline = None  # Nearly degenerate positions, the plane below is still well defined
+            if spline is not None:
+                predicted = spline((good[:, :2] - origin) / scale)
+                model = {"kind": "spline", "spline": spline, "origin": origin, "scale": scale}
+        if model is None:
+            plane = self._fit_plane(good)
+            predicted = good[:, 0] * plane[0] + good[:, 1] * plane[1] + plane[2]
+            model = {"kind": "plane", "plane": plane}
+        model.update({"points": good, "inliers": int(inliers.sum()), "outliers": int((~inliers).sum())})
+        model["rms"] = float(np.sqrt(np.mean((good[:, 2] - predicted) ** 2)))
+        return model
+
+    def predict(self, x: float, y: float) -> Optional[dict]:
+        """
+        Predicted focus Z at a stage position.
+
+        Returns:
+            dict: "z", fit "kind" ("nearest", "line", "plane" or "spline"), number of "inliers" and the
+            "rms" residual of the fit (None for "nearest"), or None if no focus has been recorded.
+        """
+        with self._lock:
+            if self._model is None:
+                self._model = self._fit()
+            model = self._model
+        if model["kind"] is None:
+            return None
+        if model["kind"] == "nearest":
+            points = model["points"]
+            distances = (points[:, 0] - x) ** 2 + (points[:, 1] - y) ** 2
+            # Repeated foci at the same spot are averaged
+            z = points[distances <= distances.min(), 2].mean()
+        elif model["kind"] == "line":
+            slope, intercept = model["line"]
+            z = slope * ((np.array([x, y], dtype=float) - model["origin"]) @ model["direction"]) + intercept
+        elif model["kind"] == "plane":
+            a, b, c = model["plane"]
+            z = a * x + b * y + c
+        else:
+            z = model["spline"]((np.array([[x, y]], dtype=float) - model["origin"]) / model["scale"])[0]
+        return {"z": float(z), "kind": model["kind"], "inliers": model["inliers"], "rms": model["rms"]}
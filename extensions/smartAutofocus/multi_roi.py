@@ -0,0 +1,159 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+import cv2
+
+from .utils import METRICS, laplace, to_gray
+from .sweep import fit_peak
+
+
+def roi_grid(shape: Sequence[int], rows: int, cols: int, margin: float = 0.1) -> List[List[int]]:
+    """
+    Regular grid of ROIs [x, y, width, height] covering the frame, leaving `margin` of each edge free.
+
+    The frame edges are usually vignetted or out of the illuminated field, so they are not used by default.
+    """
+    h, w = shape[:2]
+    x0, y0 = int(w * margin), int(h * margin)
+    cell_w, cell_h = (w - 2 * x0) // max(cols, 1), (h - 2 * y0) // max(rows, 1)
+    return [[x0 + c * cell_w, y0 + r * cell_h, cell_w, cell_h] for r in range(rows) for c in range(cols)]
+
+
+def _box_sums(integral: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Sums over boxes (x0, y0, x1, y1) from an integral image, all boxes at once."""
+    x0, y0, x1, y1 = boxes.T
+    return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+
+def _pixel_maps(gray: np.ndarray, metric_name: str) -> Optional[List[np.ndarray]]:
+    """
+    Per-pixel terms whose ROI means give the metric, or None if the metric cannot be split up this way.
+    """
+    if metric_name == "laplace4":
+        lap = laplace(gray)
+        lap *= lap
+        lap *= lap
+        return [lap]
+    if metric_name == "variance":
+        lap = laplace(gray)
+        return [lap, lap * lap]
+    if metric_name == "tenengrad":
+        gx = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_REFLECT)
+        gy = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_REFLECT)
+        gx *= gx
+        gy *= gy
+        return [cv2.add(gx, gy)]
+    return None
+
+
+class MultiRoiMetric:
+    """
+    Sharpness of many ROIs of the same frame in one pass.
+
+    For "laplace4", "variance" and "tenengrad" the filter runs once over the frame and every ROI's mean
+    is read from an integral image with four lookups, so the cost hardly depends on the number of ROIs.
+    Pixels at ROI edges see their neighbours outside the ROI, so values differ slightly from the metric
+    on a cropped ROI. Other metrics are computed ROI by ROI.
+    """
+
+    def __init__(self, metric_name: str, rois: Optional[List[List[int]]] = None, grid=(3, 3), channel: str = "mean", downsample: int = 1):
+        """
+        Args:
+            metric_name (str): Name of a registered metric (see utils.METRICS).
+            rois (list, optional): ROIs as [x, y, width, height] in pixels of the full frame.
+            grid (tuple): (rows, columns) of a regular ROI grid, used if `rois` is None.
+            channel (str): "mean" or "green".
+            downsample (int): Factor by which the frame is shrunk before the metric is computed.
+        """
+        self.metric = METRICS.get(metric_name.lower())
+        if self.metric is None:
+            raise ValueError(f"Unknown sharpness metric: {metric_name}")
+        if channel not in ("mean", "green"):
+            raise ValueError(f"Unknown channel: {channel}")
+        if rois is not None:
+            if not rois or any(len(roi) != 4 or roi[2] <= 0 or roi[3] <= 0 for roi in rois):
+                raise ValueError("ROIs must be given as [x, y, width, height] with a positive size")
+        elif len(grid) != 2 or min(grid) < 1:
+            raise ValueError("The ROI grid must be given as [rows, columns]")
+        self.rois = rois
+        self.grid = tuple(grid)
+        self.channel = channel
+        self.downsample = max(1, downsample)
+        self._boxes = None
+
+    def resolve(self, shape: Sequence[int]) -> List[List[int]]:
+        """ROIs for a frame of the given shape, clipped to the frame."""
+        h, w = shape[:2]
+        rois = self.rois if self.rois is not None else roi_grid(shape, *self.grid)
+        clipped = []
+        for x, y, rw, rh in rois:
+            x0, y0 = min(max(x, 0), w), min(max(y, 0), h)
+            x1, y1 = min(max(x + rw, 0), w), min(max(y + rh, 0), h)
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError(f"ROI {[x, y, rw, rh]} lies outside the {w}x{h} frame")
+            clipped.append([x0, y0, x1 - x0, y1 - y0])
+        self.rois = clipped
+        return clipped
+
+    def _scaled_boxes(self, shape) -> np.ndarray:
+        if self._boxes is None:
+            rois = np.array(self.resolve(shape), dtype=np.int64)
+            boxes = np.column_stack([rois[:, 0], rois[:, 1], rois[:, 0] + rois[:, 2], rois[:, 1] + rois[:, 3]])
+            # Boxes in the downsampled frame, at least one pixel wide
+            boxes //= self.downsample
+            boxes[:, 2:] = np.maximum(boxes[:, 2:], boxes[:, :2] + 1)
+            self._boxes = boxes
+        return self._boxes
+
+    def __call__(self, rgb_image: np.ndarray) -> np.ndarray:
+        """Sharpness of every ROI, in the order of `rois`."""
+        boxes = self._scaled_boxes(rgb_image.shape)
+        gray = to_gray(rgb_image, self.channel, self.downsample)
+        h, w = gray.shape
+        boxes = np.minimum(boxes, [w - 1, h - 1, w, h])
+        maps = _pixel_maps(gray, self.metric.name)
+        if maps is None:
+            return np.array([self.metric.func(gray[y0:y1, x0:x1]) for x0, y0, x1, y1 in boxes])
+        area = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])).astype(np.float64)
+        means = [_box_sums(cv2.integral(m, sdepth=cv2.CV_64F), boxes) / area for m in maps]
+        if self.metric.name == "variance":
+            return means[1] - means[0] ** 2
+        return means[0]
+
+
+def fit_tilt(rois: List[List[int]], best_z: Sequence[float]) -> Optional[dict]:
+    """
+    Fit the focal plane z = a * x + b * y + c through the best Z of each ROI, at the ROI centres (pixels).
+
+    Returns:
+        dict: Slopes "a" and "b" (stage steps per pixel), offset "c", "rms" residual and the Z
+            difference "dz_x" and "dz_y" across the width and height spanned by the ROIs, or None
+            with fewer than three ROIs or if they lie on a line.
+    """
+    if len(rois) < 3:
+        return None
+    rois = np.asarray(rois, dtype=float)
+    x = rois[:, 0] + rois[:, 2] / 2
+    y = rois[:, 1] + rois[:, 3] / 2
+    z = np.asarray(best_z, dtype=float)
+    design = np.column_stack([x, y, np.ones(len(x))])
+    if np.linalg.matrix_rank(design) < 3:
+        return None
+    (a, b, c), *_ = np.linalg.lstsq(design, z, rcond=None)
+    rms = float(np.sqrt(np.mean((design @ [a, b, c] - z) ** 2)))
+    return {"a": float(a), "b": float(b), "c": float(c), "rms": rms, "dz_x": float(a * np.ptp(x)), "dz_y": float(b * np.ptp(y))}
+
+
+def best_positions(positions: Sequence[float], sharpnesses: np.ndarray) -> List[float]:
+    """
+    Best Z of every ROI: the peak of a parabola fitted around its maximum, or the argmax if that fails.
+
+    Args:
+        positions: Z-positions of the scan.
+        sharpnesses: Array (positions x ROIs) of sharpness values.
+    """
+    best = []
+    for column in np.asarray(sharpnesses, dtype=float).T:
+        peak = fit_peak(positions, column)
+        best.append(float(positions[int(np.argmax(column))]) if peak is None else peak)
+    return best
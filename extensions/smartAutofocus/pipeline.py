@@ -0,0 +1,197 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class VideoFrameBuffer:
+    """
+    A reused buffer for video port frames, so grabbing a frame does not allocate one.
+
+    The first grab learns the frame shape from camera.array; later grabs capture RGB straight into a
+    buffer padded like picamera pads unencoded captures (width to 32, height to 16 pixels). Cameras
+    that cannot capture into a buffer fall back to camera.array. Use one per action: the shape is not
+    checked again, and a grabbed frame is only valid until the next grab.
+    """
+
+    def __init__(self):
+        self._buffer: Optional[np.ndarray] = None
+        self._shape = None
+        self.supported = True
+
+    def grab(self, camera) -> np.ndarray:
+        if self._buffer is None or not self.supported:
+            frame = camera.array(use_video_port=True)
+            if self._buffer is None and self.supported:
+                h, w = frame.shape[:2]
+                self._shape = (h, w)
+                self._buffer = np.empty(((h + 15) // 16 * 16, (w + 31) // 32 * 32) + frame.shape[2:], dtype=np.uint8)
+            return frame
+        try:
+            camera.capture(self._buffer, "rgb", use_video_port=True)
+        except Exception:
+            logging.warning("Camera cannot capture into a buffer, autofocus frames are allocated per capture", exc_info=True)
+            self.supported = False
+            return camera.array(use_video_port=True)
+        h, w = self._shape
+        return self._buffer[:h, :w]
+
+
+class MetricPipeline:
+    """
+    Computes the sharpness of frames on a worker thread, so the stage can move on while it runs.
+
+    Frames are copied into a ring of preallocated buffers (allocated on the first frame). A buffer is
+    reused as soon as the worker has finished with it; if all buffers are busy, `submit` waits for one.
+    """
+
+    def __init__(self, metric_fn: Callable[[np.ndarray], float], slots: int = 2):
+        """
+        Args:
+            metric_fn (callable): Sharpness of a frame (ROI), a float or e.g. an array of per-ROI values.
+            slots (int): Number of frame buffers, i.e. frames that may wait for or be in computation.
+        """
+        self.metric_fn = metric_fn
+        self.slots = max(1, slots)
+        self.sharpnesses: Dict[int, object] = {}
+        self.compute_times: Dict[int, float] = {}
+        self._buffers: Optional[np.ndarray] = None
+        self._free = queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        self._pending = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="Autofocus Metric Pipeline", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, index: int, frame: np.ndarray) -> float:
+        """
+        Copy a frame into a free buffer and queue it for the metric.
+
+        Returns:
+            float: Time spent waiting for a free buffer (seconds).
+        """
+        if self._error is not None:
+            raise self._error
+        start = time.monotonic()
+        slot = self._free.get()
+        waited = time.monotonic() - start
+        if self._buffers is None or self._buffers.shape[1:] != frame.shape or self._buffers.dtype != frame.dtype:
+            # Only reallocated if the ROI changes, which it does not during a scan
+            self._buffers = np.empty((self.slots,) + frame.shape, dtype=frame.dtype)
+        np.copyto(self._buffers[slot], frame)
+        self._pending.put((index, slot))
+        return waited
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            index, slot = item
+            if self._error is None:
+                start = time.monotonic()
+                try:
+                    self.sharpnesses[index] = self.metric_fn(self._buffers[slot])
+                except Exception as e:
+                    self._error = e
+                self.compute_times[index] = time.monotonic() - start
+            self._free.put(slot)
+
+    def close(self):
+        """Wait until all queued frames have been measured."""
+        self._pending.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def summarise_steps(log: List[dict]) -> dict:
+    """
+    Mean time per step spent in each phase, and the wall time per step.
+
+    "sequential" is the sum of the phases, i.e. the time per step without overlapping the metric.
+    """
+    phases = ("move", "settle", "capture", "compute", "wait", "step")
+    summary = {"steps": len(log)}
+    for phase in phases:
+        summary[phase] = float(np.mean([entry[phase] for entry in log])) if log else 0.0
+    summary["sequential"] = summary["move"] + summary["settle"] + summary["capture"] + summary["compute"]
+    return summary
+
+
+def scan_z(
+    stage,
+    grab: Callable[[], np.ndarray],
+    metric_fn: Callable[[np.ndarray], float],
+    dz,
+    settle: float,
+    pipelined: bool = True,
+    should_stop: Optional[Callable[[], bool]] = None,
+):
+    """
+    Measure the sharpness at Z offsets around the current position, logging the time of every step.
+
+    With `pipelined`, the metric of frame N runs on a MetricPipeline worker while the stage moves to
+    and settles at N+1, so a step takes about move + settle + capture instead of additionally the
+    metric's compute time. The frame itself has to be grabbed after settling, so only the metric overlaps.
+
+    Args:
+        stage: Stage with scan_z and position.
+        grab (callable): Returns the frame (ROI) to measure; it is copied before grab is called again.
+        metric_fn (callable): Sharpness of a frame.
+        dz: Z offsets relative to the current position.
+        settle (float): Wait time after each movement (seconds).
+        pipelined (bool): Compute the metric on a worker thread.
+        should_stop (callable, optional): Returns True if the scan should be aborted.
+
+    Returns:
+        tuple: (List of Z-positions, List of sharpness values, step log), or None if aborted.
+            Each log entry holds the "z" and the "move", "settle", "capture", "compute", "wait" and
+            total "step" times (seconds).
+    """
+    pipeline = MetricPipeline(metric_fn).start() if pipelined else None
+    positions = []
+    sharpnesses = []
+    log = []
+    steps = iter(stage.scan_z(dz, return_to_start=False))
+    try:
+        while True:
+            step_start = time.monotonic()
+            try:
+                next(steps)
+            except StopIteration:
+                break
+            moved = time.monotonic()
+            if should_stop and should_stop():
+                return None
+            time.sleep(settle)
+            settled = time.monotonic()
+            frame = grab()
+            captured = time.monotonic()
+            entry = {"z": stage.position[2], "move": moved - step_start, "settle": settled - moved, "capture": captured - settled}
+            if pipeline:
+                entry["wait"] = pipeline.submit(len(positions), frame)
+                # Compute time is filled in from the pipeline once it has finished
+                entry["compute"] = 0.0
+            else:
+                sharpnesses.append(metric_fn(frame))
+                entry["wait"] = 0.0
+                entry["compute"] = time.monotonic() - captured
+            entry["step"] = time.monotonic() - step_start
+            positions.append(entry["z"])
+            log.append(entry)
+    finally:
+        if pipeline:
+            pipeline.close()
+    if pipeline:
+        sharpnesses = [pipeline.sharpnesses[i] for i in range(len(positions))]
+        for i, entry in enumerate(log):
+            entry["compute"] = pipeline.compute_times[i]
+    return positions, sharpnesses, log
@@ -0,0 +1,195 @@
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from scipy import optimize
+
+
+class SearchAborted(Exception):
+    """Raised by FocusProbe when the running action has been stopped."""
+
+
+class FocusProbe:
+    """
+    Measures sharpness at absolute Z positions, counting stage moves and captures.
+
+    Positions are rounded to whole stage steps and every position is measured at most once, so search
+    strategies can ask for the same Z repeatedly without paying for it.
+    """
+
+    def __init__(self, stage, measure: Callable[[], float], settle: float = 0.4, should_stop: Optional[Callable[[], bool]] = None):
+        """
+        Args:
+            stage: Stage with move_rel and position.
+            measure (callable): Grabs a frame and returns its sharpness.
+            settle (float): Wait time after each movement (seconds).
+            should_stop (callable, optional): Returns True if the search should be aborted.
+        """
+        self.stage = stage
+        self.measure = measure
+        self.settle = settle
+        self.should_stop = should_stop
+        self.samples: Dict[int, float] = {}
+        self.moves = 0
+        self.captures = 0
+
+    def move_to(self, z: float):
+        dz = int(round(z)) - self.stage.position[2]
+        if dz:
+            self.stage.move_rel((0, 0, dz))
+            self.moves += 1
+
+    def __call__(self, z: float) -> float:
+        z = int(round(z))
+        if z not in self.samples:
+            if self.should_stop and self.should_stop():
+                raise SearchAborted()
+            self.move_to(z)
+            time.sleep(self.settle)
+            self.samples[z] = self.measure()
+            self.captures += 1
+        return self.samples[z]
+
+    def best(self) -> int:
+        return max(self.samples, key=self.samples.get)
+
+    def history(self):
+        """Measured positions and sharpness values, sorted by Z."""
+        positions = sorted(self.samples)
+        return positions, [self.samples[z] for z in positions]
+
+
+def vertex(x: List[float], y: List[float]) -> Optional[float]:
+    """X of the vertex of the parabola through three points, or None if it is not a maximum."""
+    (x1, x2, x3), (y1, y2, y3) = x, y
+    denom = (x1 - x2) * (x1 - x3) * (x2 - x3)
+    if denom == 0:
+        return None
+    a = (x3 * (y2 - y1) + x2 * (y1 - y3) + x1 * (y3 - y2)) / denom
+    b = (x3 ** 2 * (y1 - y2) + x2 ** 2 * (y3 - y1) + x1 ** 2 * (y2 - y3)) / denom
+    if a >= 0:
+        return None
+    return -b / (2 * a)
+
+
+def coarse_scan(probe: FocusProbe, centre: int, coarse_range: int, coarse_steps: int):
+    """
+    Sample a coarse grid around centre.
+
+    Returns:
+        tuple: (lower, upper) Z of the bracket around the best grid position.
+    """
+    grid = np.linspace(centre - coarse_range, centre + coarse_range, max(coarse_steps, 3))
+    best = int(np.argmax([probe(z) for z in grid]))
+    return grid[max(best - 1, 0)], grid[min(best + 1, len(grid) - 1)]
+
+
+def grid_search(probe: FocusProbe, centre: int, coarse_range: int = 400, coarse_steps: int = 5, fine_range: int = 100, fine_steps: int = 5, **_) -> float:
+    """The coarse and fine grid search of smart_autofocus: argmax of the fine grid around the coarse argmax."""
+    grid = np.linspace(centre - coarse_range, centre + coarse_range, coarse_steps)
+    best = grid[int(np.argmax([probe(z) for z in grid]))]
+    fine = np.linspace(best - fine_range, best + fine_range, fine_steps)
+    return float(fine[int(np.argmax([probe(z) for z in fine]))])
+
+
+def model_search(probe: FocusProbe, centre: int, coarse_range: int = 400, coarse_steps: int = 5, tolerance: float = 10, max_iterations: int = 5, model: str = "parabolic", **_) -> float:
+    """
+    Coarse grid, then repeatedly fit a peak model through the best sample and its measured neighbours
+    and measure at the fitted peak.
+
+    Stops early once the fitted peak moves by less than `tolerance` between iterations, so the result
+    is usually a sub-step estimate after two or three extra captures.
+
+    A best sample at the edge of the coarse grid is returned as it is: the peak lies at or beyond the
+    end of the range, which the grid already covers.
+
+    Args:
+        model (str): "parabolic" fits a parabola to the sharpness, "gaussian" a parabola to its logarithm.
+    """
+    if max_iterations < 0:
+        raise ValueError("max_iterations must not be negative")
+    coarse_scan(probe, centre, coarse_range, coarse_steps)
+    peak = previous = None
+    for _ in range(max_iterations + 1):
+        positions = sorted(probe.samples)
+        best = positions.index(probe.best())
+        if best == 0 or best == len(positions) - 1:
+            return float(positions[best])
+        x = positions[best - 1:best + 2]
+        y = [probe.samples[z] for z in x]
+        if model == "gaussian":
+            y = [math.log(max(v, 1e-12)) for v in y]
+        peak = vertex(x, y)
+        if peak is None:
+            return float(positions[best])
+        peak = min(max(peak, x[0]), x[2])
+        if previous is not None and abs(peak - previous) < tolerance:
+            break
+        probe(peak)
+        previous = peak
+    if peak is None:
+        return float(probe.best())
+    return float(peak)
+
+
+def golden_search(probe: FocusProbe, centre: int, coarse_range: int = 400, coarse_steps: int = 5, tolerance: float = 10, **_) -> float:
+    """Coarse grid, then golden-section search inside the bracket around the best grid position."""
+    a, b = coarse_scan(probe, centre, coarse_range, coarse_steps)
+    ratio = (math.sqrt(5) - 1) / 2
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    while b - a > tolerance:
+        if probe(c) >= probe(d):
+            b, d = d, c
+            c = b - ratio * (b - a)
+        else:
+            a, c = c, d
+            d = a + ratio * (b - a)
+    return (a + b) / 2
+
+
+def brent_search(probe: FocusProbe, centre: int, coarse_range: int = 400, coarse_steps: int = 5, tolerance: float = 10, **_) -> float:
+    """Coarse grid, then Brent's method (parabolic steps with golden-section fallback) inside the bracket."""
+    a, b = coarse_scan(probe, centre, coarse_range, coarse_steps)
+    result = optimize.minimize_scalar(lambda z: -probe(z), bounds=(a, b), method="bounded", options={"xatol": tolerance})
+    return float(result.x)
+
+
+STRATEGIES = {
+    "grid": grid_search,
+    "parabolic": lambda probe, centre, **kwargs: model_search(probe, centre, model="parabolic", **kwargs),
+    "gaussian": lambda probe, centre, **kwargs: model_search(probe, centre, model="gaussian", **kwargs),
+    "golden": golden_search,
+    "brent": brent_search,
+}
+
+
+def find_focus(strategy: str, probe: FocusProbe, **params) -> dict:
+    """
+    Search for the focus with a strategy from STRATEGIES and move the stage to it.
+
+    Args:
+        strategy (str): Name of the search strategy.
+        probe (FocusProbe): Probe measuring the sharpness.
+        params: Search parameters: coarse_range, coarse_steps, fine_range, fine_steps, tolerance, max_iterations.
+
+    Returns:
+        dict: "strategy", fitted "peak" Z, "positions" and "sharpnesses" measured (sorted by Z),
+            and the number of stage "moves" and "captures" used.
+    """
+    try:
+        search = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown search strategy: {strategy}")
+    centre = probe.stage.position[2]
+    peak = search(probe, centre, **params)
+    probe.move_to(peak)
+    positions, sharpnesses = probe.history()
+    return {
+        "strategy": strategy,
+        "peak": peak,
+        "positions": positions,
+        "sharpnesses": sharpnesses,
+        "moves": probe.moves,
+        "captures": probe.captures,
+    }
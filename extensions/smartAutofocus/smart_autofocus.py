@@ -1,5 +1,4 @@
 import inspect
-import time
 import numpy as np
 from typing import Callable, Dict, List, Optional, Tuple, cast
 
@@ -15,6 +14,13 @@ from openflexure_microscope.utilities import set_properties
 from openflexure_microscope.devel import abort
 
 from .utils import get_sharpness_function
+from .sweep import sweep_focus
+from .search import STRATEGIES, FocusProbe, SearchAborted, find_focus
+from .pipeline import VideoFrameBuffer, scan_z, summarise_steps
+from .multi_roi import MultiRoiMetric, best_positions, fit_tilt
+from .focus_surface import FocusSurface
+
+FOCUS_SURFACE_PATH = "/var/openflexure/data/smart_autofocus/focus_surface.json"
 
 def find_microscope() -> Microscope:
     """Find and return the connected microscope component, or abort if none found."""
@@ -40,8 +46,9 @@ def extension_action(args=None):
             __doc__ = f"Manage actions for {func.__name__}."
             args = supplied_args
 
-            def post(self, arguments):
-                return func(self.extension, **arguments)
+            def post(self, arguments=None):
+                # Without an args schema LabThings calls post() without arguments
+                return func(self.extension, **(arguments or {}))
 
         ActionViewWrapper.post.description = (
             get_docstring(func, remove_newlines=False) + "\n\nThis POST request starts the action."
@@ -60,9 +67,11 @@ class SmartAutofocusExtension(BaseExtension):
     def __init__(self):
         super().__init__(
             "org.openflexure.smart_autofocus",
-            version="1.1.0",
+            version="1.2.0",
             description="Smart autofocus with ROI support and selectable sharpness metric.",
         )
+        self.focus_surface = FocusSurface(FOCUS_SURFACE_PATH)
+        self.last_step_log: List[dict] = []
         self.add_decorated_method_views()
 
     def add_decorated_method_views(self):
@@ -81,7 +90,11 @@ class SmartAutofocusExtension(BaseExtension):
             "fine_steps": fields.Int(load_default=5),
             "settle": fields.Float(load_default=0.4),
             "metric_name": fields.Str(load_default="laplace4"),
-            "roi": fields.List(fields.Int(), load_default=None, metadata={"description": "ROI as [x, y, width, height]"})
+            "channel": fields.Str(load_default="mean", metadata={"description": "'mean' or 'green' (faster)"}),
+            "downsample": fields.Int(load_default=1),
+            "roi": fields.List(fields.Int(), load_default=None, metadata={"description": "ROI as [x, y, width, height]"}),
+            "mode": fields.Str(load_default="steps", metadata={"description": "'steps', 'sweep' or 'predictive'"}),
+            "pipelined": fields.Bool(load_default=True, metadata={"description": "Compute the metric while the stage moves on"}),
         }
     )
     def smart_autofocus(
@@ -93,13 +106,31 @@ class SmartAutofocusExtension(BaseExtension):
         fine_range: int = 100,
         fine_steps: int = 5,
         metric_name: str = "laplace4",
+        channel: str = "mean",
+        downsample: int = 1,
         roi: Optional[List[int]] = None,
+        mode: str = "steps",
+        pipelined: bool = True,
     ) -> Tuple[List[int], List[float]]:
         """
         Perform a two-stage autofocus routine:
         1. Coarse search: Move the Z-stage across a wide range and sample sharpness.
         2. Fine search: Move in a small range around the coarse maximum, with finer steps.
 
+        In "sweep" mode the stage instead travels once across the coarse range without stopping while
+        frames are grabbed continuously. Each frame's Z is interpolated from its timestamp, a parabola
+        is fitted to the sharpness curve and the stage returns to the peak from below. No settle time is
+        needed, so focusing takes about one traverse.
+
+        In "predictive" mode the stage jumps to the Z predicted by the focus surface (see predict_z) and
+        only the fine search runs. If no prediction is available, or the fine maximum lies at the edge of
+        the fine range, the full coarse and fine search follows.
+
+        With `pipelined`, the sharpness of each frame is computed on a worker thread while the stage
+        moves to the next position. The time spent in each step is available from step_log.
+
+        Every successful focus is recorded in the focus surface.
+
         Args:
             microscope: Microscope object (optional, auto-detected if None)
             settle: Wait time after each movement (seconds)
@@ -108,53 +139,361 @@ class SmartAutofocusExtension(BaseExtension):
             fine_range: Half-width of the fine search range (centered on coarse maximum)
             fine_steps: Distance between positions in the fine search
             metric_name: Name of the sharpness metric to use
+            channel: "mean" of the colour channels or "green" only (faster)
+            downsample: Factor by which the ROI is shrunk before the metric is computed
             roi: Region of interest as [x, y, width, height] (pixels)
+            mode: "steps" for the coarse and fine grid search, "sweep" for a single continuous move,
+                "predictive" for a fine search around the predicted Z
+            pipelined: Overlap the metric computation with the stage moves ("steps" and "predictive")
 
         Returns:
-            Tuple: (List of fine Z-positions, List of fine sharpness values)
+            Tuple: (List of fine Z-positions, List of fine sharpness values); the interpolated Z-positions
+            and sharpness values of the sweep in "sweep" mode
         """
+        if mode not in ("steps", "sweep", "predictive"):
+            abort(400, f"Unknown autofocus mode: {mode}")
         if not microscope:
             microscope = find_microscope_with_real_stage()
         camera: BaseCamera = microscope.camera
         stage: BaseStage = microscope.stage
-        metric_fn = get_sharpness_function(metric_name)
+        try:
+            metric_fn = get_sharpness_function(metric_name, channel=channel, downsample=downsample)
+        except ValueError as e:
+            abort(400, str(e))
+
+        frames = VideoFrameBuffer()
+        if mode == "sweep":
+            with set_properties(stage, backlash=256), stage.lock, camera.lock:
+                result = sweep_focus(
+                    stage,
+                    lambda: self.measure_sharpness(microscope, metric_fn, roi, frames),
+                    coarse_range,
+                    should_stop=lambda: bool(current_action() and current_action().stopped),
+                )
+                if result["peak"] is not None:
+                    self.record_focus(stage, max(result["sharpnesses"]))
+            return result["positions"], result["sharpnesses"]
 
+        self.last_step_log = []
         with set_properties(stage, backlash=256), stage.lock, camera.lock:
-            # --- Coarse scan: search over wide Z-range
-            coarse_dz = np.linspace(-coarse_range, coarse_range, coarse_steps)
-            coarse_positions = []
-            coarse_sharpnesses = []
-            for _ in stage.scan_z(coarse_dz, return_to_start=False):
-                if current_action() and current_action().stopped:
+            fine = None
+            if mode == "predictive":
+                prediction = self.focus_surface.predict(*stage.position[:2])
+                if prediction is not None:
+                    stage.move_rel((0, 0, int(round(prediction["z"])) - stage.position[2]))
+                    fine = self._scan_z(microscope, metric_fn, roi, np.linspace(-fine_range, fine_range, fine_steps), settle, pipelined, frames)
+                    if fine is None:
+                        return [], []
+                    best = int(np.argmax(fine[1]))
+                    if best in (0, len(fine[1]) - 1):
+                        # The focus may lie outside the fine range: fall back to the full search
+                        fine = None
+            if fine is None:
+                # --- Coarse scan: search over wide Z-range
+                coarse = self._scan_z(microscope, metric_fn, roi, np.linspace(-coarse_range, coarse_range, coarse_steps), settle, pipelined, frames)
+                if coarse is None:
                     return [], []
-                time.sleep(settle)
-                sharpness = self.measure_sharpness(microscope, metric_fn, roi)
-                coarse_positions.append(stage.position[2])
-                coarse_sharpnesses.append(sharpness)
-            # Move to best coarse position
-            best_coarse_z = coarse_positions[np.argmax(coarse_sharpnesses)]
-            stage.move_rel((0, 0, best_coarse_z - stage.position[2]))
-            # --- Fine scan: narrow range around coarse maximum
-            fine_dz = np.linspace(-fine_range, fine_range, fine_steps)
-            fine_positions = []
-            fine_sharpnesses = []
-            for _ in stage.scan_z(fine_dz, return_to_start=False):
-                if current_action() and current_action().stopped:
+                coarse_positions, coarse_sharpnesses = coarse
+                # Move to best coarse position
+                best_coarse_z = coarse_positions[np.argmax(coarse_sharpnesses)]
+                stage.move_rel((0, 0, best_coarse_z - stage.position[2]))
+                # --- Fine scan: narrow range around coarse maximum
+                fine = self._scan_z(microscope, metric_fn, roi, np.linspace(-fine_range, fine_range, fine_steps), settle, pipelined, frames)
+                if fine is None:
                     return [], []
-                time.sleep(settle)
-                sharpness = self.measure_sharpness(microscope, metric_fn, roi)
-                fine_positions.append(stage.position[2])
-                fine_sharpnesses.append(sharpness)
+            fine_positions, fine_sharpnesses = fine
             # Move to best fine position
             best_fine_z = fine_positions[np.argmax(fine_sharpnesses)]
             stage.move_rel((0, 0, best_fine_z - stage.position[2]))
+            self.record_focus(stage, max(fine_sharpnesses))
         return fine_positions, fine_sharpnesses
 
+    @extension_action(
+        args={
+            "z_range": fields.Int(load_default=400),
+            "z_steps": fields.Int(load_default=9),
+            "settle": fields.Float(load_default=0.4),
+            "metric_name": fields.Str(load_default="laplace4"),
+            "channel": fields.Str(load_default="mean", metadata={"description": "'mean' or 'green' (faster)"}),
+            "downsample": fields.Int(load_default=2),
+            "rois": fields.List(fields.List(fields.Int()), load_default=None, metadata={"description": "ROIs as [[x, y, width, height], ...]"}),
+            "grid": fields.List(fields.Int(), load_default=[3, 3], metadata={"description": "ROI grid as [rows, columns], used without rois"}),
+        }
+    )
+    def multi_roi_autofocus(
+        self,
+        microscope: Optional[Microscope] = None,
+        z_range: int = 400,
+        z_steps: int = 9,
+        settle: float = 0.4,
+        metric_name: str = "laplace4",
+        channel: str = "mean",
+        downsample: int = 2,
+        rois: Optional[List[List[int]]] = None,
+        grid: Optional[List[int]] = None,
+    ) -> dict:
+        """
+        Focus several ROIs in a single Z scan and fit the tilt of the sample.
+
+        Every frame of the scan is measured in all ROIs at once, so one scan replaces running
+        smart_autofocus once per ROI. The best Z of each ROI is the peak of a parabola fitted around its
+        sharpness maximum; a plane through these gives the tilt. The stage finally moves to the plane's
+        Z at the centre of the frame.
+
+        Args:
+            microscope: Microscope object (optional, auto-detected if None)
+            z_range: Half-width of the scanned Z range (in stage units)
+            z_steps: Number of positions in the scan
+            settle: Wait time after each movement (seconds)
+            metric_name: Name of the sharpness metric to use
+            channel: "mean" of the colour channels or "green" only (faster)
+            downsample: Factor by which the frame is shrunk before the metric is computed
+            rois: Regions of interest as [[x, y, width, height], ...] (pixels)
+            grid: [rows, columns] of a regular ROI grid, used if no rois are given
+
+        Returns:
+            dict: "rois" (clipped to the frame), scanned "positions", "sharpnesses" (one list per ROI),
+            "best_z" of each ROI, the tilt "plane" (see fit_tilt, None with fewer than three ROIs) and the final "z"
+        """
+        if not microscope:
+            microscope = find_microscope_with_real_stage()
+        camera: BaseCamera = microscope.camera
+        stage: BaseStage = microscope.stage
+        try:
+            metric_fn = MultiRoiMetric(metric_name, rois=rois, grid=grid or (3, 3), channel=channel, downsample=downsample)
+        except ValueError as e:
+            abort(400, str(e))
+
+        self.last_step_log = []
+        frames = VideoFrameBuffer()
+        with set_properties(stage, backlash=256), stage.lock, camera.lock:
+            frame_shape = frames.grab(camera).shape
+            try:
+                rois = metric_fn.resolve(frame_shape)
+            except ValueError as e:
+                abort(400, str(e))
+            scan = self._scan_z(
+                microscope, metric_fn, [0, 0, frame_shape[1], frame_shape[0]], np.linspace(-z_range, z_range, z_steps), settle, frames=frames
+            )
+            if scan is None:
+                return {"rois": rois, "positions": [], "sharpnesses": [], "best_z": [], "plane": None, "z": stage.position[2]}
+            positions, sharpnesses = scan
+            sharpnesses = np.asarray(sharpnesses, dtype=float)
+            best_z = best_positions(positions, sharpnesses)
+            plane = fit_tilt(rois, best_z)
+            if plane is not None:
+                target = plane["a"] * frame_shape[1] / 2 + plane["b"] * frame_shape[0] / 2 + plane["c"]
+            else:
+                target = float(np.mean(best_z))
+            stage.move_rel((0, 0, int(round(target)) - stage.position[2]))
+            self.record_focus(stage, float(sharpnesses.mean(axis=1).max()))
+        return {
+            "rois": rois,
+            "positions": positions,
+            "sharpnesses": sharpnesses.T.tolist(),
+            "best_z": best_z,
+            "plane": plane,
+            "z": stage.position[2],
+        }
+
+    def _scan_z(
+        self,
+        microscope: Microscope,
+        metric_fn: Callable,
+        roi: Optional[List[int]],
+        dz: np.ndarray,
+        settle: float,
+        pipelined: bool = True,
+        frames: Optional[VideoFrameBuffer] = None,
+    ):
+        """
+        Measure the sharpness at Z offsets around the current position, appending the steps to last_step_log.
+
+        Returns:
+            Tuple: (List of Z-positions, List of sharpness values), or None if the action was stopped
+        """
+        frames = frames or VideoFrameBuffer()
+        result = scan_z(
+            microscope.stage,
+            lambda: self.grab_roi(microscope, roi, frames),
+            metric_fn,
+            dz,
+            settle,
+            pipelined=pipelined,
+            should_stop=lambda: bool(current_action() and current_action().stopped),
+        )
+        if result is None:
+            return None
+        positions, sharpnesses, log = result
+        self.last_step_log.extend(log)
+        return positions, sharpnesses
+
+    def record_focus(self, stage: BaseStage, metric: float):
+        """Add the current stage position as a successful focus to the focus surface."""
+        x, y, z = stage.position
+        self.focus_surface.add(x, y, z, metric=float(metric))
+
+    @extension_action()
+    def step_log(self) -> dict:
+        """
+        Time spent in each step of the last "steps" or "predictive" autofocus.
+
+        Returns:
+            dict: "steps" with the Z and the move, settle, capture, compute, wait and total step time
+            (seconds) of every step, and "summary" with their means. The summary's "sequential" time is
+            what a step would take without overlapping the metric computation.
+        """
+        return {"steps": self.last_step_log, "summary": summarise_steps(self.last_step_log)}
+
+    @extension_action(
+        args={
+            "x": fields.Int(load_default=None, allow_none=True),
+            "y": fields.Int(load_default=None, allow_none=True),
+        }
+    )
+    def predict_z(self, x: Optional[int] = None, y: Optional[int] = None, microscope: Optional[Microscope] = None) -> dict:
+        """
+        Predict the focus Z at a stage position from the recorded focus positions.
+
+        Args:
+            x: Stage X (defaults to the current position)
+            y: Stage Y (defaults to the current position)
+            microscope: Microscope object (optional, auto-detected if None)
+
+        Returns:
+            dict: Position, predicted "z" (None without recorded focus), fit "kind", number of "inliers" and "rms" residual
+        """
+        if x is None or y is None:
+            if not microscope:
+                microscope = find_microscope_with_real_stage()
+            position = microscope.stage.position
+            x = position[0] if x is None else x
+            y = position[1] if y is None else y
+        prediction = self.focus_surface.predict(x, y) or {"z": None, "kind": None, "inliers": 0, "rms": None}
+        return {"x": x, "y": y, **prediction}
+
+    @extension_action()
+    def clear_focus_surface(self) -> dict:
+        """
+        Forget all recorded focus positions, e.g. after changing the slide.
+
+        Returns:
+            dict: Number of recorded focus positions
+        """
+        self.focus_surface.clear()
+        return {"points": 0}
+
+    @extension_action(
+        args={
+            "strategy": fields.Str(load_default="parabolic", metadata={"description": "'grid', 'parabolic', 'gaussian', 'golden' or 'brent'"}),
+            "coarse_range": fields.Int(load_default=400),
+            "coarse_steps": fields.Int(load_default=5),
+            "fine_range": fields.Int(load_default=100),
+            "fine_steps": fields.Int(load_default=5),
+            "tolerance": fields.Float(load_default=10),
+            "max_iterations": fields.Int(load_default=5),
+            "settle": fields.Float(load_default=0.4),
+            "metric_name": fields.Str(load_default="laplace4"),
+            "channel": fields.Str(load_default="mean", metadata={"description": "'mean' or 'green' (faster)"}),
+            "downsample": fields.Int(load_default=1),
+            "roi": fields.List(fields.Int(), load_default=None, metadata={"description": "ROI as [x, y, width, height]"}),
+        }
+    )
+    def focus_search(
+        self,
+        microscope: Optional[Microscope] = None,
+        strategy: str = "parabolic",
+        coarse_range: int = 400,
+        coarse_steps: int = 5,
+        fine_range: int = 100,
+        fine_steps: int = 5,
+        tolerance: float = 10,
+        max_iterations: int = 5,
+        settle: float = 0.4,
+        metric_name: str = "laplace4",
+        channel: str = "mean",
+        downsample: int = 1,
+        roi: Optional[List[int]] = None,
+    ) -> dict:
+        """
+        Autofocus with a selectable search strategy, reporting the stage moves and captures it used.
+
+        Strategies:
+        - grid: the coarse and fine grid of smart_autofocus (argmax of the fine grid).
+        - parabolic / gaussian: coarse grid, then a parabola (or Gaussian) through the best sample and its
+          neighbours, re-measured at the fitted peak until the peak moves less than `tolerance`.
+        - golden / brent: coarse grid, then golden-section search or Brent's method within the bracket
+          around the best grid position, until the bracket is narrower than `tolerance`.
+
+        Args:
+            microscope: Microscope object (optional, auto-detected if None)
+            strategy: Name of the search strategy
+            coarse_range: Half-width of the coarse search range (in stage units)
+            coarse_steps: Number of positions in the coarse search
+            fine_range: Half-width of the fine search range ("grid" only)
+            fine_steps: Number of positions in the fine search ("grid" only)
+            tolerance: Z accuracy at which the search stops (in stage units)
+            max_iterations: Maximum number of model refinements ("parabolic" and "gaussian" only)
+            settle: Wait time after each movement (seconds)
+            metric_name: Name of the sharpness metric to use
+            channel: "mean" of the colour channels or "green" only (faster)
+            downsample: Factor by which the ROI is shrunk before the metric is computed
+            roi: Region of interest as [x, y, width, height] (pixels)
+
+        Returns:
+            dict: Strategy, fitted peak Z, measured Z-positions and sharpness values, number of moves and captures
+        """
+        if strategy not in STRATEGIES:
+            abort(400, f"Unknown search strategy: {strategy}")
+        if max_iterations < 0:
+            abort(400, "max_iterations must not be negative")
+        if not microscope:
+            microscope = find_microscope_with_real_stage()
+        camera: BaseCamera = microscope.camera
+        stage: BaseStage = microscope.stage
+        try:
+            metric_fn = get_sharpness_function(metric_name, channel=channel, downsample=downsample)
+        except ValueError as e:
+            abort(400, str(e))
+
+        frames = VideoFrameBuffer()
+        with set_properties(stage, backlash=256), stage.lock, camera.lock:
+            probe = FocusProbe(
+                stage,
+                lambda: self.measure_sharpness(microscope, metric_fn, roi, frames),
+                settle=settle,
+                should_stop=lambda: bool(current_action() and current_action().stopped),
+            )
+            try:
+                result = find_focus(
+                    strategy,
+                    probe,
+                    coarse_range=coarse_range,
+                    coarse_steps=coarse_steps,
+                    fine_range=fine_range,
+                    fine_steps=fine_steps,
+                    tolerance=tolerance,
+                    max_iterations=max_iterations,
+                )
+                self.record_focus(stage, max(result["sharpnesses"]))
+                return result
+            except SearchAborted:
+                positions, sharpnesses = probe.history()
+                return {
+                    "strategy": strategy,
+                    "peak": None,
+                    "positions": positions,
+                    "sharpnesses": sharpnesses,
+                    "moves": probe.moves,
+                    "captures": probe.captures,
+                }
+
     def measure_sharpness(
         self,
         microscope: Optional[Microscope] = None,
         metric_fn: Callable = None,
         roi: Optional[List[int]] = None,
+        frames: Optional[VideoFrameBuffer] = None,
     ) -> float:
         """
         Measure image sharpness using the given metric function and ROI.
@@ -163,13 +502,27 @@ class SmartAutofocusExtension(BaseExtension):
             microscope: Microscope object (optional, auto-detected if None)
             metric_fn: Sharpness function, e.g. variance, Laplacian, etc.
             roi: [x, y, width, height] in pixels; if None, center ROI is used
+            frames: Buffer to capture into (see grab_roi)
 
         Returns:
             Calculated sharpness value (float)
         """
         if not microscope:
             microscope = find_microscope_with_real_stage()
-        img = microscope.camera.array(use_video_port=True)
+        return metric_fn(self.grab_roi(microscope, roi, frames))
+
+    @staticmethod
+    def grab_roi(microscope: Microscope, roi: Optional[List[int]] = None, frames: Optional[VideoFrameBuffer] = None) -> np.ndarray:
+        """
+        Grab a video port frame and return the ROI [x, y, width, height], by default the central half.
+
+        With `frames`, the frame is captured into its reused buffer and the ROI is a view that is
+        overwritten by the next grab; otherwise a new frame is allocated.
+        """
+        if frames is not None:
+            img = frames.grab(microscope.camera)
+        else:
+            img = microscope.camera.array(use_video_port=True)
         # If no ROI is given, use the central half of the image
         if roi is None:
             h, w = img.shape[:2]
@@ -177,5 +530,4 @@ class SmartAutofocusExtension(BaseExtension):
             y = h // 4
             roi = [x, y, w // 2, h // 2]
         x, y, w_roi, h_roi = roi
-        img_roi = img[y:y+h_roi, x:x+w_roi]
-        return metric_fn(img_roi)
\ No newline at end of file
+        return img[y:y+h_roi, x:x+w_roi]
\ No newline at end of file
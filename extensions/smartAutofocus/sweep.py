@@ -0,0 +1,152 @@
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+
+class TimedSharpnessRecorder:
+    """
+    Measures sharpness continuously in a background thread, recording when each frame was taken.
+
+    The timestamp of a frame is the start of the measurement: the video port delivers the frame being
+    exposed then, and the time spent computing the metric must not shift it.
+    """
+
+    def __init__(self, measure: Callable[[], float]):
+        """
+        Args:
+            measure (callable): Grabs a frame and returns its sharpness.
+        """
+        self.measure = measure
+        self.times: List[float] = []
+        self.sharpnesses: List[float] = []
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="Autofocus Sweep Recorder", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                sharpness = self.measure()
+            except Exception as e:
+                self._error = e
+                return
+            self.times.append(start)
+            self.sharpnesses.append(sharpness)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def interpolate_z(times: List[float], t_start: float, t_end: float, z_start: float, z_end: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Z of frames taken during a move at constant speed, from the start and end times of the move.
+
+    Returns:
+        tuple: (Z of each frame taken during the move, boolean mask of those frames)
+    """
+    times = np.asarray(times, dtype=float)
+    during = (times >= t_start) & (times <= t_end)
+    duration = max(t_end - t_start, 1e-9)
+    z = z_start + (times[during] - t_start) / duration * (z_end - z_start)
+    return z, during
+
+
+def fit_peak(positions, sharpnesses, fraction: float = 0.5) -> Optional[float]:
+    """
+    Z of the sharpness maximum from a parabola fitted to the samples around the best one.
+
+    Only the contiguous samples around the maximum that reach `fraction` of the peak height above the
+    baseline are used, at least the maximum and its direct neighbours.
+
+    Returns:
+        float: Fitted peak Z, or None if there are too few samples or the fit is not a maximum.
+    """
+    z = np.asarray(positions, dtype=float)
+    s = np.asarray(sharpnesses, dtype=float)
+    order = np.argsort(z)
+    z, s = z[order], s[order]
+    if len(z) < 3:
+        return None
+    best = int(np.argmax(s))
+    threshold = s.min() + fraction * (s[best] - s.min())
+    lo, hi = best, best
+    while lo > 0 and (s[lo - 1] >= threshold or best - lo < 1):
+        lo -= 1
+    while hi < len(s) - 1 and (s[hi + 1] >= threshold or hi - best < 1):
+        hi += 1
+    if hi - lo < 2:
+        return None
+    a, b, _ = np.polyfit(z[lo:hi + 1], s[lo:hi + 1], 2)
+    if a >= 0:
+        return None
+    # Never extrapolate beyond the fitted samples
+    return float(np.clip(-b / (2 * a), z[lo], z[hi]))
+
+
+def sweep_focus(stage, measure: Callable[[], float], half_range: int, should_stop: Optional[Callable[[], bool]] = None) -> dict:
+    """
+    Autofocus by one continuous Z move, measuring sharpness on the fly.
+
+    The stage moves down to the bottom of the range, then travels to the top in a single move while a
+    background thread grabs frames. Each frame's Z is interpolated from its timestamp and the start and
+    end times of the move. The stage finally moves back down to the fitted peak. Both downward moves
+    rely on the stage's backlash compensation (set_properties(stage, backlash=...)), so every position
+    is approached from below, like the positions recorded during the upward sweep.
+
+    Args:
+        stage: Stage with move_rel and position.
+        measure (callable): Grabs a frame and returns its sharpness.
+        half_range (int): Half-width of the sweep around the current Z (stage steps).
+        should_stop (callable, optional): Returns True if the sweep should be aborted before moving to the peak.
+
+    Returns:
+        dict: Interpolated "positions" and "sharpnesses" of the sweep, "peak" Z (None if aborted),
+            "fitted" (False if the argmax had to be used), "frames" and "duration" (s) of the sweep.
+    """
+    z_centre = stage.position[2]
+    z_start, z_end = z_centre - half_range, z_centre + half_range
+    stage.move_rel((0, 0, z_start - z_centre))
+
+    # Frames taken before the move starts or after it ends are discarded by interpolate_z
+    recorder = TimedSharpnessRecorder(measure).start()
+    try:
+        t_start = time.monotonic()
+        stage.move_rel((0, 0, z_end - z_start))
+        t_end = time.monotonic()
+    finally:
+        recorder.stop()
+
+    positions, during = interpolate_z(recorder.times, t_start, t_end, z_start, z_end)
+    sharpnesses = np.asarray(recorder.sharpnesses)[during]
+    result = {
+        "positions": positions.tolist(),
+        "sharpnesses": sharpnesses.tolist(),
+        "peak": None,
+        "fitted": False,
+        "frames": int(len(positions)),
+        "duration": t_end - t_start,
+    }
+    if should_stop and should_stop():
+        return result
+    if len(positions) == 0:
+        # No frame was taken during the move: go back to where we started
+        stage.move_rel((0, 0, z_centre - stage.position[2]))
+        return result
+
+    peak = fit_peak(positions, sharpnesses)
+    result["fitted"] = peak is not None
+    if peak is None:
+        peak = float(positions[int(np.argmax(sharpnesses))])
+    result["peak"] = peak
+    stage.move_rel((0, 0, int(round(peak)) - stage.position[2]))
+    return result
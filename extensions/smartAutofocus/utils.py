@@ -1,50 +1,170 @@
+import functools
+import time
+from typing import Callable, Dict, Optional
+
 import numpy as np
-from scipy import ndimage, fftpack
+import cv2
+from scipy import fft
+
+
+def to_gray(rgb_image: np.ndarray, channel: str = "mean", downsample: int = 1) -> np.ndarray:
+    """
+    Graustufenbild (float32) für die Schärfemetriken.
+
+    Args:
+        rgb_image: Bild (H x W x 3) oder bereits einkanalig (H x W).
+        channel: "mean" für den Mittelwert der Kanäle, "green" für den Grünkanal allein (schneller).
+        downsample: Verkleinerungsfaktor (INTER_AREA), 1 für volle Auflösung.
+    """
+    if rgb_image.ndim == 2:
+        gray = rgb_image
+    elif channel == "green":
+        gray = rgb_image[..., 1]
+    elif channel == "mean":
+        gray = cv2.transform(rgb_image.astype(np.float32, copy=False), np.full((1, 3), 1 / 3, dtype=np.float32))
+    else:
+        raise ValueError(f"Unknown channel: {channel}")
+    gray = np.ascontiguousarray(gray, dtype=np.float32)
+    if downsample > 1:
+        h, w = gray.shape
+        gray = cv2.resize(gray, (max(1, w // downsample), max(1, h // downsample)), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def laplace(gray: np.ndarray) -> np.ndarray:
+    """4-Nachbar-Laplace wie scipy.ndimage.laplace (Rand gespiegelt)."""
+    return cv2.Laplacian(gray, cv2.CV_32F, ksize=1, borderType=cv2.BORDER_REFLECT)
+
+
+def metric_sum_lap2(gray: np.ndarray) -> float:
+    """Original Laplacian-basierte Methode."""
+    lap = laplace(gray)
+    lap *= lap
+    lap *= lap
+    return float(np.mean(lap, dtype=np.float64))
+
+
+def metric_laplace_variance(gray: np.ndarray) -> float:
+    """Varianz des Laplace-Operators."""
+    return float(np.var(laplace(gray), dtype=np.float64))
+
+
+def metric_tenengrad(gray: np.ndarray) -> float:
+    """Tenengrad-Methode basierend auf Sobel-Kanten."""
+    gx = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_REFLECT)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_REFLECT)
+    gx *= gx
+    gy *= gy
+    return float(np.mean(cv2.add(gx, gy), dtype=np.float64))
+
+
+@functools.lru_cache(maxsize=16)
+def fft_weights(shape: tuple, radius: float = 10) -> np.ndarray:
+    """
+    Gewichte für das Spektrum von rfft2 (je Bildgröße einmal berechnet).
+
+    Niedrige Frequenzen innerhalb von `radius` werden ausgeblendet. Spalten, die im Halbspektrum für
+    zwei Spalten des vollen Spektrums stehen, zählen doppelt, sodass die Summe dem Mittelwert über das
+    volle Spektrum (mal Pixelzahl) entspricht.
+    """
+    h, w = shape
+    fy = np.fft.fftfreq(h, 1 / h)[:, None]
+    fx = np.arange(w // 2 + 1)[None, :]
+    # Wie bei fftshift liegt die Nyquist-Frequenz gerader Größen auf der negativen Seite
+    fy = np.where(fy == h / 2, -fy, fy)
+    weights = (np.sqrt(fx ** 2 + fy ** 2) >= radius).astype(np.float32)
+    weights[:, 1:(w + 1) // 2] *= 2
+    weights /= h * w
+    weights.setflags(write=False)
+    return weights
+
+
+def metric_fft_energy(gray: np.ndarray) -> float:
+    """Frequenzbasierte Methode: Hochfrequenzenergie."""
+    spectrum = np.abs(fft.rfft2(gray))
+    return float(np.sum(spectrum * fft_weights(gray.shape), dtype=np.float64))
+
+
+class SharpnessMetric:
+    """Eingetragene Schärfemetrik: Funktion auf einem float32-Graustufenbild und Kosten pro Bild."""
+
+    def __init__(self, name: str, func: Callable[[np.ndarray], float], cost: Optional[float] = None, description: str = ""):
+        """
+        Args:
+            name: Name der Metrik.
+            func: Metrik auf einem Graustufenbild (H x W, float32).
+            cost: Rechenzeit in ms pro Megapixel; wird bei None beim ersten Abruf gemessen.
+            description: Kurzbeschreibung.
+        """
+        self.name = name
+        self.func = func
+        self.description = description
+        self._cost = cost
+
+    @property
+    def cost(self) -> float:
+        """Rechenzeit in ms pro Megapixel."""
+        if self._cost is None:
+            gray = np.random.default_rng(0).random((480, 640), dtype=np.float32) * 255
+            self.func(gray)
+            start = time.perf_counter()
+            for _ in range(5):
+                self.func(gray)
+            self._cost = (time.perf_counter() - start) / 5 * 1000 / (gray.size / 1e6)
+        return self._cost
+
+    def __call__(self, rgb_image: np.ndarray, channel: str = "mean", downsample: int = 1) -> float:
+        return self.func(to_gray(rgb_image, channel, downsample))
+
+
+METRICS: Dict[str, SharpnessMetric] = {}
+
+
+def register_metric(name: str, func: Callable[[np.ndarray], float], cost: Optional[float] = None, description: str = "") -> SharpnessMetric:
+    """Trägt eine Schärfemetrik unter `name` ein (überschreibt eine bestehende gleichen Namens)."""
+    metric = SharpnessMetric(name.lower(), func, cost, description)
+    METRICS[metric.name] = metric
+    return metric
+
+
+register_metric("laplace4", metric_sum_lap2, description="Mittel der 4. Potenz des Laplace-Bildes")
+register_metric("variance", metric_laplace_variance, description="Varianz des Laplace-Bildes")
+register_metric("tenengrad", metric_tenengrad, description="Mittlere quadrierte Sobel-Gradientenstärke")
+register_metric("fft", metric_fft_energy, description="Mittlere Amplitude des Spektrums außerhalb der tiefen Frequenzen")
+
 
 def sharpness_sum_lap2(rgb_image: np.ndarray) -> float:
     """Original Laplacian-basierte Methode."""
-    image_bw = np.mean(rgb_image, axis=2)
-    image_lap = ndimage.laplace(image_bw)
-    return float(np.mean(image_lap.astype(float) ** 4))
+    return metric_sum_lap2(to_gray(rgb_image))
+
 
 def sharpness_laplace_variance(rgb_image: np.ndarray) -> float:
     """Varianz des Laplace-Operators."""
-    image_bw = np.mean(rgb_image, axis=2)
-    lap = ndimage.laplace(image_bw)
-    return float(np.var(lap))
+    return metric_laplace_variance(to_gray(rgb_image))
+
 
 def sharpness_tenengrad(rgb_image: np.ndarray) -> float:
     """Tenengrad-Methode basierend auf Sobel-Kanten."""
-    image_bw = np.mean(rgb_image, axis=2)
-    gx = ndimage.sobel(image_bw, axis=0)
-    gy = ndimage.sobel(image_bw, axis=1)
-    g2 = gx ** 2 + gy ** 2
-    return float(np.mean(g2))
+    return metric_tenengrad(to_gray(rgb_image))
+
 
 def sharpness_fft_energy(rgb_image: np.ndarray) -> float:
     """Frequenzbasierte Methode: Hochfrequenzenergie."""
-    image_bw = np.mean(rgb_image, axis=2)
-    f = fftpack.fft2(image_bw)
-    fshift = fftpack.fftshift(f)
-    magnitude_spectrum = np.abs(fshift)
-    center = np.array(magnitude_spectrum.shape) // 2
-    mask = np.ones_like(magnitude_spectrum)
-    r = 10  # Radius des Zentrums, das ignoriert wird (Niedrigfrequenz)
-    Y, X = np.ogrid[:mask.shape[0], :mask.shape[1]]
-    dist = np.sqrt((X - center[1]) ** 2 + (Y - center[0]) ** 2)
-    mask[dist < r] = 0
-    return float(np.mean(magnitude_spectrum * mask))
-
-def get_sharpness_function(name: str):
-    """Gibt die entsprechende Schärfefunktion basierend auf dem Namen zurück."""
-    name = name.lower()
-    if name == "laplace4":
-        return sharpness_sum_lap2
-    elif name == "variance":
-        return sharpness_laplace_variance
-    elif name == "tenengrad":
-        return sharpness_tenengrad
-    elif name == "fft":
-        return sharpness_fft_energy
-    else:
-        raise ValueError(f"Unknown sharpness metric: {name}")
\ No newline at end of file
+    return metric_fft_energy(to_gray(rgb_image))
+
+
+def get_sharpness_function(name: str, channel: str = "mean", downsample: int = 1):
+    """
+    Gibt die entsprechende Schärfefunktion basierend auf dem Namen zurück.
+
+    Args:
+        name: Name einer eingetragenen Metrik (siehe METRICS).
+        channel: "mean" oder "green" (schneller, nur Grünkanal).
+        downsample: Verkleinerungsfaktor des Bildausschnitts vor der Messung.
+    """
+    metric = METRICS.get(name.lower())
+    if metric is None:
+        raise ValueError(f"Unknown sharpness metric: {name}")
+    if channel not in ("mean", "green"):
+        raise ValueError(f"Unknown channel: {channel}")
+    return functools.partial(metric, channel=channel, downsample=max(1, downsample))
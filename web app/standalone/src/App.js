@@ -106,7 +106,8 @@ function App() {
           />
           <div className="minimap">
             <ImageDisplay
-              imageUrlBase={`http://${API_IP}:5000/api/v2/extensions/de.hs-flensburg.mini-map/map`}
+              mapUrlBase={`http://${API_IP}:5000/api/v2/extensions/de.hs-flensburg.mini-map`}
+              websocketUrl={`ws://${API_IP}:6789`}
               updateInterval={3000}
               showGalleryMenu={showGalleryMenu}
               showAutofocusMenu={showAutofocusMenu}
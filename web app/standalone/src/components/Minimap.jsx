@@ -1,46 +1,193 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 
 /**
- * 
- * @param {str} imageUrlBase - Image Url
- * @param {number} updateInterval - Update interval for minimap
+ * Minimap built from the tile pyramid of the mini map extension.
+ * Subscribes to "map" events on the websocket server, which carry the new map version and the rectangle that
+ * changed, and only re-downloads the tiles in that rectangle; unchanged tiles stay in the browser cache.
+ * The manifest is fetched on (re)connect and when events were missed, and polled while the websocket is down.
+ *
+ * @param {str} mapUrlBase - Url of the mini map extension
+ * @param {str} websocketUrl - Url of the websocket server publishing map events
+ * @param {number} updateInterval - Update interval for minimap while the websocket is not connected
  * @param {boolean} showAutofocusMenu -
  * @param {boolean} showGalleryMenu -
- * @returns 
+ * @returns
  */
 
 function ImageDisplay({
-  imageUrlBase,
+  mapUrlBase,
+  websocketUrl,
   updateInterval,
   showAutofocusMenu,
   showGalleryMenu,
 }) {
-  const [imageUrl, setImageUrl] = useState(
-    `${imageUrlBase}?${new Date().getTime()}`
-  );
+  const [map, setMap] = useState(null); // { version, tileSize, levels, bounds, tiles: { "z/x/y": version } }
+  const containerRef = useRef(null);
 
   useEffect(() => {
     if (!showAutofocusMenu && !showGalleryMenu) {
-      const intervalId = setInterval(() => {
-        setImageUrl(`${imageUrlBase}?${new Date().getTime()}`);
-      }, updateInterval);
-      console.log("minimap active:", imageUrlBase);
+      let version = 0;
+      let tileSize = null;
+      let levels = 0;
+      let cancelled = false;
+      let ws = null;
+      let intervalId = null;
+      let reconnectId = null;
+
+      const update = () => {
+        const since = version;
+        fetch(`${mapUrlBase}/manifest?since=${since}`)
+          .then((res) => res.json())
+          .then((manifest) => {
+            if (cancelled) return;
+            if (manifest.version < since) {
+              /**server restarted: fetch the whole manifest again*/
+              version = 0;
+              update();
+              return;
+            }
+            if (manifest.version <= version) return; /**already up to date, e.g. by events*/
+            const full = since === 0;
+            version = manifest.version;
+            tileSize = manifest.tile_size;
+            levels = manifest.levels;
+            setMap((previous) => ({
+              version: manifest.version,
+              tileSize: manifest.tile_size,
+              levels: manifest.levels,
+              bounds: manifest.bounds,
+              tiles: {
+                ...(full || !previous ? {} : previous.tiles),
+                ...manifest.tiles,
+              },
+            }));
+          })
+          .catch((err) => console.error("Minimap update failed:", err));
+      };
+
+      const applyEvent = (event) => {
+        if (event.version <= version) return; /**stale event*/
+        if (!tileSize || event.version > version + 1) {
+          /**missed events: catch up from the manifest*/
+          update();
+          return;
+        }
+        /**the dirty rectangle covers whole level 0 tiles, so it tells the changed tiles of every level*/
+        const [x0, y0, x1, y1] = event.dirty;
+        const changed = {};
+        for (let z = 0; z < levels; z++) {
+          const span = tileSize * 2 ** z;
+          for (let x = Math.floor(x0 / span); x <= Math.floor((x1 - 1) / span); x++) {
+            for (let y = Math.floor(y0 / span); y <= Math.floor((y1 - 1) / span); y++) {
+              changed[`${z}/${x}/${y}`] = event.version;
+            }
+          }
+        }
+        version = event.version;
+        setMap((previous) => ({
+          ...previous,
+          version: event.version,
+          bounds: event.bounds,
+          tiles: { ...previous.tiles, ...changed },
+        }));
+      };
+
+      const startPolling = () => {
+        if (intervalId === null) intervalId = setInterval(update, updateInterval);
+      };
+      const stopPolling = () => {
+        clearInterval(intervalId);
+        intervalId = null;
+      };
+
+      const connectWebsocket = () => {
+        ws = new WebSocket(websocketUrl);
+        ws.onopen = () => {
+          ws.send(JSON.stringify({ subscribe: ["map"], unsubscribe: ["input"] }));
+          stopPolling();
+          update(); /**catch up with changes while disconnected*/
+        };
+        ws.onmessage = (message) => {
+          try {
+            const data = JSON.parse(message.data);
+            if (data.topic === "map") applyEvent(data);
+          } catch (error) {
+            console.error("Error parsing map event", error);
+          }
+        };
+        ws.onclose = () => {
+          if (cancelled) return;
+          startPolling();
+          reconnectId = setTimeout(connectWebsocket, 5000);
+        };
+      };
 
-      return () => clearInterval(intervalId);
+      update();
+      startPolling();
+      connectWebsocket();
+      console.log("minimap active:", mapUrlBase);
+
+      return () => {
+        cancelled = true;
+        stopPolling();
+        clearTimeout(reconnectId);
+        if (ws) {
+          ws.onclose = null;
+          ws.close();
+        }
+      };
     } else {
       console.log("minimap deactivated");
     }
-  }, [imageUrlBase, updateInterval, showAutofocusMenu, showGalleryMenu]); /**useEffect runs again when value has been changed*/
+  }, [mapUrlBase, websocketUrl, updateInterval, showAutofocusMenu, showGalleryMenu]); /**useEffect runs again when value has been changed*/
+
+  const hidden = showAutofocusMenu || showGalleryMenu;
+  if (!map || !map.bounds) {
+    return <div ref={containerRef} style={{ display: hidden ? "none" : "block" }} />;
+  }
+
+  const [x0, y0, x1, y1] = map.bounds;
+  const width = x1 - x0;
+  const height = y1 - y0;
+
+  /**coarsest level that still has about one map pixel per screen pixel*/
+  const displayWidth = containerRef.current ? containerRef.current.clientWidth : 300;
+  let level = 0;
+  while (level < map.levels - 1 && width / 2 ** (level + 1) >= displayWidth) {
+    level += 1;
+  }
+  const span = map.tileSize * 2 ** level; /**map pixels covered by one tile of this level*/
+
+  const tiles = Object.entries(map.tiles)
+    .map(([key, version]) => [key.split("/").map(Number), version])
+    .filter(([[z]]) => z === level);
 
   return (
-    <img
-      src={imageUrl}
-      alt="Mini Map"
+    <div
+      ref={containerRef}
       style={{
-        maxWidth: "100%",
-        display: showAutofocusMenu || showGalleryMenu ? "none" : "block", /**only shows minimap if menus aren't open*/
+        position: "relative",
+        width: "100%",
+        aspectRatio: `${width} / ${height}`,
+        overflow: "hidden",
+        display: hidden ? "none" : "block", /**only shows minimap if menus aren't open*/
       }}
-    />
+    >
+      {tiles.map(([[z, x, y], version]) => (
+        <img
+          key={`${z}/${x}/${y}`}
+          src={`${mapUrlBase}/tiles/${z}/${x}/${y}?v=${version}`}
+          alt=""
+          style={{
+            position: "absolute",
+            left: `${((x * span - x0) / width) * 100}%`,
+            top: `${((y * span - y0) / height) * 100}%`,
+            width: `${(span / width) * 100}%`,
+            height: `${(span / height) * 100}%`,
+          }}
+        />
+      ))}
+    </div>
   );
 }
 